@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Backup, restore, cleanup and menu benchmark
+
+Runs the extension's hot paths headless against synthetic workloads and
+reports throughput, latency percentiles and peak RSS:
+
+    large-file    one 5 GiB file, half random and half text: backup, restore
+    tiny-files    1,000,000 files of 64-512 bytes in 1,000 folders: backup, restore
+    deep-tree     100 chains of 64 nested folders, 4 files each: backup, restore
+    many-backups  a folder holding 10,000 backups of 100 files: first and later
+                  history lookups, View Backups, the menu of a backup, Restore,
+                  and a keep-last-10 cleanup
+
+Backups go through the scheduler and BackupCore like the extension's, with
+its default settings. Each scenario runs in a fresh interpreter, so the peak
+RSS reported is its own. The first three workloads are generated once into
+--data and reused; --scale shrinks every workload (0.01 takes a minute or
+two). large-file needs about three times its size in free disk space.
+
+Save a run as a baseline and compare later runs against it:
+    python3 benchmarks/bench_backup.py --save benchmarks/baselines/laptop.json
+    python3 benchmarks/bench_backup.py --compare benchmarks/baselines/laptop.json --check
+
+Usage:
+    python3 benchmarks/bench_backup.py [--scenarios large-file,tiny-files,deep-tree,many-backups]
+        [--scale 1] [--runs 3] [--repeat 200] [--data DIR] [--json]
+
+Uses the real Nautilus bindings when they are installed, otherwise the
+stand-ins from bench_menu.py.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bench_menu import FakeFileInfo, load_extension, percentile
+
+SCENARIOS = ("large-file", "tiny-files", "deep-tree", "many-backups")
+DEFAULT_DATA = Path(tempfile.gettempdir()) / "nautilus-backup-bench-data"
+MB = 1024 * 1024
+
+# Full-size workloads (--scale multiplies the sizes and counts)
+LARGE_FILE_SIZE = 5 * 1024 * MB
+TINY_FILES = 1_000_000
+TINY_FILES_PER_FOLDER = 1000
+DEEP_CHAINS = 100
+DEEP_DEPTH = 64
+DEEP_FILES_PER_LEVEL = 4
+BACKED_UP_FILES = 100
+BACKUPS_PER_FILE = 100
+CLEANUP_KEEP_LAST = 10
+
+
+# ---------------------------------------------------------------------------
+# Workloads
+# ---------------------------------------------------------------------------
+
+def workload_spec(scenario, scale):
+    """What to generate for a scenario at a scale (also the cache key)"""
+    if scenario == "large-file":
+        return {"size": max(MB, int(LARGE_FILE_SIZE * scale) // MB * MB)}
+    if scenario == "tiny-files":
+        return {"files": max(TINY_FILES_PER_FOLDER, int(TINY_FILES * scale))}
+    if scenario == "deep-tree":
+        return {"chains": max(1, round(DEEP_CHAINS * scale)), "depth": DEEP_DEPTH}
+    return {"files": max(1, round(BACKED_UP_FILES * scale)), "backups": BACKUPS_PER_FILE}
+
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little")
+
+
+def generate_large_file(path, size):
+    rng = random.Random(1)
+    text = (b"The quick brown fox jumps over the lazy dog. " * (MB // 45 + 1))[:MB]
+    with open(path, "wb") as f:
+        for block in range(size // MB):
+            f.write(random_bytes(rng, MB) if block % 2 else text)
+
+
+def generate_tiny_files(root, count):
+    rng = random.Random(2)
+    for first in range(0, count, TINY_FILES_PER_FOLDER):
+        folder = root / f"{first // TINY_FILES_PER_FOLDER:04}"
+        folder.mkdir()
+        for i in range(first, min(count, first + TINY_FILES_PER_FOLDER)):
+            (folder / f"message-{i:07}.eml").write_bytes(random_bytes(rng, rng.randint(64, 512)))
+
+
+def generate_deep_tree(root, chains, depth):
+    rng = random.Random(3)
+    for chain in range(chains):
+        folder = root / f"branch-{chain:03}"
+        for level in range(depth):
+            folder = folder / f"level-{level:02}"
+            folder.mkdir(parents=True)
+            for i in range(DEEP_FILES_PER_LEVEL):
+                (folder / f"module-{i}.py").write_bytes(random_bytes(rng, rng.randint(1024, 4096)))
+
+
+def prepare_workload(data_dir, scenario, spec):
+    """Source to back up for a scenario, generated unless an identical one is cached"""
+    root = data_dir / scenario
+    source = root / {"large-file": "disk.img", "tiny-files": "Mail", "deep-tree": "project"}[scenario]
+    marker = root / "workload.json"
+    try:
+        if json.loads(marker.read_text()) == spec:
+            return source
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    if scenario == "large-file":
+        free = shutil.disk_usage(root).free
+        if free < 3 * spec["size"]:
+            sys.exit(f"large-file needs {3 * spec['size'] // MB} MB free in {root}, "
+                     f"{free // MB} MB available (try --scale or --data)")
+    print(f"Generating {scenario} workload in {root}...", file=sys.stderr)
+    start = time.monotonic()
+    if scenario == "large-file":
+        generate_large_file(source, spec["size"])
+    elif scenario == "tiny-files":
+        source.mkdir()
+        generate_tiny_files(source, spec["files"])
+    else:
+        source.mkdir()
+        generate_deep_tree(source, spec["chains"], spec["depth"])
+    marker.write_text(json.dumps(spec))
+    print(f"  done in {time.monotonic() - start:.1f}s", file=sys.stderr)
+    return source
+
+
+def generate_backup_folder(folder, files, backups):
+    """Files with `backups` dated backups each, named like the extension names them"""
+    folder.mkdir(parents=True)
+    newest = datetime(2025, 6, 1, 12, 0, 0)
+    sources = []
+    for i in range(files):
+        source = folder / f"notes-{i:03}.txt"
+        source.write_text(f"notes {i}\n" * 64)
+        sources.append(source)
+        for age in range(backups):
+            stamp = newest - timedelta(hours=age, seconds=i)
+            backup = folder / f"{source.stem}_backup_{stamp:%Y-%m-%d_%H-%M-%S}{source.suffix}"
+            backup.write_text(f"notes {i} version {backups - age}\n" * 64)
+            os.utime(backup, (stamp.timestamp(), stamp.timestamp()))
+    return sources
+
+
+def tree_size(path):
+    """(bytes, files) under path"""
+    if path.is_file():
+        return path.stat().st_size, 1
+    size = files = 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for name in filenames:
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+            files += 1
+    return size, files
+
+
+# ---------------------------------------------------------------------------
+# Measurement (in the child interpreter)
+# ---------------------------------------------------------------------------
+
+def peak_rss():
+    """Peak resident set size of this process so far, in bytes"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Recorder:
+    """Collects per-operation samples: seconds, work done and peak RSS"""
+
+    def __init__(self):
+        self.ops = {}
+
+    def time(self, op, func, size=0, files=0):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        entry = self.ops.setdefault(op, {"seconds": [], "bytes": size, "files": files})
+        entry["seconds"].append(elapsed)
+        entry["peak_rss"] = peak_rss()
+        return result
+
+
+def run_job(core, func, description, destination):
+    """Run func(job) on the scheduler like the extension does, return its result"""
+    done = threading.Event()
+    job = core.scheduler.submit(func, description, destination, on_done=lambda job: done.set())
+    done.wait()
+    if job.state != "done":
+        raise RuntimeError(f"{description}: {job.error or job.state}")
+    return job.result
+
+
+def bench_backup_restore(ext, source, scratch, runs, recorder):
+    """Back up source and restore it, runs times"""
+    core = ext.core
+    size, files = tree_size(source)
+    backups = scratch / "backups"
+    restored = scratch / "restored"
+    for _ in range(runs):
+        backups.mkdir()
+        destination = backups / core.generate_backup_name(source)
+
+        def backup():
+            success, error = run_job(core, lambda job: core.create_backup(source, destination, job)[:2],
+                                     source.name, destination)
+            if not success:
+                raise RuntimeError(f"Backup of {source} failed: {error}")
+
+        def restore():
+            return run_job(core, lambda job: (core.restore(destination, restored, job.checkpoint), None),
+                           f"Restore {destination.name}", restored)
+
+        recorder.time("backup", backup, size, files)
+        recorder.time("restore", restore, size, files)
+        # Only the steps above are timed
+        shutil.rmtree(restored)
+        shutil.rmtree(backups)
+
+
+def bench_many_backups(ext, module, spec, scratch, runs, repeat, recorder):
+    """History lookups, View Backups, menu, Restore and cleanup in a crowded folder"""
+    core = ext.core
+    core._schedule_retention = lambda: None  # prune_pending() is called directly
+    nautilus_args = (lambda files: (None, files)) if module.NAUTILUS_VERSION == 3 else (lambda files: (files,))
+    rng = random.Random(4)
+    for run in range(runs):
+        folder = scratch / f"run-{run}" / "Documents"
+        sources = generate_backup_folder(folder, spec["files"], spec["backups"])
+        total = spec["files"] * spec["backups"]
+
+        # The first lookup indexes the folder
+        recorder.time("history (first)", lambda: core.find_backups(folder, sources[0].name), files=total)
+        for _ in range(repeat):
+            source = rng.choice(sources)
+            recorder.time("history", lambda: core.find_backups(folder, source.name), files=spec["backups"])
+        for _ in range(repeat):
+            selection = [FakeFileInfo(rng.choice(sources).as_uri())]
+            recorder.time("view backups", lambda: ext.view_backups(None, selection), files=spec["backups"])
+        backups = core.find_backups(folder, sources[0].name)
+        for _ in range(repeat):
+            selection = [FakeFileInfo(rng.choice(backups).as_uri())]
+            recorder.time("menu (backup)", lambda: ext.get_file_items(*nautilus_args(selection)))
+        for _ in range(min(repeat, 50)):
+            backup = rng.choice(backups)
+            recorder.time("restore", lambda: ext.restore_backup(None, [FakeFileInfo(backup.as_uri())]),
+                          size=backup.stat().st_size, files=1)
+
+        core.max_backups = CLEANUP_KEEP_LAST
+        core.cleanup_old_backups(backups[0])
+        deleted = recorder.time("cleanup", core.prune_pending, files=total)
+        expected = spec["files"] * max(0, spec["backups"] - CLEANUP_KEEP_LAST)
+        if deleted != expected:
+            raise RuntimeError(f"Cleanup deleted {deleted} backups, expected {expected}")
+        core.max_backups = None
+
+
+def child(scenario, data_dir, runs, repeat, scale):
+    """Run one scenario in this (fresh) interpreter and print its samples as JSON"""
+    scratch = Path(os.environ["HOME"])
+    module = load_extension()
+    # View Backups opens a file manager window
+    module.subprocess = types.SimpleNamespace(Popen=lambda *args, **kwargs: None)
+    ext = module.BackupExtension()
+    # Notifications are still queued, just never shown
+    ext.notifications._send = lambda *args: 0
+    ext.core  # loaded before timing starts, as after the first right-click
+    started_rss = peak_rss()
+
+    recorder = Recorder()
+    spec = workload_spec(scenario, scale)
+    if scenario == "many-backups":
+        bench_many_backups(ext, module, spec, scratch, runs, repeat, recorder)
+    else:
+        source = prepare_workload(data_dir, scenario, spec)
+        bench_backup_restore(ext, source, scratch, runs, recorder)
+    ext.core.close()
+
+    json.dump({"ops": recorder.ops, "started_rss": started_rss, "peak_rss": peak_rss()}, sys.stdout)
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def summarize(raw):
+    """Samples of one scenario -> reported numbers"""
+    ops = {}
+    for op, entry in raw["ops"].items():
+        samples = entry["seconds"]
+        median = statistics.median(samples)
+        ops[op] = {
+            "runs": len(samples),
+            "p50_ms": median * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "max_ms": max(samples) * 1000,
+            "mb_per_s": entry["bytes"] / MB / median if entry["bytes"] and median else None,
+            "files_per_s": entry["files"] / median if entry["files"] and median else None,
+            "peak_rss_mb": entry["peak_rss"] / MB,
+        }
+    return {"started_rss_mb": raw["started_rss"] / MB, "peak_rss_mb": raw["peak_rss"] / MB, "ops": ops}
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def print_report(report, baseline=None):
+    def number(value, spec):
+        return format(value, spec) if value is not None else format("-", spec.split(".")[0])
+
+    header = (f"{'scenario':13} {'operation':16} {'runs':>5} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} "
+              f"{'MB/s':>8} {'files/s':>10} {'RSS MB':>7}")
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header)
+    for scenario, result in report["scenarios"].items():
+        for op, stats in result["ops"].items():
+            line = (f"{scenario:13} {op:16} {stats['runs']:>5} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} "
+                    f"{stats['max_ms']:>10.2f} {number(stats['mb_per_s'], '>8.1f')} "
+                    f"{number(stats['files_per_s'], '>10.0f')} {stats['peak_rss_mb']:>7.1f}")
+            if baseline:
+                change = p50_change(baseline, scenario, op, stats)
+                line += f" {change:>+7.0%}" if change is not None else f" {'new':>8}"
+            print(line)
+        print(f"{scenario:13} {'(peak RSS)':16} {'':>5} {'':>10} {'':>10} {'':>10} {'':>8} {'':>10} "
+              f"{result['peak_rss_mb']:>7.1f}")
+
+
+def p50_change(baseline, scenario, op, stats):
+    """Relative change of the median latency against the baseline, or None"""
+    try:
+        before = baseline["scenarios"][scenario]["ops"][op]["p50_ms"]
+    except KeyError:
+        return None
+    return stats["p50_ms"] / before - 1 if before else None
+
+
+def regressions(report, baseline, tolerance):
+    """(scenario, operation, change) for every operation slower than the baseline by more than tolerance"""
+    slower = []
+    for scenario, result in report["scenarios"].items():
+        for op, stats in result["ops"].items():
+            change = p50_change(baseline, scenario, op, stats)
+            if change is not None and change > tolerance:
+                slower.append((scenario, op, change))
+    return slower
+
+
+def run(args):
+    data_dir = Path(args.data)
+    report = {"machine": machine_info(), "scale": args.scale, "runs": args.runs, "repeat": args.repeat,
+              "scenarios": {}}
+    for scenario in args.scenarios:
+        if scenario != "many-backups":
+            # Generated here so the child's peak RSS is the benchmark's alone
+            prepare_workload(data_dir, scenario, workload_spec(scenario, args.scale))
+        print(f"Running {scenario}...", file=sys.stderr)
+        with tempfile.TemporaryDirectory(prefix="nautilus-backup-bench-", dir=args.scratch) as home:
+            # Settings, catalog and Backups folder of this run only
+            env = dict(os.environ, HOME=home)
+            result = subprocess.run(
+                [sys.executable, __file__, "--child", scenario, "--data", str(data_dir),
+                 "--runs", str(args.runs), "--repeat", str(args.repeat), "--scale", str(args.scale)],
+                env=env, capture_output=True, text=True
+            )
+        if result.returncode != 0:
+            # The extension's log is only worth reading when something failed
+            sys.stderr.write(result.stderr)
+            sys.exit(f"{scenario} failed")
+        report["scenarios"][scenario] = summarize(json.loads(result.stdout))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated scenarios (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--scale", type=float, default=1.0, help="workload size factor (default: 1, full size)")
+    parser.add_argument("--runs", type=int, default=3, help="backups and restores per scenario")
+    parser.add_argument("--repeat", type=int, default=200, help="calls per latency measurement")
+    parser.add_argument("--data", default=str(DEFAULT_DATA), help=f"generated workloads (default: {DEFAULT_DATA})")
+    parser.add_argument("--scratch", help="where backups and restores are written (default: system temp folder)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--save", metavar="FILE", help="save the report as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="show the change against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed median slowdown against the baseline (default: 0.25)")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if an operation is slower than the baseline by more than --tolerance")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, Path(args.data), args.runs, args.repeat, args.scale)
+        sys.exit(0)
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if args.check and not args.compare:
+        parser.error("--check needs --compare")
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    report = run(args)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_report(report, baseline)
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nBaseline saved to {args.save}", file=sys.stderr)
+
+    if baseline and baseline.get("scale") != args.scale:
+        print(f"\nNote: the baseline was run at --scale {baseline.get('scale')}", file=sys.stderr)
+    if args.check:
+        slower = regressions(report, baseline, args.tolerance)
+        for scenario, op, change in slower:
+            print(f"Slower than baseline: {scenario} {op} {change:+.0%}", file=sys.stderr)
+        if slower:
+            sys.exit("Performance regressed")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Context menu latency benchmark
+
+Times BackupExtension.get_file_items() for growing selections. The latency
+should stay flat: only the first selected file is ever inspected and the
+menu items are the same dozen whatever the selection size.
+
+Usage:
+    python3 benchmarks/bench_menu.py [--sizes 1,2,100,1000,20000] [--repeat 300] [--check]
+
+Uses the real Nautilus bindings when they are installed, otherwise minimal
+stand-ins so the extension's own cost is what gets measured.
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+EXTENSION = Path(__file__).resolve().parent.parent / "nautilus-backup.py"
+
+
+def install_gi_stand_ins():
+    """Fake just enough of gi.repository for the extension to import"""
+    class MenuItem:
+        def __init__(self, name='', label='', tip='', **kwargs):
+            self.props = {'name': name, 'label': label, 'tip': tip}
+
+        def connect(self, signal, callback, *args):
+            return 0
+
+        def set_property(self, name, value):
+            self.props[name] = value
+
+        def set_submenu(self, menu):
+            self.submenu = menu
+
+    class Menu:
+        def __init__(self):
+            self.items = []
+
+        def append_item(self, item):
+            self.items.append(item)
+
+    class GObject:
+        pass
+
+    class MenuProvider:
+        pass
+
+    class Anything:
+        def __getattr__(self, name):
+            return Anything()
+
+        def __call__(self, *args, **kwargs):
+            return Anything()
+
+    repository = types.ModuleType("gi.repository")
+    repository.Nautilus = types.SimpleNamespace(Menu=Menu, MenuItem=MenuItem, MenuProvider=MenuProvider)
+    repository.GObject = types.SimpleNamespace(GObject=GObject)
+    repository.Gtk = repository.Gio = repository.GLib = Anything()
+
+    gi = types.ModuleType("gi")
+    gi.require_version = lambda name, version: None
+    gi.repository = repository
+    sys.modules["gi"] = gi
+    sys.modules["gi.repository"] = repository
+
+
+def load_extension():
+    try:
+        import gi  # noqa: F401
+    except ImportError:
+        install_gi_stand_ins()
+
+    spec = importlib.util.spec_from_file_location("nautilus_backup", EXTENSION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeFileInfo:
+    """Stands in for Nautilus.FileInfo: the extension only asks for the URI"""
+
+    def __init__(self, uri):
+        self.uri = uri
+
+    def get_uri(self):
+        return self.uri
+
+
+def measure(ext, files, repeat, nautilus_version):
+    """Per-call latencies in microseconds"""
+    call = ext.get_file_items
+    args = (None, files) if nautilus_version == 3 else (files,)
+    call(*args)  # warm up (loads the backup core)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call(*args)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,2,100,1000,20000", help="selection sizes to time")
+    parser.add_argument("--repeat", type=int, default=300, help="calls per selection size")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if the largest selection is over 3x slower than a 2-file one")
+    args = parser.parse_args()
+
+    # Keep the extension's config and ~/Backups out of the real home folder
+    with tempfile.TemporaryDirectory(prefix="nautilus-backup-bench-") as home:
+        os.environ["HOME"] = home
+        ext_module = load_extension()
+        ext = ext_module.BackupExtension()
+
+        sizes = [int(size) for size in args.sizes.split(",")]
+        results = {}
+        print(f"{'files':>8} {'p50 µs':>10} {'p95 µs':>10} {'max µs':>10}")
+        for size in sizes:
+            files = [FakeFileInfo(f"file:///home/user/Documents/report%20{i}.txt") for i in range(size)]
+            samples = measure(ext, files, args.repeat, ext_module.NAUTILUS_VERSION)
+            results[size] = statistics.median(samples)
+            print(f"{size:>8} {results[size]:>10.1f} {percentile(samples, 0.95):>10.1f} {max(samples):>10.1f}")
+
+        if args.check:
+            multi = [size for size in sizes if size > 1]
+            if len(multi) >= 2:
+                ratio = results[max(multi)] / results[min(multi)]
+                print(f"\n{max(multi)} vs {min(multi)} files: {ratio:.2f}x")
+                if ratio > 3:
+                    sys.exit("Menu latency grows with the selection size")
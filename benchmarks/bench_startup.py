@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Extension startup benchmark
+
+Times what every Nautilus start pays for the extension: importing
+nautilus-backup.py and constructing BackupExtension, each run in a fresh
+interpreter. Also times the first context menu, which is where the backup
+core is loaded, and reports whether startup loaded the core's heavy
+imports or created the backup folder.
+
+Usage:
+    python3 benchmarks/bench_startup.py [--runs 20] [--check]
+
+Uses the real Nautilus bindings when they are installed, otherwise the
+stand-ins from bench_menu.py.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_menu import FakeFileInfo, load_extension, percentile
+
+# Modules that only the backup core needs
+HEAVY_MODULES = ("tarfile", "sqlite3", "lzma", "shutil", "subprocess", "zstandard")
+
+
+def child():
+    """One measurement in this (fresh) interpreter, printed as JSON"""
+    home = Path(os.environ["HOME"])
+    already_loaded = set(sys.modules)
+    start = time.perf_counter()
+    module = load_extension()
+    imported = time.perf_counter()
+    ext = module.BackupExtension()
+    constructed = time.perf_counter()
+    # Lazily imported modules sit in sys.modules before their code has run
+    heavy = [name for name in HEAVY_MODULES if name not in already_loaded and name in sys.modules
+             and type(sys.modules[name]).__name__ == "module"]
+    backups_created = (home / "Backups").exists()
+
+    # First right-click: loads the core
+    document = home / "report.txt"
+    document.write_text("report")
+    files = [FakeFileInfo(document.as_uri())]
+    menu_start = time.perf_counter()
+    ext.get_file_items(*((None, files) if module.NAUTILUS_VERSION == 3 else (files,)))
+    menu_done = time.perf_counter()
+
+    json.dump({
+        "import_ms": (imported - start) * 1000,
+        "construct_ms": (constructed - imported) * 1000,
+        "first_menu_ms": (menu_done - menu_start) * 1000,
+        "heavy_modules": heavy,
+        "backups_created": backups_created,
+    }, sys.stdout)
+
+
+def run(runs):
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="nautilus-backup-bench-") as home:
+            # Settings as a typical install has them
+            config_dir = Path(home) / ".config" / "nautilus-backup"
+            config_dir.mkdir(parents=True)
+            (config_dir / "config.txt").write_text(str(Path(home) / "Backups"))
+            (config_dir / "cleanup.txt").write_text("10")
+            (config_dir / "stats.txt").write_text(json.dumps({"total_backups": 1000, "total_size": 1 << 30}))
+
+            env = dict(os.environ, HOME=home)
+            output = subprocess.run([sys.executable, __file__, "--child"], env=env, capture_output=True,
+                                    text=True, check=True).stdout
+            results.append(json.loads(output))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="fresh interpreters to time")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if startup loads the backup core or touches the backup folder")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        sys.exit(0)
+
+    results = run(args.runs)
+    print(f"{'':16} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for key, label in (("import_ms", "import"), ("construct_ms", "construct"), ("first_menu_ms", "first menu")):
+        samples = [r[key] for r in results]
+        print(f"{label:16} {statistics.median(samples):>8.2f} {percentile(samples, 0.95):>8.2f} "
+              f"{max(samples):>8.2f}")
+
+    heavy = sorted({name for r in results for name in r["heavy_modules"]})
+    created = any(r["backups_created"] for r in results)
+    print(f"\nLoaded at startup: {', '.join(heavy) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+    print(f"Backup folder created at startup: {'yes' if created else 'no'}")
+    if args.check and (heavy or created):
+        sys.exit("Startup does work that should wait for the first menu")
@@ -7,7 +7,11 @@ set -e
 
 VERSION="1.0.0"
 EXTENSION_NAME="nautilus-backup.py"
+CORE_NAME="nautilus_backup_core.py"
+CLI_NAME="nautilus_backup_cli.py"
 INSTALL_DIR="$HOME/.local/share/nautilus-python/extensions"
+LIB_DIR="$HOME/.local/share/nautilus-backup"
+BIN_DIR="$HOME/.local/bin"
 CONFIG_DIR="$HOME/.config/nautilus-backup"
 BACKUP_DIR="$HOME/Backups"
 
@@ -87,6 +91,8 @@ echo ""
 echo "[INFO] Creating directories..."
 
 mkdir -p "$INSTALL_DIR"
+mkdir -p "$LIB_DIR"
+mkdir -p "$BIN_DIR"
 mkdir -p "$CONFIG_DIR"
 mkdir -p "$BACKUP_DIR"
 
@@ -99,17 +105,13 @@ echo "[INFO] Installing extension..."
 # Get script directory
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
-# Check if extension file exists in current directory or script directory
-if [ -f "$EXTENSION_NAME" ]; then
-    cp "$EXTENSION_NAME" "$INSTALL_DIR/"
-    chmod +x "$INSTALL_DIR/$EXTENSION_NAME"
-    echo "[OK] Extension installed to: $INSTALL_DIR"
-elif [ -f "$SCRIPT_DIR/$EXTENSION_NAME" ]; then
-    cp "$SCRIPT_DIR/$EXTENSION_NAME" "$INSTALL_DIR/"
-    chmod +x "$INSTALL_DIR/$EXTENSION_NAME"
-    echo "[OK] Extension installed to: $INSTALL_DIR"
+# Check if extension files exist in current directory or script directory
+if [ -f "$EXTENSION_NAME" ] && [ -f "$CORE_NAME" ]; then
+    SOURCE_DIR="$(pwd)"
+elif [ -f "$SCRIPT_DIR/$EXTENSION_NAME" ] && [ -f "$SCRIPT_DIR/$CORE_NAME" ]; then
+    SOURCE_DIR="$SCRIPT_DIR"
 else
-    echo "[ERROR] $EXTENSION_NAME not found"
+    echo "[ERROR] $EXTENSION_NAME or $CORE_NAME not found"
     echo "        Looked in:"
     echo "          * Current directory: $(pwd)"
     echo "          * Script directory: $SCRIPT_DIR"
@@ -117,6 +119,17 @@ else
     exit 1
 fi
 
+cp "$SOURCE_DIR/$EXTENSION_NAME" "$INSTALL_DIR/"
+chmod +x "$INSTALL_DIR/$EXTENSION_NAME"
+echo "[OK] Extension installed to: $INSTALL_DIR"
+
+# Backup core and command line tool (kept out of the extensions folder,
+# where Nautilus would load every .py file)
+cp "$SOURCE_DIR/$CORE_NAME" "$SOURCE_DIR/$CLI_NAME" "$LIB_DIR/"
+chmod +x "$LIB_DIR/$CLI_NAME"
+ln -sf "$LIB_DIR/$CLI_NAME" "$BIN_DIR/nautilus-backup"
+echo "[OK] Command line tool installed: $BIN_DIR/nautilus-backup"
+
 # Create default config
 echo ""
 echo "[INFO] Creating configuration..."
@@ -163,6 +176,8 @@ echo "  * Desktop notifications show backup status"
 echo ""
 echo "Settings: Right-click -> Backup -> Backup Settings"
 echo ""
+echo "From a terminal or cron: nautilus-backup backup FILE... (see nautilus-backup --help)"
+echo ""
 echo "If you don't see the menu, try:"
 echo "  1. Close all Nautilus windows"
 echo "  2. Run: nautilus -q"
@@ -6,15 +6,36 @@ COMPATIBILITY: Ubuntu 20.04, 22.04, 24.04 (Nautilus 3.x and 4.x)
 """
 
 import os
-import shutil
-from datetime import datetime
+import sys
 from pathlib import Path
 from urllib.parse import unquote, urlparse
-import subprocess
-import tarfile
 import threading
-import re
 import logging
+import collections
+import importlib.util
+import time
+
+
+def _lazy_import(name):
+    """Import a module whose code only runs when one of its names is first used
+
+    Keeps Nautilus startup from paying for modules (and the backup core's
+    own imports: tarfile, sqlite3, compression...) until a backup is made.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+shutil = _lazy_import("shutil")
+subprocess = _lazy_import("subprocess")
+tempfile = _lazy_import("tempfile")
 
 # Setup logging
 logging.basicConfig(
@@ -51,6 +72,300 @@ except ValueError:
 
 from gi.repository import Nautilus, GObject, Gtk, Gio, GLib
 
+
+# Backup logic lives in nautilus_backup_core.py, next to this file or in
+# ~/.local/share/nautilus-backup (shared with the nautilus-backup command),
+# and is loaded on first use
+for _core_dir in (Path(__file__).resolve().parent, Path.home() / ".local" / "share" / "nautilus-backup"):
+    if (_core_dir / "nautilus_backup_core.py").exists() and str(_core_dir) not in sys.path:
+        sys.path.insert(0, str(_core_dir))
+        break
+
+backup_core = _lazy_import("nautilus_backup_core")
+
+
+# ---------------------------------------------------------------------------
+# Desktop notifications
+# ---------------------------------------------------------------------------
+
+NOTIFICATIONS_BUS_NAME = "org.freedesktop.Notifications"
+NOTIFICATIONS_OBJECT_PATH = "/org/freedesktop/Notifications"
+NOTIFICATIONS_APP_NAME = "Nautilus Backup"
+
+
+class NotificationService:
+    """Sends desktop notifications from a background thread
+
+    Talks to org.freedesktop.Notifications over a persistent session bus
+    connection, falling back to notify-send when there is no session bus.
+    A failed call only drops the connection; the next notification reconnects.
+    notify() never blocks: requests are queued, and queued updates for the
+    same key are coalesced so only the latest is sent. Notifications with a
+    key replace the previous one with that key in place until final=True.
+    """
+
+    def __init__(self, app_name=NOTIFICATIONS_APP_NAME):
+        self.app_name = app_name
+        self._pending = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._ids = {}
+        self._next_anonymous = 0
+        self._bus = None
+        self._use_bus = True
+        self._notify_send_replaces = True
+
+    def notify(self, title, message, success=True, key=None, final=False, percent=None):
+        """Queue a notification; percent shows a progress bar where supported"""
+        with self._cond:
+            if key is None:
+                # Never coalesced with anything
+                self._next_anonymous += 1
+                key = ("anonymous", self._next_anonymous)
+            elif not final and key in self._pending and self._pending[key][3]:
+                # A late update must not replace the queued final message
+                return
+            self._pending[key] = (title, message, success, final, percent)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="backup-notifications")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, (title, message, success, final, percent) = self._pending.popitem(last=False)
+
+            keyed = not (isinstance(key, tuple) and key[0] == "anonymous")
+            shown = key in self._ids
+            replaces = self._ids.pop(key, None) if final else self._ids.get(key)
+            if shown and not final and not (self._use_bus or self._notify_send_replaces):
+                # Updates can't replace each other: show only the first and the last
+                continue
+
+            try:
+                notification_id = self._send(title, message, success, replaces, keyed and not final, percent)
+            except Exception as e:
+                logger.error(f"Failed to show notification: {e}")
+                continue
+            if keyed and not final:
+                self._ids[key] = notification_id
+
+    def _send(self, title, message, success, replaces, transient, percent):
+        """Show one notification, returns its id (0 if unknown)"""
+        icon = "dialog-information" if success else "dialog-error"
+
+        if self._use_bus and self._bus is None:
+            try:
+                self._bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+            except Exception as e:
+                # No session bus at all: use notify-send from now on
+                logger.warning(f"D-Bus notifications unavailable, using notify-send: {e}")
+                self._use_bus = False
+
+        if self._bus is not None:
+            try:
+                hints = {"urgency": GLib.Variant("y", 1)}
+                if transient:
+                    hints["transient"] = GLib.Variant("b", True)
+                if percent is not None:
+                    hints["value"] = GLib.Variant("i", int(percent))
+                result = self._bus.call_sync(
+                    NOTIFICATIONS_BUS_NAME, NOTIFICATIONS_OBJECT_PATH, NOTIFICATIONS_BUS_NAME, "Notify",
+                    GLib.Variant("(susssasa{sv}i)",
+                                 (self.app_name, replaces or 0, icon, title, message, [], hints, -1)),
+                    GLib.VariantType("(u)"), Gio.DBusCallFlags.NONE, -1, None
+                )
+                return result.unpack()[0]
+            except Exception as e:
+                # One failed call (daemon restarting, timeout...): reconnect for the next notification
+                logger.warning(f"D-Bus notification failed, using notify-send for this one: {e}")
+                self._bus = None
+
+        return self._notify_send(title, message, icon, replaces)
+
+    def _notify_send(self, title, message, icon, replaces):
+        command = ['notify-send', '-i', icon, '-u', 'normal']
+        if self._notify_send_replaces:
+            # libnotify 0.7.9+: print the id, replace a previous one
+            command.append('-p')
+            if replaces:
+                command += ['-r', str(replaces)]
+        result = subprocess.run(command + [title, message], capture_output=True, text=True, check=False)
+
+        if self._notify_send_replaces and result.returncode != 0:
+            self._notify_send_replaces = False
+            return self._notify_send(title, message, icon, None)
+        output = result.stdout.strip()
+        return int(output) if output.isdigit() else 0
+
+
+# ---------------------------------------------------------------------------
+# Watch mode
+# ---------------------------------------------------------------------------
+
+# A watched path is backed up once nothing under it changed for this long...
+WATCH_QUIET_PERIOD = 5
+# ...or after this long if it never goes quiet (a log, a running VM)
+WATCH_MAX_DELAY = 600
+# inotify watches are a per-user resource shared with other programs
+WATCH_MAX_MONITORS = 8192
+# Monitors created per main loop iteration when a large folder is watched
+WATCH_BATCH_SIZE = 200
+
+
+class WatchService:
+    """Gio file monitors on watched files and folders, with debouncing
+
+    Folders are watched recursively (one monitor per directory). Every event
+    under a watched path only pushes back that path's deadline; a single
+    timer, armed only while changes are pending, calls on_quiet(path) on the
+    main loop once the path has been quiet for quiet_period seconds.
+    ignore(name) filters out events for files such as our own backups.
+    """
+
+    def __init__(self, on_quiet, ignore=None, quiet_period=WATCH_QUIET_PERIOD, max_delay=WATCH_MAX_DELAY):
+        self.on_quiet = on_quiet
+        self.ignore = ignore or (lambda name: False)
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self._monitors = {}
+        self._count = 0
+        self._pending = {}
+        self._timer = None
+        self._warned = False
+
+    @property
+    def roots(self):
+        return set(self._monitors)
+
+    def is_watched(self, path):
+        return Path(path) in self._monitors
+
+    def watch(self, path):
+        """Start watching a file or folder (folders are walked in the background)"""
+        path = Path(path)
+        if path in self._monitors:
+            return
+        self._monitors[path] = {}
+        if path.is_dir():
+            self._watch_tree(path, str(path))
+        else:
+            self._add_monitor(path, path, directory=False)
+
+    def unwatch(self, path):
+        path = Path(path)
+        for monitor in self._monitors.pop(path, {}).values():
+            monitor.cancel()
+            self._count -= 1
+        self._pending.pop(path, None)
+
+    def touch(self, root):
+        """Note a change under root, pushing its backup back by quiet_period"""
+        now = time.monotonic()
+        entry = self._pending.get(root)
+        if entry is None:
+            self._pending[root] = [now, now + self.quiet_period]
+        else:
+            entry[1] = min(now + self.quiet_period, entry[0] + self.max_delay)
+        if self._timer is None:
+            self._timer = GLib.timeout_add(int(self.quiet_period * 1000), self._on_timer)
+
+    def _watch_tree(self, root, top):
+        """Monitor top and every folder below it (walked in a background thread)"""
+        def walk():
+            directories = [top]
+            for dirpath, dirnames, _filenames in os.walk(top):
+                directories.extend(os.path.join(dirpath, name) for name in dirnames)
+            GLib.idle_add(self._add_monitors, root, directories)
+
+        thread = threading.Thread(target=walk, name="backup-watch-walk")
+        thread.daemon = True
+        thread.start()
+
+    def _add_monitors(self, root, directories):
+        """Idle callback creating the monitors of a folder tree in batches"""
+        if root not in self._monitors:
+            return False
+        batch, directories[:WATCH_BATCH_SIZE] = directories[:WATCH_BATCH_SIZE], []
+        for directory in batch:
+            self._add_monitor(root, directory, directory=True)
+        return bool(directories)
+
+    def _add_monitor(self, root, path, directory):
+        path = str(path)
+        if path in self._monitors[root]:
+            return
+        if self._count >= WATCH_MAX_MONITORS:
+            if not self._warned:
+                logger.warning(f"Watching more than {WATCH_MAX_MONITORS} folders, changes in new ones are missed")
+                self._warned = True
+            return
+        try:
+            gfile = Gio.File.new_for_path(path)
+            flags = Gio.FileMonitorFlags.WATCH_MOVES
+            monitor = gfile.monitor_directory(flags, None) if directory else gfile.monitor_file(flags, None)
+        except Exception as e:
+            logger.error(f"Cannot watch {path}: {e}")
+            return
+        monitor.connect("changed", self._on_changed, root)
+        self._monitors[root][path] = monitor
+        self._count += 1
+
+    def _on_changed(self, monitor, gfile, other_file, event_type, root):
+        if event_type in (Gio.FileMonitorEvent.ATTRIBUTE_CHANGED, Gio.FileMonitorEvent.PRE_UNMOUNT,
+                          Gio.FileMonitorEvent.UNMOUNTED):
+            return
+        path = gfile.get_path()
+        if not path or self.ignore(os.path.basename(path)):
+            return
+
+        monitors = self._monitors.get(root)
+        if monitors is None:
+            return
+        # A watched file keeps its monitor, editors replace files on save
+        if path != str(root) and event_type in (Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_OUT,
+                                                Gio.FileMonitorEvent.RENAMED):
+            self._drop_tree(monitors, path)
+        if event_type == Gio.FileMonitorEvent.RENAMED and other_file is not None:
+            path = other_file.get_path()
+            event_type = Gio.FileMonitorEvent.CREATED
+        if event_type in (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.MOVED_IN):
+            if path and path not in monitors and os.path.isdir(path) and not os.path.islink(path):
+                self._watch_tree(root, path)
+        self.touch(root)
+
+    def _drop_tree(self, monitors, path):
+        """Cancel the monitors of a folder that was removed or renamed, and of its subfolders"""
+        if path not in monitors:
+            return
+        prefix = path + os.sep
+        for gone in [key for key in monitors if key == path or key.startswith(prefix)]:
+            monitors.pop(gone).cancel()
+            self._count -= 1
+
+    def _on_timer(self):
+        now = time.monotonic()
+        due = [root for root, (_first, deadline) in self._pending.items() if deadline <= now]
+        for root in due:
+            del self._pending[root]
+            try:
+                self.on_quiet(root)
+            except Exception as e:
+                logger.error(f"Automatic backup of {root} failed: {e}")
+
+        if self._pending:
+            wait = min(deadline for _first, deadline in self._pending.values()) - now
+            self._timer = GLib.timeout_add(max(100, int(wait * 1000)), self._on_timer)
+        else:
+            self._timer = None
+        return False
+
+
 class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
     """Nautilus extension for easy file/folder backups"""
     
@@ -59,40 +374,36 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         
         logger.info(f"Initializing Nautilus Backup Extension (GTK {GTK_VERSION})")
         
-        # Load config
+        # Nothing here may touch the backup folder's disk or load the backup
+        # core: this runs on every Nautilus start (see the core property)
         self.config_dir = Path.home() / ".config" / "nautilus-backup"
-        self.config_file = self.config_dir / "config.txt"
-        self.cleanup_config = self.config_dir / "cleanup.txt"
+        self._core = None
         
-        # Load backup folder
-        if self.config_file.exists():
-            try:
-                saved_path = self.config_file.read_text().strip()
-                if saved_path:
-                    self.backup_folder = Path(saved_path)
-                else:
-                    self.backup_folder = Path.home() / "Backups"
-            except Exception as e:
-                logger.error(f"Failed to load config: {e}")
-                self.backup_folder = Path.home() / "Backups"
-        else:
-            self.backup_folder = Path.home() / "Backups"
+        # Desktop notifications, sent from their own thread
+        self.notifications = NotificationService()
         
-        self.backup_folder.mkdir(parents=True, exist_ok=True)
+        # Files and folders backed up automatically after they change
+        self.watch_config = self.config_dir / "watched.txt"
+        self.watcher = WatchService(self._on_watch_quiet,
+                                    ignore=lambda name: backup_core.BACKUP_STAMP_RE.search(name) is not None)
+        self._watch_running = set()
+        GLib.idle_add(self._start_watching)
         
-        # Load cleanup settings (default: keep all backups)
-        self.max_backups = None  # None means no limit
-        if self.cleanup_config.exists():
-            try:
-                value = self.cleanup_config.read_text().strip()
-                if value and value != "0":
-                    self.max_backups = int(value)
-            except Exception as e:
-                logger.error(f"Failed to load cleanup config: {e}")
+        # Backup copies rebuilt for a diff tool (see _compare_temp_dir)
+        self.compare_dir = self.config_dir / "compare"
+        self._compare_lock = threading.Lock()
+        self._compare_swept = False
+        
+    
+    @property
+    def core(self):
+        """Settings, backups, catalog and job queue (shared with the nautilus-backup command)
         
-        # Stats tracking
-        self.stats_file = self.config_dir / "stats.txt"
-        self.stats = self._load_stats()
+        Created when first needed, normally the first time a menu is shown.
+        """
+        if self._core is None:
+            self._core = backup_core.BackupCore(self.config_dir)
+        return self._core
     
     def get_file_items(self, *args):
         """Add backup menu items to right-click context menu
@@ -100,6 +411,11 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         Note: Method signature changed between Nautilus 3 and 4
         - Nautilus 3: get_file_items(window, files)
         - Nautilus 4: get_file_items(files)
+        
+        Called on every right-click, so it never touches the selected files
+        beyond the first: only a single selection can be a backup. The items
+        are rebuilt each time (a dozen objects whatever the selection size) so
+        every handler gets the selection its own menu was shown for.
         """
         # Handle both Nautilus 3 and 4 signatures
         if NAUTILUS_VERSION == 3:
@@ -115,9 +431,40 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         if len(files) == 0:
             return []
         
-        # Check if any selected file is a backup
-        is_backup = any(self._is_backup_file(self._get_file_path(f)) for f in files)
+        # Restore/compare for a single backup, history for a single file
+        if len(files) == 1:
+            path = self._get_file_path(files[0])
+            if not self.core.is_backup_file(path):
+                shape = "file"
+            elif self.core.has_archive_name(path):
+                shape = "archive"
+            else:
+                shape = "backup"
+        else:
+            shape = "multi"
+        busy = self.core.scheduler.is_busy()
+        backup_item, items = self._build_menu(shape, busy, files)
+        
+        if shape == "file":
+            watched = self.watcher.is_watched(path)
+            items['Watch'].set_property('label', '👁️ Stop Auto-Backup' if watched else '👁️ Auto-Backup on Change')
+        
+        if busy:
+            queue = self.core.scheduler.status()
+            items['Queue'].set_property(
+                'label', f"⏳ Backup Queue ({len(queue['running'])} running, {queue['queued_count']} queued)"
+            )
+        
+        return [backup_item]
+    
+    def _build_menu(self, shape, busy, files):
+        """Create the Backup submenu for one selection shape ("backup", "archive", "file" or "multi")
+        
+        Every handler is connected with ``files``, the selection this menu is for.
         
+        Returns:
+            tuple: (top-level item, {name: item})
+        """
         backup_menu = Nautilus.Menu()
         backup_item = Nautilus.MenuItem(
             name='BackupExtension::Backup',
@@ -125,258 +472,246 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             tip='Backup options for selected file(s)'
         )
         backup_item.set_submenu(backup_menu)
+        items = {}
+        
+        def add(name, label, tip='', handler=None):
+            item = Nautilus.MenuItem(name=f'BackupExtension::{name}', label=label, tip=tip)
+            if handler:
+                item.connect('activate', handler, files)
+            backup_menu.append_item(item)
+            items[name] = item
         
         # If it's a backup file, add restore option first
-        if is_backup and len(files) == 1:
-            restore_item = Nautilus.MenuItem(
-                name='BackupExtension::Restore',
-                label='♻️ Restore from Backup',
-                tip='Restore original file from this backup'
-            )
-            restore_item.connect('activate', self.restore_backup, files)
-            backup_menu.append_item(restore_item)
+        if shape in ("backup", "archive"):
+            add('Restore', '♻️ Restore from Backup', 'Restore original file from this backup', self.restore_backup)
             
-            # Add compare option for backed up files
-            compare_item = Nautilus.MenuItem(
-                name='BackupExtension::Compare',
-                label='🔍 Compare with Original',
-                tip='View differences between backup and current file'
-            )
-            compare_item.connect('activate', self.compare_backup, files)
-            backup_menu.append_item(compare_item)
+            # Folder archives can give back one file or subfolder
+            if shape == "archive":
+                add('RestoreItem', '📂 Restore Single Item…', 'Restore one file or folder from this archive',
+                    self.restore_item)
             
-            separator = Nautilus.MenuItem(
-                name='BackupExtension::RestoreSeparator',
-                label='─────────────────',
-                tip=''
-            )
-            backup_menu.append_item(separator)
+            # Add compare option for backed up files
+            add('Compare', '🔍 Compare with Original', 'View differences between backup and current file',
+                self.compare_backup)
+            add('RestoreSeparator', '─────────────────')
         
         # If not a backup, add "View Backups" for the file
-        if not is_backup and len(files) == 1:
-            view_backups_item = Nautilus.MenuItem(
-                name='BackupExtension::ViewBackups',
-                label='📜 View All Backups',
-                tip='See all backups of this file'
-            )
-            view_backups_item.connect('activate', self.view_backups, files)
-            backup_menu.append_item(view_backups_item)
-            
-            separator = Nautilus.MenuItem(
-                name='BackupExtension::ViewSeparator',
-                label='─────────────────',
-                tip=''
-            )
-            backup_menu.append_item(separator)
-        
-        quick_item = Nautilus.MenuItem(
-            name='BackupExtension::QuickBackup',
-            label='⚡ Quick Backup (Same Folder)',
-            tip='Create timestamped backup in same folder'
-        )
-        quick_item.connect('activate', self.quick_backup, files)
-        backup_menu.append_item(quick_item)
-        
-        backup_as_item = Nautilus.MenuItem(
-            name='BackupExtension::BackupAs',
-            label='💾 Backup As...',
-            tip='Choose backup name and location'
-        )
-        backup_as_item.connect('activate', self.backup_as, files)
-        backup_menu.append_item(backup_as_item)
-        
-        backup_home_item = Nautilus.MenuItem(
-            name='BackupExtension::BackupToHome',
-            label='🗂️ Backup to ~/Backups',
-            tip='Save backup to ~/Backups folder'
-        )
-        backup_home_item.connect('activate', self.backup_to_home, files)
-        backup_menu.append_item(backup_home_item)
-        
-        separator = Nautilus.MenuItem(
-            name='BackupExtension::Separator1',
-            label='─────────────────',
-            tip=''
-        )
-        backup_menu.append_item(separator)
-        
-        settings_item = Nautilus.MenuItem(
-            name='BackupExtension::Settings',
-            label='⚙️ Backup Settings',
-            tip='Configure backup options'
-        )
-        settings_item.connect('activate', self.show_settings, files)
-        backup_menu.append_item(settings_item)
-        
-        return [backup_item]
+        if shape == "file":
+            add('ViewBackups', '📜 View All Backups', 'See all backups of this file', self.view_backups)
+            add('ViewSeparator', '─────────────────')
+        
+        add('QuickBackup', '⚡ Quick Backup (Same Folder)', 'Create timestamped backup in same folder',
+            self.quick_backup)
+        add('BackupAs', '💾 Backup As...', 'Choose backup name and location', self.backup_as)
+        add('BackupToHome', '🗂️ Backup to ~/Backups', 'Save backup to ~/Backups folder', self.backup_to_home)
+        if shape in ("file", "multi"):
+            add('Watch', '👁️ Auto-Backup on Change', 'Back up automatically whenever this changes (again to stop)',
+                self.toggle_watch)
+        add('Separator1', '─────────────────')
+        
+        # Queue status and cancel while backups are running (label set by get_file_items)
+        if busy:
+            add('Queue', '⏳ Backup Queue', 'Show running and queued backups', self.show_queue)
+            add('CancelAll', '⏹️ Cancel All Backups', 'Stop running backups and clear the queue',
+                self.cancel_backups)
+        
+        add('Settings', '⚙️ Backup Settings', 'Configure backup options', self.show_settings)
+        
+        return backup_item, items
     
     def get_background_items(self, *args):
         """Background items (not used, but required by interface)"""
         return []
     
-    def _load_stats(self):
-        """Load backup statistics"""
-        default_stats = {"total_backups": 0, "total_size": 0}
-        if self.stats_file.exists():
-            try:
-                import json
-                return json.loads(self.stats_file.read_text())
-            except Exception as e:
-                logger.error(f"Failed to load stats: {e}")
-                return default_stats
-        return default_stats
-    
-    def _save_stats(self):
-        """Save backup statistics"""
-        try:
-            import json
-            self.config_dir.mkdir(parents=True, exist_ok=True)
-            self.stats_file.write_text(json.dumps(self.stats))
-        except Exception as e:
-            logger.error(f"Failed to save stats: {e}")
-    
-    def _update_stats(self, file_size):
-        """Update statistics after successful backup"""
-        self.stats["total_backups"] = self.stats.get("total_backups", 0) + 1
-        self.stats["total_size"] = self.stats.get("total_size", 0) + file_size
-        self._save_stats()
-    
     def _get_file_path(self, file_info):
         uri = file_info.get_uri()
         return Path(unquote(urlparse(uri).path))
     
-    def _is_backup_file(self, path):
-        """Check if filename matches backup pattern"""
-        return '_backup_' in path.name and re.search(r'_backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}', path.name)
-    
-    def _generate_backup_name(self, source_path):
-        """Generate timestamped backup filename"""
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        
-        if source_path.is_dir():
-            return f"{source_path.name}_backup_{timestamp}.tar.gz"
-        else:
-            stem = source_path.stem
-            suffix = source_path.suffix
-            return f"{stem}_backup_{timestamp}{suffix}"
-    
-    def _get_original_filename(self, backup_path):
-        """Extract original filename from backup filename"""
-        pattern = r'^(.+)_backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}(.*)$'
-        match = re.match(pattern, backup_path.name)
-        if match:
-            if backup_path.suffix == '.gz' and backup_path.stem.endswith('.tar'):
-                # It's a folder backup
-                return match.group(1)
-            else:
-                # It's a file backup
-                return match.group(1) + match.group(2)
-        return None
-    
-    def _create_backup(self, source, destination):
-        """Create backup of file or folder"""
-        try:
-            if source.is_dir():
-                # Create compressed archive for folders
-                with tarfile.open(destination, "w:gz") as tar:
-                    tar.add(source, arcname=source.name)
-                file_size = destination.stat().st_size
-            else:
-                # Copy file with metadata
-                shutil.copy2(source, destination)
-                file_size = destination.stat().st_size
-            
-            # Update statistics
-            self._update_stats(file_size)
-            
-            return True, None
-        except Exception as e:
-            return False, str(e)
-    
     def _show_notification(self, title, message, success=True):
-        """Show desktop notification"""
-        try:
-            icon = "dialog-information" if success else "dialog-error"
-            subprocess.run([
-                'notify-send',
-                '-i', icon,
-                '-u', 'normal',
-                title,
-                message
-            ], check=False)
-        except Exception as e:
-            logger.error(f"Failed to show notification: {e}")
+        """Show desktop notification (queued, safe from any thread)"""
+        self.notifications.notify(title, message, success)
     
-    def _cleanup_old_backups(self, new_backup_path):
-        """Clean up old backups if max limit is set"""
-        if self.max_backups is None:
-            return
+    def _show_progress_notification(self, key, title, message, success=True, final=False, percent=None):
+        """Show or update the notification identified by key, replacing it in place
         
-        try:
-            # Extract base filename from backup
-            original_name = self._get_original_filename(new_backup_path)
-            if not original_name:
-                return
-            
-            # Find all backups of this file in the same directory
-            parent_dir = new_backup_path.parent
-            pattern = f"{Path(original_name).stem}_backup_*{Path(original_name).suffix}"
-            
-            all_backups = sorted(
-                parent_dir.glob(pattern),
-                key=lambda p: p.stat().st_mtime,
-                reverse=True
-            )
-            
-            # Remove oldest backups if over limit
-            if len(all_backups) > self.max_backups:
-                for old_backup in all_backups[self.max_backups:]:
-                    try:
-                        old_backup.unlink()
-                        logger.info(f"Cleaned up old backup: {old_backup.name}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete {old_backup}: {e}")
-        except Exception as e:
-            logger.error(f"Cleanup failed: {e}")
+        final=True shows the last update and forgets the key. Returns False
+        so it can be used with GLib.timeout_add.
+        """
+        self.notifications.notify(title, message, success, key=key, final=final, percent=percent)
+        return False
     
     def _backup_with_progress(self, source_path, dest_path, notification_title):
         """Backup with progress notification (for large files/folders)"""
         
-        def do_backup():
-            # Show initial notification
+        def do_backup(job):
+            key = f"job-{job.id}"
+            done = threading.Event()
+            
+            # Show initial notification, then update it in place while the backup runs
             GLib.idle_add(
-                self._show_notification,
+                self._show_progress_notification,
+                key,
                 "Backup In Progress...",
                 f"Backing up: {source_path.name}",
                 True
             )
             
-            success, error = self._create_backup(source_path, dest_path)
+            def update_progress():
+                if done.is_set():
+                    return False
+                snapshot = job.progress.snapshot()
+                self._show_progress_notification(
+                    key,
+                    f"Backing up {source_path.name}",
+                    backup_core.describe_progress(snapshot),
+                    percent=snapshot["percent"]
+                )
+                return True
             
-            if success:
+            GLib.timeout_add_seconds(backup_core.PROGRESS_NOTIFY_INTERVAL, update_progress)
+            try:
+                success, error, backup_path = self.core.create_backup(source_path, dest_path, job)
+            finally:
+                done.set()
+            
+            if job.cancelled:
+                GLib.idle_add(
+                    self._show_progress_notification,
+                    key,
+                    "Backup Cancelled",
+                    f"Cancelled: {source_path.name}",
+                    False,
+                    True
+                )
+            elif success:
                 # Cleanup old backups
-                self._cleanup_old_backups(dest_path)
+                self.core.cleanup_old_backups(backup_path)
                 
-                # Success notification
+                # Success notification (with the final numbers)
+                snapshot = job.progress.snapshot()
                 GLib.idle_add(
-                    self._show_notification,
+                    self._show_progress_notification,
+                    key,
                     notification_title,
-                    f"Backed up to:\n{dest_path.parent}",
+                    f"Backed up to:\n{backup_path.parent}\n"
+                    f"{backup_core.format_size(snapshot['bytes_done'])} in "
+                    f"{backup_core.format_duration(snapshot['elapsed'])}",
+                    True,
                     True
                 )
             else:
                 # Error notification
                 GLib.idle_add(
-                    self._show_notification,
+                    self._show_progress_notification,
+                    key,
                     "Backup Failed",
                     error,
-                    False
+                    False,
+                    True
                 )
         
-        # Run in background thread
-        thread = threading.Thread(target=do_backup)
-        thread.daemon = True
-        thread.start()
+        # Run on the scheduler's worker pool
+        must_wait = self.core.scheduler.is_saturated(dest_path)
+        self.core.scheduler.submit(do_backup, source_path.name, dest_path, priority=backup_core.PRIORITY_HIGH)
+        
+        if must_wait:
+            self._show_notification(
+                "Backup Queued",
+                f"{source_path.name} will start when the destination disk is free"
+            )
+    
+    def show_queue(self, menu, files):
+        """Show running and queued backup jobs"""
+        queue = self.core.scheduler.status()
+        lines = []
+        for job in queue["running"]:
+            snapshot = job["progress"]
+            done = f"{snapshot['percent']:.0f}%" if snapshot["percent"] is not None \
+                else backup_core.format_size(snapshot["bytes_done"])
+            lines.append(f"▶ {job['description']} ({done}, {snapshot['rate'] / (1024 * 1024):.1f} MB/s)")
+        lines += [f"⏸ {job['description']}" for job in queue["queued"]]
+        if queue["queued_count"] > len(queue["queued"]):
+            lines.append(f"… and {queue['queued_count'] - len(queue['queued'])} more queued")
+        
+        self._show_notification(
+            "Backup Queue",
+            "\n".join(lines) if lines else "No backups running"
+        )
+    
+    def cancel_backups(self, menu, files):
+        """Cancel every running and queued backup"""
+        count = self.core.scheduler.cancel()
+        self._show_notification(
+            "Backups Cancelled",
+            f"Cancelled {count} backup(s)",
+            success=False
+        )
+    
+    def _backup_batch(self, files, dest_dir_for, summary_folder=None):
+        """Back up several items in the background with one final notification
+        
+        Args:
+            files: Selected Nautilus file infos
+            dest_dir_for: Maps a source path to the folder its backup goes to
+            summary_folder: Folder named in the completion message, if any
+        """
+        sources = [self._get_file_path(file_info) for file_info in files]
+        
+        def on_complete(batch):
+            title, msg, success = self._batch_summary(batch, summary_folder)
+            GLib.idle_add(self._show_notification, title, msg, success)
+        
+        batch = backup_core.BackupBatch(len(sources), on_complete)
+        # Names handed out per folder: a search view can select same-named items from several folders
+        taken = collections.defaultdict(set)
+        naming_lock = threading.Lock()
+        
+        for source_path in sources:
+            dest_dir = dest_dir_for(source_path)
+            
+            def do_backup(job, source_path=source_path, dest_dir=dest_dir):
+                # Naming stats the source, keep that off the UI thread too
+                with naming_lock:
+                    name = self.core.unique_backup_name(source_path, dest_dir, taken[dest_dir])
+                    taken[dest_dir].add(name)
+                dest_path = dest_dir / name
+                success, error, backup_path = self.core.create_backup(source_path, dest_path, job)
+                if success:
+                    self.core.cleanup_old_backups(backup_path)
+                return success, error
+            
+            self.core.scheduler.submit(
+                do_backup, source_path.name, dest_dir / source_path.name,
+                priority=backup_core.PRIORITY_NORMAL, on_done=batch.job_done
+            )
+        
+        self._show_notification(
+            "Backup In Progress...",
+            f"Backing up {len(sources)} items in the background"
+        )
+    
+    def _batch_summary(self, batch, summary_folder):
+        """Notification (title, message, success) for a finished batch"""
+        lines = []
+        if batch.succeeded:
+            msg = f"{len(batch.succeeded)} file(s) backed up"
+            lines.append(f"{msg} to:\n{summary_folder}" if summary_folder else msg)
+        if batch.cancelled:
+            lines.append(f"{len(batch.cancelled)} cancelled")
+        if batch.failed:
+            lines.append(f"{len(batch.failed)} failed:")
+            for name, error in batch.failed[:5]:
+                lines.append(f"• {name}: {error}")
+            if len(batch.failed) > 5:
+                lines.append(f"…and {len(batch.failed) - 5} more")
+        
+        if batch.failed and not batch.succeeded:
+            return "Backup Failed", "\n".join(lines), False
+        if batch.failed:
+            return "Backup Finished With Errors", "\n".join(lines), False
+        if not batch.succeeded:
+            return "Backup Cancelled", "\n".join(lines), False
+        return "Backup Complete ✓", "\n".join(lines), True
     
     def quick_backup(self, menu, files):
         success_count = 0
@@ -385,26 +720,31 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         # For single large file/folder, use threaded backup
         if len(files) == 1:
             source_path = self._get_file_path(files[0])
-            backup_name = self._generate_backup_name(source_path)
+            backup_name = self.core.generate_backup_name(source_path)
             dest_path = source_path.parent / backup_name
             
             # Check if it's a large operation
-            if source_path.is_dir() or (source_path.is_file() and source_path.stat().st_size > 10_000_000):
+            if self.core.is_large(source_path):
                 self._backup_with_progress(source_path, dest_path, "Backup Complete ✓")
                 return
         
-        # Multiple files or small files - do synchronously
+        # Multiple files - back them up in parallel on the worker pool
+        if len(files) > 1:
+            self._backup_batch(files, lambda source_path: source_path.parent)
+            return
+        
+        # Single small file - do synchronously
         for file_info in files:
             source_path = self._get_file_path(file_info)
-            backup_name = self._generate_backup_name(source_path)
+            backup_name = self.core.generate_backup_name(source_path)
             dest_path = source_path.parent / backup_name
             
-            success, error = self._create_backup(source_path, dest_path)
+            success, error, backup_path = self.core.create_backup(source_path, dest_path)
             
             if success:
-                self._cleanup_old_backups(dest_path)
+                self.core.cleanup_old_backups(backup_path)
                 success_count += 1
-                last_dest_path = dest_path
+                last_dest_path = backup_path
             else:
                 self._show_notification(
                     "Backup Failed",
@@ -431,7 +771,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             return
         
         source_path = self._get_file_path(files[0])
-        backup_name = self._generate_backup_name(source_path)
+        backup_name = self.core.generate_backup_name(source_path)
         
         logger.info(f"backup_as: Starting for {source_path.name}")
         
@@ -453,16 +793,16 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
                     logger.info(f"backup_as: User selected {dest_path}")
                     
                     # Large file/folder - use threaded backup
-                    if source_path.is_dir() or (source_path.is_file() and source_path.stat().st_size > 10_000_000):
+                    if self.core.is_large(source_path):
                         self._backup_with_progress(source_path, dest_path, "Backup Complete ✓")
                     else:
-                        success, error = self._create_backup(source_path, dest_path)
+                        success, error, backup_path = self.core.create_backup(source_path, dest_path)
                         
                         if success:
-                            self._cleanup_old_backups(dest_path)
+                            self.core.cleanup_old_backups(backup_path)
                             self._show_notification(
                                 "Backup Complete ✓",
-                                f"Backed up to:\n{dest_path}"
+                                f"Backed up to:\n{backup_path}"
                             )
                         else:
                             self._show_notification(
@@ -546,16 +886,16 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             logger.info(f"backup_as: User selected {dest_path}")
             
             # Large file/folder - use threaded backup
-            if source_path.is_dir() or (source_path.is_file() and source_path.stat().st_size > 10_000_000):
+            if self.core.is_large(source_path):
                 self._backup_with_progress(source_path, dest_path, "Backup Complete ✓")
             else:
-                success, error = self._create_backup(source_path, dest_path)
+                success, error, backup_path = self.core.create_backup(source_path, dest_path)
                 
                 if success:
-                    self._cleanup_old_backups(dest_path)
+                    self.core.cleanup_old_backups(backup_path)
                     self._show_notification(
                         "Backup Complete ✓",
-                        f"Backed up to:\n{dest_path}"
+                        f"Backed up to:\n{backup_path}"
                     )
                 else:
                     self._show_notification(
@@ -574,23 +914,29 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         # Single large file/folder
         if len(files) == 1:
             source_path = self._get_file_path(files[0])
-            backup_name = self._generate_backup_name(source_path)
-            dest_path = self.backup_folder / backup_name
+            backup_name = self.core.generate_backup_name(source_path)
+            dest_path = self.core.backup_folder / backup_name
             
-            if source_path.is_dir() or (source_path.is_file() and source_path.stat().st_size > 10_000_000):
+            if self.core.is_large(source_path):
                 self._backup_with_progress(source_path, dest_path, "Backup Complete ✓")
                 return
         
-        # Multiple files or small files
+        # Multiple files - back them up in parallel on the worker pool
+        if len(files) > 1:
+            backup_folder = self.core.backup_folder
+            self._backup_batch(files, lambda source_path: backup_folder, backup_folder)
+            return
+        
+        # Single small file
         for file_info in files:
             source_path = self._get_file_path(file_info)
-            backup_name = self._generate_backup_name(source_path)
-            dest_path = self.backup_folder / backup_name
+            backup_name = self.core.generate_backup_name(source_path)
+            dest_path = self.core.backup_folder / backup_name
             
-            success, error = self._create_backup(source_path, dest_path)
+            success, error, backup_path = self.core.create_backup(source_path, dest_path)
             
             if success:
-                self._cleanup_old_backups(dest_path)
+                self.core.cleanup_old_backups(backup_path)
                 success_count += 1
             else:
                 self._show_notification(
@@ -600,7 +946,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
                 )
         
         if success_count > 0:
-            msg = f"{success_count} file(s) backed up to:\n{self.backup_folder}"
+            msg = f"{success_count} file(s) backed up to:\n{self.core.backup_folder}"
             self._show_notification("Backup Complete ✓", msg)
     
     def restore_backup(self, menu, files):
@@ -609,7 +955,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             return
         
         backup_path = self._get_file_path(files[0])
-        original_name = self._get_original_filename(backup_path)
+        original_name = self.core.get_original_filename(backup_path)
         
         if not original_name:
             self._show_notification(
@@ -620,7 +966,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             return
         
         # Determine original path
-        original_path = backup_path.parent / original_name
+        original_path = self.core.original_path(backup_path, original_name)
         
         # Ask for confirmation (simple yes/no)
         msg = f"Restore '{original_name}' from backup?"
@@ -636,16 +982,14 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         )
         
         try:
-            if backup_path.suffix == '.gz' and backup_path.stem.endswith('.tar'):
-                # Extract folder from archive
-                with tarfile.open(backup_path, "r:gz") as tar:
-                    tar.extractall(backup_path.parent)
+            restored = self.core.restore(backup_path, original_path.parent)
+            if restored.is_dir():
                 success_msg = f"Restored folder: {original_name}"
             else:
-                # Copy file back
-                shutil.copy2(backup_path, original_path)
                 success_msg = f"Restored: {original_name}"
             
+            if original_path.parent != backup_path.parent:
+                success_msg += f"\nto {original_path.parent}"
             self._show_notification("Restore Complete ✓", success_msg)
         except Exception as e:
             self._show_notification(
@@ -654,13 +998,140 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
                 success=False
             )
     
+    def restore_item(self, menu, files):
+        """Restore one file or folder from a folder archive, picked from its index"""
+        if len(files) != 1:
+            return
+        
+        backup_path = self._get_file_path(files[0])
+        original_name = self.core.get_original_filename(backup_path)
+        
+        if not original_name or not self.core.is_folder_archive(backup_path):
+            self._show_notification(
+                "Cannot Restore",
+                "Single items can only be restored from folder archives",
+                success=False
+            )
+            return
+        
+        if not backup_core.index_path_for(backup_path).exists():
+            self._show_notification(
+                "No Index",
+                "This archive was made before single-item restore was available.\n"
+                "Use Restore from Backup instead.",
+                success=False
+            )
+            return
+        
+        # Items are stored relative to the folder's parent
+        target_dir = self.core.original_path(backup_path, original_name).parent
+        
+        def search(text):
+            try:
+                return backup_core.search_archive_chain(backup_path, text)
+            except Exception as e:
+                logger.error(f"Failed to search {backup_path.name}: {e}")
+                return []
+        
+        def on_pick(item):
+            def do_restore(job):
+                try:
+                    target_dir.mkdir(parents=True, exist_ok=True)
+                    count = backup_core.restore_archive_item(backup_path, item, target_dir)
+                    msg = f"Restored: {item}\nto {target_dir}"
+                    if count > 1:
+                        msg += f"\n({count} items)"
+                    self._show_notification("Restore Complete ✓", msg)
+                except Exception as e:
+                    self._show_notification("Restore Failed", str(e), success=False)
+            
+            self.core.scheduler.submit(do_restore, f"Restore {item}", target_dir / item,
+                                       priority=backup_core.PRIORITY_HIGH)
+        
+        self._show_item_picker(
+            f"Restore from {backup_path.name}",
+            "Type part of a name, then click the file or folder to restore",
+            search,
+            on_pick
+        )
+    
+    def _show_item_picker(self, title, hint, search, on_pick):
+        """Window listing search(text) results; on_pick(name) runs for the clicked one"""
+        window = Gtk.Window()
+        window.set_title(title)
+        window.set_default_size(500, 450)
+        window.set_modal(True)
+        
+        main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
+        main_box.set_margin_start(15)
+        main_box.set_margin_end(15)
+        main_box.set_margin_top(15)
+        main_box.set_margin_bottom(15)
+        
+        hint = Gtk.Label(label=hint)
+        hint.set_halign(Gtk.Align.START)
+        entry = Gtk.SearchEntry()
+        listbox = Gtk.ListBox()
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_vexpand(True)
+        names = []
+        
+        def fill(text):
+            if GTK_VERSION == 4:
+                child = listbox.get_first_child()
+                while child is not None:
+                    listbox.remove(child)
+                    child = listbox.get_first_child()
+            else:
+                for child in listbox.get_children():
+                    listbox.remove(child)
+            
+            names[:] = search(text)
+            for name in names:
+                label = Gtk.Label(label=name)
+                label.set_halign(Gtk.Align.START)
+                if GTK_VERSION == 4:
+                    listbox.append(label)
+                else:
+                    listbox.add(label)
+            if GTK_VERSION == 3:
+                listbox.show_all()
+        
+        def on_search_changed(search_entry):
+            fill(search_entry.get_text())
+        
+        def on_row_activated(box, row):
+            name = names[row.get_index()]
+            window.close() if GTK_VERSION == 4 else window.destroy()
+            on_pick(name)
+        
+        entry.connect("search-changed", on_search_changed)
+        listbox.connect("row-activated", on_row_activated)
+        
+        if GTK_VERSION == 4:
+            scrolled.set_child(listbox)
+            main_box.append(hint)
+            main_box.append(entry)
+            main_box.append(scrolled)
+            window.set_child(main_box)
+            fill("")
+            window.present()
+        else:
+            scrolled.add(listbox)
+            main_box.pack_start(hint, False, False, 0)
+            main_box.pack_start(entry, False, False, 0)
+            main_box.pack_start(scrolled, True, True, 0)
+            window.add(main_box)
+            fill("")
+            window.show_all()
+    
     def compare_backup(self, menu, files):
         """Compare backup with original using meld or diff"""
         if len(files) != 1:
             return
         
         backup_path = self._get_file_path(files[0])
-        original_name = self._get_original_filename(backup_path)
+        original_name = self.core.get_original_filename(backup_path)
         
         if not original_name:
             self._show_notification(
@@ -670,7 +1141,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             )
             return
         
-        original_path = backup_path.parent / original_name
+        original_path = self.core.original_path(backup_path, original_name)
         
         if not original_path.exists():
             self._show_notification(
@@ -680,12 +1151,16 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             )
             return
         
-        # Try meld first, fallback to diff
+        if self.core.is_folder_archive(backup_path):
+            self._compare_folder_archive(backup_path, original_path)
+            return
+        
+        if self.core.is_manifest_backup(backup_path) or backup_path.name.endswith(backup_core.DELTA_SUFFIX):
+            self._compare_rebuilt(backup_path, original_path)
+            return
+        
         try:
-            if shutil.which('meld'):
-                subprocess.Popen(['meld', str(backup_path), str(original_path)])
-            else:
-                subprocess.Popen(['gnome-terminal', '--', 'diff', str(backup_path), str(original_path)])
+            self._launch_diff(backup_path, original_path)
         except Exception as e:
             self._show_notification(
                 "Compare Failed",
@@ -693,6 +1168,150 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
                 success=False
             )
     
+    def _launch_diff(self, backup_path, original_path, on_exit=None):
+        """Open a backup and the original side by side (meld first, fallback to diff)
+        
+        on_exit() runs in a background thread once the diff tool is closed,
+        or right away if it could not be started.
+        """
+        if shutil.which('meld'):
+            command = ['meld', str(backup_path), str(original_path)]
+        else:
+            # --wait: stay running until diff exits, not just until the window opens
+            command = ['gnome-terminal', '--wait', '--', 'diff', str(backup_path), str(original_path)]
+        try:
+            process = subprocess.Popen(command)
+        except Exception:
+            if on_exit:
+                on_exit()
+            raise
+        
+        if on_exit:
+            def wait():
+                process.wait()
+                on_exit()
+            
+            thread = threading.Thread(target=wait, name="backup-diff-wait")
+            thread.daemon = True
+            thread.start()
+    
+    def _compare_temp_dir(self):
+        """New folder under compare_dir for backup copies opened in a diff tool
+        
+        The first one of a session also removes what earlier sessions left
+        behind (entries opened with xdg-open, or Nautilus quit while a diff
+        tool was open).
+        """
+        with self._compare_lock:
+            if not self._compare_swept:
+                self._compare_swept = True
+                if self.compare_dir.is_dir():
+                    for leftover in self.compare_dir.iterdir():
+                        shutil.rmtree(leftover, ignore_errors=True)
+            self.compare_dir.mkdir(parents=True, exist_ok=True)
+            return Path(tempfile.mkdtemp(dir=self.compare_dir))
+    
+    def _compare_rebuilt(self, backup_path, original_path):
+        """Diff a backup that has to be rebuilt first (repository or delta), off the UI thread
+        
+        The copy is rebuilt in a scheduler job and removed when the diff tool closes.
+        """
+        def do_rebuild(job):
+            temp_dir = self._compare_temp_dir()
+            try:
+                if self.core.is_manifest_backup(backup_path):
+                    # Materialize the backup from its chunks so the diff tools can read it
+                    manifest = backup_core.load_manifest(backup_path)
+                    copy = backup_core.ChunkStore(manifest["store"]).restore(manifest, temp_dir)
+                else:
+                    copy = backup_core.restore_delta(backup_path, temp_dir / original_path.name, job.checkpoint)
+                self._launch_diff(copy, original_path, on_exit=lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+            except backup_core.BackupCancelled:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+            except Exception as e:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                GLib.idle_add(self._show_notification, "Compare Failed", str(e), False)
+                return False, str(e)
+            return True, None
+        
+        self.core.scheduler.submit(do_rebuild, f"Compare {original_path.name}", backup_path,
+                                   priority=backup_core.PRIORITY_HIGH)
+        self._show_notification("Preparing Compare", f"Rebuilding {backup_path.name} to compare it…")
+    
+    def _compare_folder_archive(self, backup_path, original_path):
+        """List what changed between a folder archive and the live folder, diff picked entries
+        
+        Uses the archive's index, so nothing is extracted until an entry is picked.
+        """
+        if not backup_core.index_path_for(backup_path).exists():
+            self._show_notification(
+                "No Index",
+                "This archive was made before folder compare was available.\n"
+                "Restore it to compare the folders.",
+                success=False
+            )
+            return
+        
+        def do_compare(job):
+            try:
+                changes = self.core.compare(backup_path, original_path)
+            except Exception as e:
+                self._show_notification("Compare Failed", str(e), success=False)
+                return
+            
+            summary = (f"{len(changes['modified'])} modified, {len(changes['added'])} added, "
+                       f"{len(changes['removed'])} removed, {changes['unchanged']} unchanged")
+            if not (changes['modified'] or changes['added'] or changes['removed']):
+                self._show_notification("No Changes ✓", f"{original_path.name} matches the backup\n{summary}")
+                return
+            GLib.idle_add(self._show_folder_changes, backup_path, original_path, changes, summary)
+        
+        self.core.scheduler.submit(do_compare, f"Compare {original_path.name}", backup_path,
+                                   priority=backup_core.PRIORITY_HIGH)
+    
+    def _show_folder_changes(self, backup_path, original_path, changes, summary):
+        """Picker over the changed entries; modified ones open in meld/diff"""
+        lines = {}
+        for status, marker in (("modified", "±"), ("added", "+"), ("removed", "−")):
+            for path in changes[status]:
+                lines[f"{marker} {path}"] = (status, path)
+        
+        def search(text):
+            text = text.lower()
+            return [line for line in lines if text in line.lower()]
+        
+        def on_pick(line):
+            status, path = lines[line]
+            live_path = original_path.parent / path
+            if status == "added":
+                self._show_notification("Only in Folder", f"{path}\nis not in the backup")
+                return
+            
+            def do_extract(job):
+                # The picker closes on a pick: this folder is the whole compare session's
+                temp_dir = self._compare_temp_dir()
+                try:
+                    backup_core.restore_archive_item(backup_path, path, temp_dir)
+                    if status == "removed":
+                        # xdg-open returns at once: the next session's first compare removes the copy
+                        subprocess.Popen(['xdg-open', str(temp_dir / path)])
+                    else:
+                        self._launch_diff(temp_dir / path, live_path,
+                                          on_exit=lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+                except Exception as e:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    self._show_notification("Compare Failed", str(e), success=False)
+            
+            self.core.scheduler.submit(do_extract, f"Extract {path}", backup_path, priority=backup_core.PRIORITY_HIGH)
+        
+        self._show_item_picker(
+            f"Changes in {original_path.name}",
+            f"{summary}\nClick a modified entry to compare it with the backup",
+            search,
+            on_pick
+        )
+    
     def view_backups(self, menu, files):
         """View all backups of a file"""
         if len(files) != 1:
@@ -700,15 +1319,13 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         
         source_path = self._get_file_path(files[0])
         
-        # Find all backups
+        # Find all backups: next to the file, plus anywhere the catalog knows of
         parent_dir = source_path.parent
-        pattern = f"{source_path.stem}_backup_*{source_path.suffix}"
-        
-        backups = sorted(
-            parent_dir.glob(pattern),
-            key=lambda p: p.stat().st_mtime,
-            reverse=True
-        )
+        backups = self.core.find_backups(parent_dir, source_path.name)
+        for entry in self.core.catalog.history(source_path.resolve()):
+            path = Path(entry["destination"])
+            if path not in backups and path.exists():
+                backups.append(path)
         
         if not backups:
             self._show_notification(
@@ -718,12 +1335,156 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             )
             return
         
-        # Show notification with count
-        msg = f"Found {len(backups)} backup(s) of:\n{source_path.name}\n\nOpening folder..."
+        # Show notification with count (and where they are when not all next to the file)
+        folders = list(dict.fromkeys(p.parent for p in backups))
+        msg = f"Found {len(backups)} backup(s) of:\n{source_path.name}"
+        if folders != [parent_dir]:
+            msg += "\n\nIn:\n" + "\n".join(str(f) for f in folders)
+        msg += "\n\nOpening folder..."
         self._show_notification("Backups Found", msg)
         
-        # Open folder
-        subprocess.Popen(['nautilus', str(parent_dir)])
+        # Open folder (the file's own, unless all backups are elsewhere)
+        subprocess.Popen(['nautilus', str(parent_dir if parent_dir in folders else folders[0])])
+    
+    def rebuild_catalog(self):
+        """Reconcile the catalog with every known backup folder (in the background)"""
+        def do_rebuild():
+            added = removed = 0
+            try:
+                folders = self.core.known_folders()
+                for folder in folders:
+                    folder_added, folder_removed = self.core.index_folder(folder)
+                    added += folder_added
+                    removed += folder_removed
+                count, size = self.core.catalog.totals()
+                GLib.idle_add(
+                    self._show_notification,
+                    "Catalog Rebuilt ✓",
+                    f"Scanned {len(folders)} folder(s)\n{added} added, {removed} removed\n"
+                    f"{count} backup(s), {size/(1024*1024):.1f} MB"
+                )
+            except Exception as e:
+                GLib.idle_add(self._show_notification, "Catalog Rebuild Failed", str(e), False)
+        
+        thread = threading.Thread(target=do_rebuild)
+        thread.daemon = True
+        thread.start()
+    
+    def verify_backups(self):
+        """Re-check every backup against its checksum in the background
+        
+        Each backup is one low-priority scheduler job, so reads are spread
+        over the workers but bounded per device like backups. Problems are
+        listed in verify-report.txt in the config folder.
+        """
+        results = []
+        verified_chunks = set()
+        
+        def on_complete(batch):
+            summary, problems, report_path = self.core.write_verify_report(results, len(batch.cancelled))
+            msg = [summary]
+            for path, status, detail in problems[:5]:
+                msg.append(f"• {Path(path).name}: {status}")
+            if len(problems) > 5:
+                msg.append(f"…and {len(problems) - 5} more")
+            msg.append(f"Report: {report_path}")
+            title = "Backups Verified ✓" if not problems else "Damaged Backups Found"
+            GLib.idle_add(self._show_notification, title, "\n".join(msg), not problems)
+        
+        def start():
+            try:
+                for folder in self.core.known_folders():
+                    self.core.index_folder(folder)
+                rows = self.core.catalog.entries()
+            except Exception as e:
+                GLib.idle_add(self._show_notification, "Verification Failed", str(e), False)
+                return
+            if not rows:
+                GLib.idle_add(self._show_notification, "Nothing To Verify", "No backups found")
+                return
+            
+            batch = backup_core.BackupBatch(len(rows), on_complete)
+            for row in rows:
+                def do_verify(job, row=row):
+                    status, detail = self.core.verify_entry(row, verified_chunks, job)
+                    results.append((row["destination"], status, detail))
+                    return status in (backup_core.VERIFY_OK, backup_core.VERIFY_UNCHECKED), detail
+                
+                self.core.scheduler.submit(
+                    do_verify, f"Verify {Path(row['destination']).name}",
+                    row["destination"], priority=backup_core.PRIORITY_LOW, on_done=batch.job_done
+                )
+            GLib.idle_add(self._show_notification, "Verifying Backups...",
+                          f"Checking {len(rows)} backup(s) in the background")
+        
+        thread = threading.Thread(target=start)
+        thread.daemon = True
+        thread.start()
+    
+    def _start_watching(self):
+        """Resume watching the paths saved in watched.txt (idle callback)"""
+        try:
+            lines = self.watch_config.read_text().splitlines() if self.watch_config.exists() else []
+        except Exception as e:
+            logger.error(f"Failed to load watch list: {e}")
+            return False
+        for line in lines:
+            path = Path(line.strip())
+            if line.strip() and path.exists():
+                self.watcher.watch(path)
+        return False
+    
+    def _save_watch_list(self):
+        try:
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.watch_config.write_text("".join(f"{path}\n" for path in sorted(self.watcher.roots)))
+        except Exception as e:
+            logger.error(f"Failed to save watch list: {e}")
+    
+    def toggle_watch(self, menu, files):
+        """Start (or stop, if all are watched already) automatic backups of the selection"""
+        paths = [self._get_file_path(file_info) for file_info in files]
+        if all(self.watcher.is_watched(path) for path in paths):
+            for path in paths:
+                self.watcher.unwatch(path)
+            title, msg = "Auto-Backup Off", "Stopped watching"
+        else:
+            for path in paths:
+                self.watcher.watch(path)
+            title = "Auto-Backup On ✓"
+            msg = f"Backed up {WATCH_QUIET_PERIOD} s after changes stop:"
+        self._save_watch_list()
+        
+        names = ", ".join(path.name for path in paths[:3])
+        if len(paths) > 3:
+            names += f" and {len(paths) - 3} more"
+        self._show_notification(title, f"{msg}\n{names}")
+    
+    def _on_watch_quiet(self, path):
+        """Back up a watched path once it stopped changing (main loop)"""
+        if not path.exists():
+            return
+        if path in self._watch_running:
+            # Changed again while its last backup runs: try after it
+            self.watcher.touch(path)
+            return
+        self._watch_running.add(path)
+        
+        def do_backup(job):
+            try:
+                dest_path = path.parent / self.core.generate_backup_name(path)
+                success, error, backup_path = self.core.create_backup(path, dest_path, job)
+                if success:
+                    self.core.cleanup_old_backups(backup_path)
+                    self.core.stats.add("auto_backups")
+                elif not job.cancelled:
+                    GLib.idle_add(self._show_notification, "Auto-Backup Failed", f"{path.name}\n{error}", False)
+                return success, error
+            finally:
+                GLib.idle_add(self._watch_running.discard, path)
+        
+        self.core.scheduler.submit(do_backup, f"Auto-backup {path.name}", path.parent / path.name,
+                                   priority=backup_core.PRIORITY_LOW)
     
     def show_settings(self, menu, files):
         """Show settings window - Compatible with GTK 3 and 4"""
@@ -764,7 +1525,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         folder_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         
         folder_entry = Gtk.Entry()
-        folder_entry.set_text(str(self.backup_folder))
+        folder_entry.set_text(str(self.core.backup_folder))
         folder_entry.set_editable(False)
         folder_entry.set_hexpand(True)
         folder_box.append(folder_entry)
@@ -777,11 +1538,11 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
                     folder = dialog.select_folder_finish(task)
                     if folder:
                         new_path = Path(folder.get_path())
-                        self.backup_folder = new_path
+                        self.core.backup_folder = new_path
                         folder_entry.set_text(str(new_path))
                         
                         self.config_dir.mkdir(parents=True, exist_ok=True)
-                        self.config_file.write_text(str(new_path))
+                        self.core.config_file.write_text(str(new_path))
                         
                         self._show_notification(
                             "Settings Saved",
@@ -794,7 +1555,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             dialog.set_title("Select Backup Folder")
             
             try:
-                initial = Gio.File.new_for_path(str(self.backup_folder))
+                initial = Gio.File.new_for_path(str(self.core.backup_folder))
                 dialog.set_initial_folder(initial)
             except Exception as e:
                 logger.debug(f"Could not set initial folder: {e}")
@@ -844,7 +1605,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         folder_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         
         folder_entry = Gtk.Entry()
-        folder_entry.set_text(str(self.backup_folder))
+        folder_entry.set_text(str(self.core.backup_folder))
         folder_entry.set_editable(False)
         folder_entry.set_hexpand(True)
         folder_box.pack_start(folder_entry, True, True, 0)
@@ -862,16 +1623,16 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
                 )
             )
             
-            dialog.set_current_folder(str(self.backup_folder))
+            dialog.set_current_folder(str(self.core.backup_folder))
             response = dialog.run()
             
             if response == Gtk.ResponseType.OK:
                 new_path = Path(dialog.get_filename())
-                self.backup_folder = new_path
+                self.core.backup_folder = new_path
                 folder_entry.set_text(str(new_path))
                 
                 self.config_dir.mkdir(parents=True, exist_ok=True)
-                self.config_file.write_text(str(new_path))
+                self.core.config_file.write_text(str(new_path))
                 
                 self._show_notification(
                     "Settings Saved",
@@ -917,7 +1678,7 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             cleanup_check.set_label("Keep only last")
         else:
             cleanup_check.set_label("Keep only last")
-        cleanup_check.set_active(self.max_backups is not None)
+        cleanup_check.set_active(self.core.max_backups is not None)
         
         if gtk_version == 4:
             cleanup_box.append(cleanup_check)
@@ -927,8 +1688,8 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         cleanup_spin = Gtk.SpinButton()
         cleanup_spin.set_range(1, 100)
         cleanup_spin.set_increments(1, 5)
-        cleanup_spin.set_value(self.max_backups if self.max_backups else 10)
-        cleanup_spin.set_sensitive(self.max_backups is not None)
+        cleanup_spin.set_value(self.core.max_backups if self.core.max_backups else 10)
+        cleanup_spin.set_sensitive(self.core.max_backups is not None)
         
         if gtk_version == 4:
             cleanup_box.append(cleanup_spin)
@@ -944,13 +1705,13 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         def on_cleanup_toggled(check):
             cleanup_spin.set_sensitive(check.get_active())
             if check.get_active():
-                self.max_backups = int(cleanup_spin.get_value())
+                self.core.max_backups = int(cleanup_spin.get_value())
                 self.config_dir.mkdir(parents=True, exist_ok=True)
-                self.cleanup_config.write_text(str(self.max_backups))
+                self.core.cleanup_config.write_text(str(self.core.max_backups))
             else:
-                self.max_backups = None
-                if self.cleanup_config.exists():
-                    self.cleanup_config.unlink()
+                self.core.max_backups = None
+                if self.core.cleanup_config.exists():
+                    self.core.cleanup_config.unlink()
             
             self._show_notification(
                 "Settings Saved",
@@ -959,9 +1720,9 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         
         def on_value_changed(spin):
             if cleanup_check.get_active():
-                self.max_backups = int(spin.get_value())
+                self.core.max_backups = int(spin.get_value())
                 self.config_dir.mkdir(parents=True, exist_ok=True)
-                self.cleanup_config.write_text(str(self.max_backups))
+                self.core.cleanup_config.write_text(str(self.core.max_backups))
         
         cleanup_check.connect("toggled", on_cleanup_toggled)
         cleanup_spin.connect("value-changed", on_value_changed)
@@ -977,6 +1738,161 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             cleanup_hint.set_margin_left(15)
         add_widget(cleanup_hint)
         
+        gfs_check = Gtk.CheckButton()
+        gfs_check.set_label("Thin out older backups (hourly for a week, daily for a month, then weekly and monthly)")
+        gfs_check.set_active(backup_core.parse_retention(self.core.retention_spec).tiers is not None)
+        
+        def on_gfs_toggled(check):
+            rules = [rule.strip() for rule in self.core.retention_spec.split(',')
+                     if rule.strip() and rule.strip().lower() != "gfs"]
+            if check.get_active():
+                rules.insert(0, "gfs")
+            self.core.retention_spec = ",".join(rules)
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.core.retention_config.write_text(self.core.retention_spec)
+            
+            self._show_notification(
+                "Settings Saved",
+                f"Tiered retention: {'Enabled' if check.get_active() else 'Disabled'}"
+            )
+        
+        gfs_check.connect("toggled", on_gfs_toggled)
+        add_widget(gfs_check)
+        
+        gfs_hint = Gtk.Label()
+        gfs_hint.set_markup("<small>Everything from the last 24 hours is kept. Size caps: add e.g. "
+                            "<tt>item:2G,folder:50G</tt> to retention.txt</small>")
+        gfs_hint.set_halign(Gtk.Align.START)
+        if gtk_version == 4:
+            gfs_hint.set_margin_start(15)
+        else:
+            gfs_hint.set_margin_left(15)
+        add_widget(gfs_hint)
+        
+        # Storage mode section
+        storage_label = Gtk.Label()
+        storage_label.set_markup("<b>Storage:</b>")
+        storage_label.set_halign(Gtk.Align.START)
+        add_widget(storage_label)
+        
+        repository_check = Gtk.CheckButton()
+        repository_check.set_label("Deduplicating repository (store identical data only once)")
+        repository_check.set_active(self.core.repository_mode)
+        
+        def on_repository_toggled(check):
+            self.core.repository_mode = check.get_active()
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.core.storage_config.write_text("repository" if self.core.repository_mode else "files")
+            
+            self._show_notification(
+                "Settings Saved",
+                f"Repository mode: {'Enabled' if self.core.repository_mode else 'Disabled'}"
+            )
+        
+        repository_check.connect("toggled", on_repository_toggled)
+        add_widget(repository_check)
+        
+        storage_hint = Gtk.Label()
+        storage_hint.set_markup(f"<small>Backups become small {backup_core.MANIFEST_SUFFIX} manifests, data is kept in "
+                                f"{backup_core.STORE_DIRNAME} inside the backup folder</small>")
+        storage_hint.set_halign(Gtk.Align.START)
+        if gtk_version == 4:
+            storage_hint.set_margin_start(15)
+        else:
+            storage_hint.set_margin_left(15)
+        add_widget(storage_hint)
+        
+        incremental_check = Gtk.CheckButton()
+        incremental_check.set_label("Incremental folder backups (archive only what changed)")
+        incremental_check.set_active(self.core.incremental_mode is not None)
+        
+        def on_incremental_toggled(check):
+            self.core.incremental_mode = "on" if check.get_active() else None
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.core.incremental_config.write_text(self.core.incremental_mode or "off")
+            
+            self._show_notification(
+                "Settings Saved",
+                f"Incremental backups: {'Enabled' if check.get_active() else 'Disabled'}"
+            )
+        
+        incremental_check.connect("toggled", on_incremental_toggled)
+        add_widget(incremental_check)
+        
+        unchanged_check = Gtk.CheckButton()
+        unchanged_check.set_label("Don't copy unchanged items again (link to their last backup)")
+        unchanged_check.set_active(self.core.unchanged_mode != "off")
+        
+        def on_unchanged_toggled(check):
+            self.core.unchanged_mode = "link" if check.get_active() else "off"
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.core.unchanged_config.write_text(
+                self.core.unchanged_mode + (":hash" if self.core.unchanged_hash else "")
+            )
+            
+            self._show_notification(
+                "Settings Saved",
+                f"Unchanged detection: {'Enabled' if check.get_active() else 'Disabled'}"
+            )
+        
+        unchanged_check.connect("toggled", on_unchanged_toggled)
+        add_widget(unchanged_check)
+        
+        delta_check = Gtk.CheckButton()
+        min_size = backup_core.format_size(backup_core.DELTA_MIN_SIZE)
+        delta_check.set_label(f"Delta backups of large files (over {min_size}, only changes are stored)")
+        delta_check.set_active(self.core.delta_mode)
+        
+        def on_delta_toggled(check):
+            self.core.delta_mode = check.get_active()
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.core.delta_config.write_text("on" if self.core.delta_mode else "off")
+            
+            self._show_notification(
+                "Settings Saved",
+                f"Delta backups: {'Enabled' if self.core.delta_mode else 'Disabled'}"
+            )
+        
+        delta_check.connect("toggled", on_delta_toggled)
+        add_widget(delta_check)
+        
+        codec_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        codec_label = Gtk.Label(label="Folder compression:")
+        
+        codec_combo = Gtk.ComboBoxText()
+        codec_options = [
+            ("auto", "Automatic (skip already-compressed data)"),
+            ("gzip:6", "gzip (.tar.gz)"),
+            ("gzip:1", "gzip, fastest (.tar.gz)"),
+            ("xz:6", "xz, smallest (.tar.xz)"),
+            ("none", "None (.tar)"),
+        ]
+        if backup_core.zstandard is not None:
+            codec_options.insert(2, ("zstd:3", "zstd (.tar.zst)"))
+        for codec_id, codec_text in codec_options:
+            codec_combo.append(codec_id, codec_text)
+        if not codec_combo.set_active_id(self.core.codec.spec):
+            codec_combo.append(self.core.codec.spec, f"Custom ({self.core.codec.spec})")
+            codec_combo.set_active_id(self.core.codec.spec)
+        
+        def on_codec_changed(combo):
+            spec = combo.get_active_id()
+            if not spec:
+                return
+            self.core.codec = backup_core.parse_codec(spec)
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            self.core.codec_config.write_text(spec)
+        
+        codec_combo.connect("changed", on_codec_changed)
+        
+        if gtk_version == 4:
+            codec_box.append(codec_label)
+            codec_box.append(codec_combo)
+        else:
+            codec_box.pack_start(codec_label, False, False, 0)
+            codec_box.pack_start(codec_combo, False, False, 0)
+        add_widget(codec_box)
+        
         sep3 = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL)
         add_widget(sep3)
         
@@ -992,8 +1908,8 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         else:
             stats_box.set_margin_left(15)
         
-        total_backups = self.stats.get("total_backups", 0)
-        total_size = self.stats.get("total_size", 0)
+        total_backups = self.core.stats.get("total_backups", 0)
+        total_size = self.core.stats.get("total_size", 0)
         
         # Format size
         if total_size < 1024*1024:
@@ -1008,6 +1924,20 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             f"Total space used: {size_str}"
         ]
         
+        try:
+            catalog_count, catalog_size = self.core.catalog.totals()
+            stats_text.append(f"Backups on disk: {catalog_count} ({catalog_size/(1024*1024):.1f} MB)")
+        except Exception as e:
+            logger.error(f"Failed to read catalog: {e}")
+        
+        copy_methods = self.core.stats.get("copy_methods", {})
+        if copy_methods:
+            stats_text.append(
+                f"Instant copies (reflink): {copy_methods.get('reflink', 0)}, "
+                f"in-kernel: {copy_methods.get('copy_file_range', 0) + copy_methods.get('sendfile', 0)}, "
+                f"sparse: {copy_methods.get('sparse', 0)}, buffered: {copy_methods.get('buffered', 0)}"
+            )
+        
         for stat in stats_text:
             label = Gtk.Label(label=stat)
             label.set_halign(Gtk.Align.START)
@@ -1018,6 +1948,82 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         
         add_widget(stats_box)
         
+        # Recent operations section (percentiles from the metrics log)
+        metrics_label = Gtk.Label()
+        metrics_label.set_markup("<b>Recent Operations:</b>")
+        metrics_label.set_halign(Gtk.Align.START)
+        add_widget(metrics_label)
+        
+        metrics_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
+        if gtk_version == 4:
+            metrics_box.set_margin_start(15)
+        else:
+            metrics_box.set_margin_left(15)
+        
+        try:
+            summary = self.core.metrics.summary()
+        except Exception as e:
+            logger.error(f"Failed to read metrics: {e}")
+            summary = {}
+        metrics_text = []
+        for operation in backup_core.METRICS_OPERATIONS:
+            if operation not in summary:
+                continue
+            entry = summary[operation]
+            line = (f"{operation.capitalize()}: {entry['count']} · p50 {entry['p50']:.2f} s · "
+                    f"p90 {entry['p90']:.2f} s · p99 {entry['p99']:.2f} s")
+            if entry['mb_per_s']:
+                line += f" · {entry['mb_per_s']:.0f} MB/s"
+            if entry['ratio'] and operation == "backup":
+                line += f" · {entry['ratio']:.1f}× compression"
+            metrics_text.append(line)
+            if operation == "backup":
+                shares = ", ".join(f"{phase} {share:.0%}" for phase, share in entry['phases'].items() if share >= 0.01)
+                metrics_text.append(f"    Time spent: {shares}")
+        if not metrics_text:
+            metrics_text.append("No operations recorded yet")
+        
+        for text in metrics_text:
+            label = Gtk.Label(label=text)
+            label.set_halign(Gtk.Align.START)
+            if gtk_version == 4:
+                metrics_box.append(label)
+            else:
+                metrics_box.pack_start(label, False, False, 0)
+        
+        export_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        export_label = Gtk.Label(label="Prometheus textfile:")
+        export_entry = Gtk.Entry()
+        export_entry.set_hexpand(True)
+        export_entry.set_placeholder_text("/var/lib/node_exporter/textfile/nautilus_backup.prom")
+        export_entry.set_tooltip_text("Export metrics for node_exporter's textfile collector (press Enter to save)")
+        export_entry.set_text(str(self.core.metrics_export or ""))
+        
+        def on_export_activate(entry):
+            text = entry.get_text().strip()
+            self.config_dir.mkdir(parents=True, exist_ok=True)
+            if text:
+                self.core.metrics_export_config.write_text(text)
+            elif self.core.metrics_export_config.exists():
+                self.core.metrics_export_config.unlink()
+            self.core.metrics_export = Path(text).expanduser() if text else None
+            self.core.metrics.export_path = self.core.metrics_export
+            self.core.metrics.export()
+            self._show_notification("Settings Saved", f"Metrics export: {text or 'Disabled'}")
+        
+        export_entry.connect("activate", on_export_activate)
+        
+        if gtk_version == 4:
+            export_box.append(export_label)
+            export_box.append(export_entry)
+            metrics_box.append(export_box)
+        else:
+            export_box.pack_start(export_label, False, False, 0)
+            export_box.pack_start(export_entry, True, True, 0)
+            metrics_box.pack_start(export_box, False, False, 0)
+        
+        add_widget(metrics_box)
+        
         sep4 = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL)
         add_widget(sep4)
         
@@ -1038,12 +2044,21 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
             "💾 Backup As - Choose custom name and location",
             "🗂️ Backup to ~/Backups - Organized storage",
             "♻️ Restore from Backup - Right-click backup files to restore",
+            "📂 Restore Single Item - Get one file back from a folder archive",
             "🔍 Compare with Original - See differences using meld/diff",
             "📜 View All Backups - Browse backup history per file",
-            "📁 Folder support - Automatic .tar.gz compression",
+            "🗃️ Backup catalog - Indexed history across all backup folders",
+            "🛡️ Checksums - Every backup is hashed as it is written and can be verified",
+            "🔗 Unchanged detection - Untouched items are linked, not copied again",
+            "🧬 Delta backups - Large files store only the chunks that changed",
+            "👁️ Auto-backup - Watched files and folders are backed up after edits",
+            "📁 Folder support - .tar.gz, .tar.zst, .tar.xz or .tar archives",
             "⏳ Progress notifications - For large operations",
-            "🗑️ Auto-cleanup - Keep only recent backups",
+            "🗑️ Auto-cleanup - Keep last N, thin out by age (GFS) and cap sizes",
+            "🧩 Repository mode - Deduplicated storage for repeated backups",
+            "📈 Incremental folders - Archive only changed files",
             "📊 Statistics - Track total backups and space used",
+            "⏱️ Metrics - Time, throughput and compression of every operation",
             "🔔 Desktop notifications - Status feedback"
         ]
         
@@ -1083,7 +2098,8 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         
         open_btn = Gtk.Button(label="Open Backups Folder")
         def on_open_clicked(button):
-            subprocess.Popen(['nautilus', str(self.backup_folder)])
+            self.core.backup_folder.mkdir(parents=True, exist_ok=True)
+            subprocess.Popen(['nautilus', str(self.core.backup_folder)])
         open_btn.connect("clicked", on_open_clicked)
         
         if gtk_version == 4:
@@ -1091,6 +2107,28 @@ class BackupExtension(GObject.GObject, Nautilus.MenuProvider):
         else:
             bottom_box.pack_start(open_btn, False, False, 0)
         
+        rebuild_btn = Gtk.Button(label="Rebuild Catalog")
+        rebuild_btn.set_tooltip_text("Re-scan all backup folders and update the backup index")
+        def on_rebuild_clicked(button):
+            self.rebuild_catalog()
+        rebuild_btn.connect("clicked", on_rebuild_clicked)
+        
+        if gtk_version == 4:
+            bottom_box.append(rebuild_btn)
+        else:
+            bottom_box.pack_start(rebuild_btn, False, False, 0)
+        
+        verify_btn = Gtk.Button(label="Verify Backups")
+        verify_btn.set_tooltip_text("Check every backup against its checksum and report damaged ones")
+        def on_verify_clicked(button):
+            self.verify_backups()
+        verify_btn.connect("clicked", on_verify_clicked)
+        
+        if gtk_version == 4:
+            bottom_box.append(verify_btn)
+        else:
+            bottom_box.pack_start(verify_btn, False, False, 0)
+        
         close_btn = Gtk.Button(label="Close")
         def on_close_clicked(button):
             window.close() if gtk_version == 4 else window.destroy()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+nautilus-backup: the Nautilus Backup Extension's backups from a terminal
+
+Uses the extension's settings (~/.config/nautilus-backup), catalog and
+naming, so backups made here show up in Nautilus and the other way round.
+Meant for cron jobs, scripts and CI: paths can come from stdin, several
+backups run at once, and --json prints one machine-readable report.
+
+Examples:
+    nautilus-backup backup ~/Documents/report.odt ~/Projects/site
+    find ~/Photos -name '*.raw' -print0 | nautilus-backup backup --null --to /mnt/usb -
+    nautilus-backup --json verify
+    nautilus-backup prune --keep-last 5 ~/Backups
+"""
+
+import argparse
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+
+from nautilus_backup_core import (
+    MAX_BACKUP_WORKERS,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    VERIFY_OK,
+    VERIFY_UNCHECKED,
+    BackupBatch,
+    BackupCore,
+)
+
+logger = logging.getLogger("nautilus-backup")
+
+# Exit statuses
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+class UsageError(Exception):
+    """Bad arguments or input, reported with exit status 2"""
+
+
+def read_paths(args):
+    """Paths from the command line, or from stdin when given "-" (or nothing, with stdin piped)"""
+    paths = list(args.paths)
+    if paths in (["-"], []) and (paths or not sys.stdin.isatty()):
+        data = sys.stdin.read()
+        paths = data.split("\0") if args.null else data.splitlines()
+    return [Path(p).expanduser() for p in paths if p]
+
+
+def run_jobs(core, items, submit):
+    """Submit one scheduler job per item and wait for all of them
+
+    submit(item, on_done) must queue the job and return it. Ctrl+C cancels
+    what is still running or queued.
+
+    Returns:
+        tuple: ([(item, job)], interrupted)
+    """
+    if not items:
+        return [], False
+    done = threading.Event()
+    batch = BackupBatch(len(items), lambda batch: done.set())
+    jobs = [(item, submit(item, batch.job_done)) for item in items]
+    try:
+        done.wait()
+        return jobs, False
+    except KeyboardInterrupt:
+        core.scheduler.cancel()
+        done.wait()
+        return jobs, True
+
+
+def job_result(job, **fields):
+    """Report entry for a finished job: fields plus status, error and timings"""
+    success, error = job.result or (False, job.error)
+    if job.state == "cancelled" or job.cancelled:
+        status = "cancelled"
+    else:
+        status = "ok" if success else "failed"
+    fields.update(status=status, error=None if status == "ok" else error or job.state,
+                  bytes=0, files=0, seconds=0)
+    if job.started:
+        snapshot = job.progress.snapshot()
+        fields.update(bytes=snapshot["bytes_done"], files=snapshot["files_done"],
+                      seconds=round(job.finished - job.started, 3))
+    return fields
+
+
+def command_backup(core, args):
+    sources = read_paths(args)
+    if not sources:
+        raise UsageError("no paths to back up")
+    missing = [str(p) for p in sources if not p.exists()]
+    if missing:
+        raise UsageError(f"not found: {', '.join(missing[:5])}")
+    if args.home:
+        args.to = core.backup_folder
+    destinations = {}
+    # Names handed out per destination folder, so same-named sources (a/x.txt
+    # and b/x.txt --to DIR) finishing in the same second don't overwrite each other
+    taken = collections.defaultdict(set)
+
+    def submit(source, on_done):
+        dest_dir = Path(args.to) if args.to else source.parent
+        name = core.unique_backup_name(source, dest_dir, taken[dest_dir])
+        taken[dest_dir].add(name)
+
+        def do_backup(job):
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            dest_path = destinations[job.id] = dest_dir / name
+            success, error, backup_path = core.create_backup(source, dest_path, job)
+            if success:
+                # A delta or skipped backup isn't at dest_path
+                destinations[job.id] = backup_path
+            return success, error
+
+        return core.scheduler.submit(do_backup, source.name, dest_dir / source.name,
+                                     priority=PRIORITY_NORMAL, on_done=on_done)
+
+    jobs, interrupted = run_jobs(core, sources, submit)
+    results = [job_result(job, source=str(source), backup=str(destinations[job.id]))
+               if job.id in destinations else job_result(job, source=str(source), backup=None)
+               for source, job in jobs]
+
+    # Retention right away rather than after the extension's delay
+    deleted = 0
+    folders = {destinations[job.id].parent for (_source, job), result in zip(jobs, results)
+               if result["status"] == "ok"}
+    if folders and not args.no_prune and not interrupted and core.retention_policy().active:
+        deleted = core.apply_retention(folders)
+    return results, {"pruned": deleted}, interrupted
+
+
+def command_restore(core, args):
+    backups = read_paths(args)
+    if not backups:
+        raise UsageError("no backups to restore")
+    not_backups = [str(p) for p in backups if not (p.exists() and core.get_original_filename(p))]
+    if not_backups:
+        raise UsageError(f"not a backup: {', '.join(not_backups[:5])}")
+    restored = {}
+
+    def submit(backup_path, on_done):
+        target_dir = Path(args.to) if args.to else None
+
+        def do_restore(job):
+            restored[backup_path] = core.restore(backup_path, target_dir, job.checkpoint)
+            return True, None
+
+        return core.scheduler.submit(do_restore, f"Restore {backup_path.name}", args.to or backup_path,
+                                     priority=PRIORITY_HIGH, on_done=on_done)
+
+    jobs, interrupted = run_jobs(core, backups, submit)
+    results = [job_result(job, backup=str(backup_path),
+                          restored=str(restored[backup_path]) if backup_path in restored else None)
+               for backup_path, job in jobs]
+    return results, {}, interrupted
+
+
+def command_verify(core, args):
+    paths = read_paths(args) if args.paths else []
+    if paths:
+        rows = []
+        for path in paths:
+            if not core.catalog.is_indexed(path.parent):
+                core.index_folder(path.parent)
+            row = core.catalog.find(path)
+            if row is None:
+                raise UsageError(f"not a known backup: {path}")
+            rows.append(row)
+    else:
+        for folder in core.known_folders():
+            core.index_folder(folder)
+        rows = core.catalog.entries()
+    verified_chunks = set()
+    checks = {}
+
+    def submit(row, on_done):
+        def do_verify(job):
+            status, detail = checks[row["destination"]] = core.verify_entry(row, verified_chunks, job)
+            return status in (VERIFY_OK, VERIFY_UNCHECKED), detail
+
+        return core.scheduler.submit(do_verify, f"Verify {Path(row['destination']).name}",
+                                     row["destination"], priority=PRIORITY_NORMAL, on_done=on_done)
+
+    jobs, interrupted = run_jobs(core, rows, submit)
+    results = [job_result(job, backup=row["destination"], check=checks.get(row["destination"], (None,))[0])
+               for row, job in jobs]
+
+    extra = {}
+    if not paths:
+        # Same report as the extension's Verify Backups
+        checked = [(path, status, detail) for path, (status, detail) in checks.items()]
+        _summary, _problems, report_path = core.write_verify_report(
+            checked, sum(1 for r in results if r["status"] == "cancelled")
+        )
+        extra["report"] = str(report_path)
+    return results, extra, interrupted
+
+
+def command_prune(core, args):
+    if args.keep_last is not None:
+        core.max_backups = args.keep_last or None
+    if args.retention is not None:
+        core.retention_spec = args.retention
+    if not core.retention_policy().active:
+        raise UsageError("no retention rules set (see --keep-last and --retention)")
+    folders = read_paths(args) if args.paths else core.known_folders()
+    start = time.monotonic()
+    deleted = core.apply_retention(folders)
+    result = {"status": "ok", "error": None, "folders": len(folders), "deleted": deleted,
+              "seconds": round(time.monotonic() - start, 3)}
+    return [result], {}, False
+
+
+def describe(command, result):
+    """One line of plain output for a result"""
+    status = result["status"]
+    if command == "backup":
+        line = f"{result['source']} -> {result['backup']}" if status == "ok" else result["source"]
+    elif command == "restore":
+        line = f"{result['backup']} -> {result['restored']}" if status == "ok" else result["backup"]
+    elif command == "verify":
+        status = result["check"] or status
+        line = result["backup"]
+    else:
+        line = f"{result['deleted']} backup(s) deleted in {result['folders']} folder(s)"
+    if result["error"] and status != "ok":
+        line += f": {result['error']}"
+    return f"{status.upper():10} {line}"
+
+
+def add_common_options(parser):
+    parser.add_argument("--config", metavar="DIR", help="settings folder (default: ~/.config/nautilus-backup)")
+    parser.add_argument("-j", "--jobs", type=int, metavar="N",
+                        help=f"backups run at once (default: {MAX_BACKUP_WORKERS})")
+    parser.add_argument("--device-jobs", type=int, metavar="N",
+                        help="backups writing to the same disk at once (default: by disk type)")
+    parser.add_argument("--json", action="store_true", help="print one JSON report instead of text")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log each step to stderr")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="nautilus-backup",
+        description="Back up, restore, verify and prune backups like the Nautilus Backup Extension.",
+    )
+    add_common_options(parser)
+    parser.set_defaults(jobs=MAX_BACKUP_WORKERS)
+
+    # The same options after the command (only the ones given override)
+    common = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    add_common_options(common)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_paths(command, what):
+        command.add_argument("paths", nargs="*", metavar="PATH",
+                             help=f"{what}; '-' or a pipe reads them from stdin, one per line")
+        command.add_argument("-0", "--null", action="store_true",
+                             help="stdin paths are separated by NUL characters (find -print0)")
+
+    backup = commands.add_parser("backup", parents=[common], help="back up files and folders")
+    add_paths(backup, "files and folders")
+    where = backup.add_mutually_exclusive_group()
+    where.add_argument("--to", metavar="DIR", help="write backups into DIR (default: next to each source)")
+    where.add_argument("--home", action="store_true", help="write backups into the configured backup folder")
+    backup.add_argument("--no-prune", action="store_true", help="don't apply the retention rules afterwards")
+
+    restore = commands.add_parser("restore", parents=[common], help="restore backups")
+    add_paths(restore, "backup files")
+    restore.add_argument("--to", metavar="DIR", help="restore into DIR (default: where the source was)")
+
+    verify = commands.add_parser("verify", parents=[common], help="check backups against their checksums")
+    add_paths(verify, "backup files (default: every backup in the catalog)")
+
+    prune = commands.add_parser("prune", parents=[common], help="delete old backups by the retention rules")
+    add_paths(prune, "folders (default: every folder in the catalog)")
+    prune.add_argument("--keep-last", type=int, metavar="N", help="keep the last N backups of each item")
+    prune.add_argument("--retention", metavar="RULES", help="retention rules, e.g. 'gfs,item:2G,folder:50G'")
+    return parser
+
+
+COMMANDS = {
+    "backup": command_backup,
+    "restore": command_restore,
+    "verify": command_verify,
+    "prune": command_prune,
+}
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - NautilusBackup - %(levelname)s - %(message)s'
+    )
+    if args.jobs < 1 or (args.device_jobs is not None and args.device_jobs < 1):
+        parser.error("--jobs and --device-jobs must be at least 1")
+
+    core = BackupCore(args.config, max_workers=args.jobs, device_jobs=args.device_jobs)
+    start = time.monotonic()
+    try:
+        results, extra, interrupted = COMMANDS[args.command](core, args)
+    except UsageError as e:
+        parser.error(str(e))
+    finally:
+        core.close()
+
+    failed = sum(1 for r in results if r["status"] != "ok")
+    if args.json:
+        report = {"command": args.command, "results": results, "succeeded": len(results) - failed,
+                  "failed": failed, "seconds": round(time.monotonic() - start, 3), **extra}
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        for result in results:
+            print(describe(args.command, result))
+        if len(results) > 1:
+            print(f"{len(results) - failed} ok, {failed} failed")
+        if extra.get("pruned"):
+            print(f"{extra['pruned']} old backup(s) deleted")
+        if extra.get("report"):
+            print(f"Report: {extra['report']}")
+
+    if interrupted:
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4375 @@
+#!/usr/bin/env python3
+"""
+Nautilus Backup core
+
+Everything the extension does that needs no desktop session: the copy
+engine, archives, chunk repository, deltas, catalog, retention, scheduler
+and BackupCore, which ties them to the settings in ~/.config/nautilus-backup.
+Used by nautilus-backup.py and the nautilus-backup command line tool.
+"""
+
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
+import tarfile
+import threading
+import re
+import logging
+import atexit
+import collections
+import contextlib
+import errno
+import fcntl
+import grp
+import hashlib
+import heapq
+import io
+import json
+import lzma
+import pwd
+import queue
+import sqlite3
+import stat
+import struct
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional: .tar.zst archives need python3-zstandard
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Copy engine
+# ---------------------------------------------------------------------------
+
+# ioctl that shares extents between two files (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Errors meaning "this kernel path is not available here", not "copy failed"
+_COPY_FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+    errno.ENOTSUP, errno.ENOTSOCK, errno.EBADF, errno.EPERM,
+}
+
+# Sparse files (VM images, databases): files from SPARSE_MIN_SIZE up that
+# have fewer blocks allocated than their size are copied extent by extent,
+# and all-zero blocks of HOLE_MIN_SIZE written by _HoleWriter are left as holes
+SPARSE_MIN_SIZE = 1024 * 1024
+HOLE_MIN_SIZE = 64 * 1024
+_ZEROS = bytes(1024 * 1024)
+
+
+def _ignore_progress(count):
+    pass
+
+
+def may_have_holes(st):
+    """Whether a stat result is of a file worth looking for holes in"""
+    return stat.S_ISREG(st.st_mode) and st.st_size >= SPARSE_MIN_SIZE and st.st_blocks * 512 < st.st_size
+
+
+def data_extents(fd, size):
+    """[(offset, length)] of the data in the first size bytes of a file with holes
+
+    Found with SEEK_DATA/SEEK_HOLE. Returns None when the file turns out to
+    have no holes, or the filesystem can't tell.
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return None
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Nothing but a hole up to the end
+                    break
+                raise
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            extents.append((start, end - start))
+            offset = end
+    except OSError:
+        return None
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+    if sum(length for _offset, length in extents) >= size:
+        return None
+    return extents
+
+
+def _hash_zeros(hasher, count):
+    """Update hasher with count zero bytes (what a hole reads as)"""
+    zeros = memoryview(_ZEROS)
+    while count > 0:
+        hasher.update(zeros[:min(count, len(zeros))])
+        count -= len(zeros)
+
+
+def _copy_extents(src_fd, dst_fd, extents, size, progress, hasher=None):
+    """Copy only the data extents of a file, leaving the holes between them as holes
+
+    Holes count towards progress as if they were copied, and are hashed as
+    the zeros they read as.
+    """
+    metrics = current_metrics()
+    kernel = hasher is None and hasattr(os, 'copy_file_range')
+    copied = position = 0
+    start = time.perf_counter()
+    try:
+        for offset, length in extents + [(size, 0)]:
+            if hasher:
+                _hash_zeros(hasher, offset - position)
+            progress(offset - position)
+            end = offset + length
+            while offset < end:
+                count = min(end - offset, COPY_CHUNK_SIZE)
+                if kernel:
+                    try:
+                        count = os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+                    except OSError as e:
+                        if e.errno not in _COPY_FALLBACK_ERRNOS:
+                            raise
+                        kernel = False
+                        continue
+                else:
+                    data = memoryview(os.pread(src_fd, count, offset))
+                    if hasher:
+                        hasher.update(data)
+                    written = 0
+                    while written < len(data):
+                        written += os.pwrite(dst_fd, data[written:], offset + written)
+                    count = len(data)
+                if count == 0:
+                    raise ValueError(f"File shrank while being copied (expected {size} bytes)")
+                offset += count
+                copied += count
+                progress(count)
+            position = end
+        os.ftruncate(dst_fd, size)
+    finally:
+        if metrics:
+            metrics.add("copy", time.perf_counter() - start, read=copied, written=copied)
+
+
+class _HoleWriter:
+    """Write-through file object that seeks over all-zero blocks instead of writing them
+
+    For files rebuilt from other data (deltas, chunks), where there are no
+    extents to copy. finish() must be called last: it sets the file's size,
+    which a trailing hole doesn't.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        size = len(data)
+        written = 0
+        for start in range(0, size - HOLE_MIN_SIZE + 1, HOLE_MIN_SIZE):
+            end = start + HOLE_MIN_SIZE
+            if data.count(0, start, end) == HOLE_MIN_SIZE:
+                if written < start:
+                    self.fileobj.write(data[written:start])
+                self.fileobj.seek(HOLE_MIN_SIZE, os.SEEK_CUR)
+                written = end
+        if written < size:
+            self.fileobj.write(data[written:] if written else data)
+        return size
+
+    def finish(self):
+        self.fileobj.truncate()
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def _copy_fileobj_fast(fsrc, fdst, progress=None, hasher=None):
+    """Copy an open file, trying reflink, copy_file_range and sendfile first
+
+    Each fallback continues from the current file offsets, so a path that
+    stops working half way through is picked up by the next one.
+    progress(count) is called as bytes are copied and may raise to abort.
+    With a hasher (hashlib object) the data is hashed as it is copied: the
+    in-kernel paths never see it, so only reflink and the buffered loop are
+    used and a file is never read twice. A file with holes that can't be
+    reflinked has only its data extents copied, so it stays sparse.
+
+    Returns:
+        str: method used ('reflink', 'sparse', 'copy_file_range', 'sendfile' or 'buffered')
+    """
+    progress = progress or _ignore_progress
+    metrics = current_metrics()
+    src_fd = fsrc.fileno()
+    dst_fd = fdst.fileno()
+    st = os.fstat(src_fd)
+    size = st.st_size
+
+    start = time.perf_counter()
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        if metrics:
+            metrics.add("copy", time.perf_counter() - start, written=size)
+        progress(size)
+        if hasher:
+            # Nothing was read to share the extents, hash them once
+            for block in iter(lambda: fsrc.read(COPY_CHUNK_SIZE), b''):
+                hasher.update(block)
+        return "reflink"
+    except OSError:
+        pass
+
+    extents = data_extents(src_fd, size) if may_have_holes(st) else None
+    if extents is not None:
+        _copy_extents(src_fd, dst_fd, extents, size, progress, hasher)
+        return "sparse"
+
+    if hasher:
+        for block in iter(lambda: fsrc.read(COPY_CHUNK_SIZE), b''):
+            hasher.update(block)
+            fdst.write(block)
+            progress(len(block))
+        return "buffered"
+
+    if hasattr(os, 'copy_file_range'):
+        copied = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                count = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+                if count == 0:
+                    break
+                copied += count
+                progress(count)
+            # Some pseudo filesystems report EOF immediately, don't trust that
+            if copied or not size:
+                return "copy_file_range"
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+        finally:
+            if metrics:
+                metrics.add("copy", time.perf_counter() - start, read=copied, written=copied)
+
+    copied = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            count = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
+            if count == 0:
+                break
+            copied += count
+            progress(count)
+        if os.lseek(dst_fd, 0, os.SEEK_CUR) >= size:
+            return "sendfile"
+    except OSError as e:
+        if e.errno not in _COPY_FALLBACK_ERRNOS:
+            raise
+    finally:
+        if metrics:
+            metrics.add("copy", time.perf_counter() - start, read=copied, written=copied)
+
+    for block in iter(lambda: fsrc.read(COPY_CHUNK_SIZE), b''):
+        fdst.write(block)
+        progress(len(block))
+    return "buffered"
+
+
+def copy_file(source, destination, progress=None, hasher=None):
+    """Copy a file with shutil.copy2 semantics using the fastest available path
+
+    hasher, if given, is updated with the file's contents in the same pass.
+
+    Returns:
+        str: method used ('reflink', 'sparse', 'copy_file_range', 'sendfile' or 'buffered')
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        raise shutil.SameFileError(f"{source} and {destination} are the same file")
+
+    with open(source, 'rb') as fsrc, open(destination, 'wb') as fdst:
+        method = _copy_fileobj_fast(metered(fsrc), metered(fdst), progress, hasher)
+    shutil.copystat(source, destination)
+    _count_file()
+    return method
+
+
+def walk_tree(root, arcname, onerror=None):
+    """Yield (path, arcname, stat) for root and everything below it
+
+    Depth first with each folder's entries in name order, the order
+    tarfile.add() uses, so a parent always comes before its contents.
+    Built on os.scandir: the lstat of each entry is the one DirEntry
+    caches, and only the listings of the folders on the current path are
+    kept, so memory doesn't grow with the number of entries. Symlinks are not
+    followed, except a root that is one. Errors listing a folder or
+    stat-ing an entry are raised, or passed to onerror(error) and the
+    entry skipped.
+    """
+    root = os.fspath(root)
+    try:
+        st = os.stat(root)
+    except OSError as e:
+        if onerror is None:
+            raise
+        onerror(e)
+        return
+    yield root, arcname, st
+    if not stat.S_ISDIR(st.st_mode):
+        return
+
+    def listing(path, name):
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            if onerror is None:
+                raise
+            onerror(e)
+            return
+        for entry in entries:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError as e:
+                if onerror is None:
+                    raise
+                onerror(e)
+                continue
+            yield entry.path, f"{name}/{entry.name}", st
+
+    folders = [listing(root, arcname)]
+    while folders:
+        item = next(folders[-1], None)
+        if item is None:
+            folders.pop()
+            continue
+        yield item
+        if stat.S_ISDIR(item[2].st_mode):
+            folders.append(listing(item[0], item[1]))
+
+
+# ---------------------------------------------------------------------------
+# Compression codecs and parallel compression
+# ---------------------------------------------------------------------------
+
+COMPRESS_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CODEC = "gzip:6"
+
+# Folder archiving (see add_tree): entries walked ahead of the writer, in
+# batches, and small files read ahead in parallel (at most WALK_QUEUE_SIZE
+# of them, so the prefetched data stays under WALK_QUEUE_SIZE * PREFETCH_MAX_SIZE)
+WALK_BATCH = 64
+WALK_QUEUE_SIZE = 256
+PREFETCH_MAX_SIZE = 64 * 1024
+PREFETCH_WORKERS = 4
+
+# Adaptive mode stores a block as-is when a level 1 deflate of a sample of it
+# saves less than this fraction (JPEG, MP4, zip, .tar.gz, ...)
+INCOMPRESSIBLE_SAMPLE_SIZE = 64 * 1024
+INCOMPRESSIBLE_RATIO = 0.95
+
+
+def _looks_incompressible(data):
+    """Sample the start and middle of a block with a cheap compression pass"""
+    if len(data) <= 2 * INCOMPRESSIBLE_SAMPLE_SIZE:
+        sample = data
+    else:
+        middle = len(data) // 2
+        sample = data[:INCOMPRESSIBLE_SAMPLE_SIZE] + data[middle:middle + INCOMPRESSIBLE_SAMPLE_SIZE]
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * INCOMPRESSIBLE_RATIO
+
+
+class Codec:
+    """Uncompressed tar; base class for the block codecs
+
+    A codec turns consecutive blocks of the tar stream into compressed bytes
+    that, concatenated between header() and trailer(), form a valid file of
+    its format. Blocks are compressed concurrently by ParallelCompressWriter.
+    Unless uses_dictionary is set, each compressed block can be decoded on
+    its own with decompress_block() (see SeekableArchive).
+    """
+
+    name = "none"
+    extension = ".tar"
+    default_level = None
+    # Whether compress_block() uses the tail of the previous block
+    uses_dictionary = False
+
+    def __init__(self, level=None, adaptive=False):
+        self.level = self.default_level if level is None else level
+        self.adaptive = adaptive
+
+    @property
+    def spec(self):
+        if self.adaptive:
+            return "auto" if self.level == GzipCodec.default_level else f"auto:{self.level}"
+        return self.name if self.level is None else f"{self.name}:{self.level}"
+
+    def header(self):
+        return b''
+
+    def compress_block(self, data, dictionary, last):
+        return data
+
+    def decompress_block(self, data):
+        return data
+
+    def trailer(self, crc, size):
+        return b''
+
+
+class GzipCodec(Codec):
+    """Single gzip member built from sync-flushed deflate blocks (like pigz --independent)
+
+    Blocks aren't primed with the previous block's data, so each one can be
+    inflated on its own at a small cost in compression ratio.
+    """
+
+    name = "gzip"
+    extension = ".tar.gz"
+    default_level = 6
+
+    def header(self):
+        # Magic, deflate, no flags, mtime, no extra flags, Unix
+        return b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\x03'
+
+    def compress_block(self, data, dictionary, last):
+        level = self.level
+        if self.adaptive and _looks_incompressible(data):
+            # Level 0 emits stored deflate blocks, still a valid gzip stream
+            level = 0
+        options = (level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY)
+        compressor = zlib.compressobj(*options, dictionary) if dictionary else zlib.compressobj(*options)
+        # A sync flush ends on a byte boundary without the final-block bit, so
+        # the blocks concatenate into one valid deflate stream
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def decompress_block(self, data):
+        return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+
+    def trailer(self, crc, size):
+        return struct.pack('<II', crc, size & 0xffffffff)
+
+
+class ZstdCodec(Codec):
+    """One zstd frame per block; concatenated frames form a valid .zst"""
+
+    name = "zstd"
+    extension = ".tar.zst"
+    default_level = 3
+
+    def compress_block(self, data, dictionary, last):
+        if not data:
+            return b''
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress_block(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class XzCodec(Codec):
+    """One xz stream per block; xz and Python read concatenated streams"""
+
+    name = "xz"
+    extension = ".tar.xz"
+    default_level = 6
+
+    def compress_block(self, data, dictionary, last):
+        if not data:
+            return b''
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=self.level)
+
+    def decompress_block(self, data):
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+CODECS = {codec.name: codec for codec in (Codec, GzipCodec, ZstdCodec, XzCodec)}
+
+
+def parse_codec(spec):
+    """Build a codec from a setting like 'gzip:9', 'zstd', 'none' or 'auto'
+
+    'auto' is gzip that stores already-compressed data without recompressing.
+    Unknown or unavailable codecs fall back to the default.
+    """
+    name, _, level = (spec or DEFAULT_CODEC).strip().lower().partition(':')
+    adaptive = name == "auto"
+    if adaptive:
+        name = "gzip"
+
+    if name == "zstd" and zstandard is None:
+        logger.warning("zstd needs python3-zstandard, falling back to gzip")
+        name = "gzip"
+    if name not in CODECS:
+        logger.warning(f"Unknown codec '{spec}', using {DEFAULT_CODEC}")
+        return parse_codec(DEFAULT_CODEC)
+
+    try:
+        level = int(level) if level else None
+    except ValueError:
+        level = None
+    return CODECS[name](level, adaptive=adaptive)
+
+
+def archive_suffix(path):
+    """Return the archive extension of a path ('.tar.gz', ...) or None"""
+    name = str(path)
+    for codec in (GzipCodec, ZstdCodec, XzCodec, Codec):
+        if name.endswith(codec.extension):
+            return codec.extension
+    return None
+
+
+def codec_for_path(path, preferred=None):
+    """Pick the codec for an archive path, keeping preferred's level if it fits"""
+    suffix = archive_suffix(path)
+    if preferred is not None and preferred.extension == suffix:
+        return preferred
+    for codec in CODECS.values():
+        if codec.extension == suffix:
+            if codec is ZstdCodec and zstandard is None:
+                raise RuntimeError("zstd archives need python3-zstandard")
+            return codec()
+    return preferred or parse_codec(DEFAULT_CODEC)
+
+
+class ParallelCompressWriter:
+    """Write-only file object compressing with a codec on several cores
+
+    The input is cut into blocks that are compressed concurrently (zlib, lzma
+    and zstandard release the GIL) and written back in order.
+    progress(count) is called with the uncompressed bytes written, and
+    on_block(offset, compressed_offset, compressed_size) for each block.
+    """
+
+    def __init__(self, fileobj, codec, workers=None, block_size=COMPRESS_BLOCK_SIZE, progress=None,
+                 on_block=None):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.progress = progress or _ignore_progress
+        self.on_block = on_block
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backup-compress")
+        # Workers time their blocks into the operation that created the writer
+        self._metrics = current_metrics()
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._dictionary = b''
+        self._crc = 0
+        self._size = 0
+        self.closed = False
+
+        header = self.codec.header()
+        self.fileobj.write(header)
+        self._written = len(header)
+
+    def write(self, data):
+        self.progress(len(data))
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _compress_timed(self, block, dictionary, last):
+        start = time.perf_counter()
+        data = self.codec.compress_block(block, dictionary, last)
+        self._metrics.add("compress", time.perf_counter() - start)
+        return data
+
+    def _submit(self, block, last):
+        compress = self._compress_timed if self._metrics else self.codec.compress_block
+        self._pending.append((
+            self._executor.submit(compress, block, self._dictionary, last),
+            self._size,
+            len(block),
+        ))
+        self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        if self.codec.uses_dictionary:
+            self._dictionary = block[-32768:]
+
+        # Bound memory: keep at most two blocks per worker in flight
+        while len(self._pending) > 2 * self.workers:
+            self._write_next()
+
+    def _write_next(self):
+        future, offset, size = self._pending.popleft()
+        data = future.result()
+        self.fileobj.write(data)
+        if self.on_block and size:
+            self.on_block(offset, self._written, len(data))
+        self._written += len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer.clear()
+            while self._pending:
+                self._write_next()
+            self.fileobj.write(self.codec.trailer(self._crc, self._size))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def abort(self):
+        """Stop without finishing the file (the caller discards it)"""
+        self.closed = True
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class _HashingWriter:
+    """Pass-through file object hashing written bytes"""
+
+    def __init__(self, fileobj, hasher):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.fileobj.write(data)
+
+
+class _ProgressWriter:
+    """Pass-through file object reporting written bytes"""
+
+    def __init__(self, fileobj, progress):
+        self.fileobj = fileobj
+        self.progress = progress
+
+    def write(self, data):
+        self.progress(len(data))
+        return self.fileobj.write(data)
+
+
+@contextlib.contextmanager
+def open_tar_writer(destination, codec=None, workers=None, progress=None, index=False, hasher=None):
+    """Open a tar archive for writing, compressed with codec on all cores
+
+    With index=True a sidecar index (see SeekableArchive) is written too;
+    hasher, if given, is updated with the archive bytes as they are written.
+    """
+    codec = codec or codec_for_path(destination)
+    index_writer = ArchiveIndexWriter(index_path_for(destination), codec) if index else None
+    try:
+        with open(destination, 'wb') as raw:
+            raw = metered(raw)
+            if hasher:
+                raw = _HashingWriter(raw, hasher)
+            if codec.name == "none":
+                with _IndexingTarFile.open(fileobj=_ProgressWriter(raw, progress or _ignore_progress),
+                                           mode="w|") as tar:
+                    tar.on_member = index_writer and index_writer.add_member
+                    yield tar
+            else:
+                with ParallelCompressWriter(raw, codec, workers, progress=progress,
+                                            on_block=index_writer and index_writer.add_block) as compressed, \
+                        _IndexingTarFile.open(fileobj=compressed, mode="w|") as tar:
+                    tar.on_member = index_writer and index_writer.add_member
+                    yield tar
+    except BaseException:
+        if index_writer:
+            index_writer.discard()
+        raise
+    if index_writer:
+        index_writer.commit()
+
+
+class _TarHeaders:
+    """Builds TarInfo headers from stat results already at hand (like TarFile.gettarinfo)
+
+    User and group names are looked up once per id, and hard-linked files
+    after the first become links to it.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._groups = {}
+        self._inodes = {}
+
+    def _name(self, names, lookup, key):
+        if key not in names:
+            try:
+                names[key] = lookup(key)[0]
+            except KeyError:
+                names[key] = ""
+        return names[key]
+
+    def tarinfo(self, path, arcname, st):
+        """TarInfo for one entry, or None for types tar can't store (sockets)"""
+        info = tarfile.TarInfo(arcname)
+        mode = st.st_mode
+        if stat.S_ISREG(mode):
+            inode = (st.st_ino, st.st_dev)
+            if st.st_nlink > 1 and inode in self._inodes:
+                info.type = tarfile.LNKTYPE
+                info.linkname = self._inodes[inode]
+            else:
+                info.type = tarfile.REGTYPE
+                info.size = st.st_size
+                if st.st_nlink > 1:
+                    self._inodes[inode] = arcname
+        elif stat.S_ISDIR(mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(path)
+        elif stat.S_ISFIFO(mode):
+            info.type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+            info.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) else tarfile.BLKTYPE
+            info.devmajor = os.major(st.st_rdev)
+            info.devminor = os.minor(st.st_rdev)
+        else:
+            return None
+        info.mode = stat.S_IMODE(mode)
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        info.mtime = st.st_mtime
+        info.uname = self._name(self._users, pwd.getpwuid, st.st_uid)
+        info.gname = self._name(self._groups, grp.getgrgid, st.st_gid)
+        return info
+
+
+# ustar header block, with the checksum field (offset 148) left as spaces
+_USTAR_HEADER = struct.Struct("100s8s8s8s12s12s8sc100s8s32s32s8s8s155s12x")
+_NO_DEVICE = bytes(8)
+
+
+def _ustar_block(name, mode, uid, gid, size, mtime, typeflag, linkname, uname, gname):
+    block = bytearray(_USTAR_HEADER.pack(
+        name, b"%07o\0" % mode, b"%07o\0" % uid, b"%07o\0" % gid, b"%011o\0" % size, b"%011o\0" % mtime,
+        b"        ", typeflag, linkname, tarfile.POSIX_MAGIC, uname, gname, _NO_DEVICE, _NO_DEVICE, b"",
+    ))
+    block[148:155] = b"%06o\0" % sum(block)
+    return bytes(block)
+
+
+def _pax_header(info):
+    """info's header as TarInfo.tobuf(PAX_FORMAT) would write it, or None
+
+    tarfile builds each header field by field in Python, which is most of
+    the time spent archiving small files. This covers the usual member -
+    ASCII names that fit, ids and size in range, at most a float mtime for
+    the extended header - in one struct.pack; for anything else it returns
+    None and tarfile's own (slower) encoder has to be used. The bytes are
+    those of Python 3.9+; 3.8's tarfile leaves the ustar mtime 0 instead of
+    the rounded value when the extended header has it, which reads the same.
+    """
+    if info.pax_headers or info.type in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+        return None
+    name = info.name + "/" if info.type == tarfile.DIRTYPE and not info.name.endswith("/") else info.name
+    mtime = info.mtime
+    mtime_int = round(mtime)
+    if not (name.isascii() and len(name) <= 100 and info.linkname.isascii() and len(info.linkname) <= 100
+            and info.uname.isascii() and len(info.uname) <= 32 and info.gname.isascii() and len(info.gname) <= 32
+            and 0 <= info.uid < 0o10000000 and 0 <= info.gid < 0o10000000
+            and type(info.size) is int and 0 <= info.size < 0o100000000000 and 0 <= mtime_int < 0o100000000000):
+        return None
+
+    header = _ustar_block(name.encode("ascii"), info.mode & 0o7777, info.uid, info.gid, info.size, mtime_int,
+                          info.type, info.linkname.encode("ascii"), info.uname.encode("ascii"),
+                          info.gname.encode("ascii"))
+    if not isinstance(mtime, float):
+        return header
+    # Extended header with the full precision mtime, "<length> mtime=<value>\n"
+    record = f" mtime={mtime}\n"
+    length = len(record) + 1
+    while len(str(length)) + len(record) != length:
+        length += 1
+    record = f"{length}{record}".encode("ascii")
+    pax = _ustar_block(b"././@PaxHeader", 0, 0, 0, len(record), 0, tarfile.XHDTYPE, b"", b"", b"")
+    return pax + record + bytes(tarfile.BLOCKSIZE - len(record)) + header
+
+
+def _add_file(tar, path, info, header=None, sparse=False):
+    """Add a regular file to an archive from open_tar_writer, holes and all if it may have some"""
+    with open(path, 'rb') as f:
+        extents = data_extents(f.fileno(), info.size) if sparse else None
+        if extents is not None:
+            tar.addsparse(info, f, extents)
+        else:
+            tar.addfile(info, f, header=header)
+
+
+def _read_small_files(paths):
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read(PREFETCH_MAX_SIZE + 1))
+    return contents
+
+
+def add_tree(tar, source, arcname, on_file=None, workers=PREFETCH_WORKERS):
+    """Stream a folder into an archive from open_tar_writer, in bounded memory
+
+    Writes the same members in the same order as tar.add(source, arcname).
+    A walker thread scans the tree (see walk_tree) and queues batches of
+    encoded headers at most WALK_QUEUE_SIZE entries ahead of the writer;
+    the files up to PREFETCH_MAX_SIZE in each batch are read ahead on
+    `workers` threads (0: none), larger ones are streamed when their turn
+    comes. on_file(name) is called after each regular file.
+    """
+    batches = queue.Queue(maxsize=max(1, WALK_QUEUE_SIZE // WALK_BATCH))
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup-prefetch") if workers else None
+    # Prefetches submitted but not yet written, cancelled if the writer stops early
+    pending = set()
+
+    def put(item):
+        # Gives up once the writer stopped taking batches
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def send(batch):
+        small = [path for path, info, _header, _sparse in batch if info.isreg() and info.size <= PREFETCH_MAX_SIZE]
+        contents = pool.submit(_read_small_files, small) if pool and small else None
+        if contents:
+            pending.add(contents)
+        return put((batch, contents))
+
+    def walk():
+        try:
+            headers = _TarHeaders()
+            batch = []
+            for path, name, st in walk_tree(source, arcname):
+                info = headers.tarinfo(path, name, st)
+                if info is None:
+                    logger.warning(f"Skipping {path}: unsupported file type")
+                    continue
+                batch.append((path, info, _pax_header(info), may_have_holes(st)))
+                if len(batch) == WALK_BATCH:
+                    if not send(batch):
+                        return
+                    batch = []
+            if batch and not send(batch):
+                return
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    def write_file(path, info, header, sparse, data):
+        if data is not None and len(data) != info.size:
+            # Changed since the walk, stored as it is now
+            header = None
+            info.size = len(data) if len(data) <= PREFETCH_MAX_SIZE else os.stat(path).st_size
+        if data is not None and len(data) <= PREFETCH_MAX_SIZE:
+            tar.addfile(info, io.BytesIO(data), header=header)
+        else:
+            _add_file(tar, path, info, header, sparse)
+
+    walker = threading.Thread(target=walk, name="backup-walker", daemon=True)
+    walker.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            batch, contents = item
+            if contents:
+                pending.discard(contents)
+            prefetched = iter(contents.result() if contents else ())
+            for path, info, header, sparse in batch:
+                if not info.isreg():
+                    tar.addfile(info, header=header)
+                    continue
+                data = next(prefetched) if pool and info.size <= PREFETCH_MAX_SIZE else None
+                write_file(path, info, header, sparse, data)
+                if on_file:
+                    on_file(info.name)
+    finally:
+        stop.set()
+        walker.join()
+        if pool:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+
+@contextlib.contextmanager
+def open_tar_reader(path):
+    """Open any archive written by open_tar_writer for sequential reading"""
+    if str(path).endswith(ZstdCodec.extension):
+        if zstandard is None:
+            raise RuntimeError("Reading .tar.zst backups needs python3-zstandard")
+        with open(path, 'rb') as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(metered(raw), read_across_frames=True)
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                yield tar
+    else:
+        with open(path, 'rb') as raw, tarfile.open(fileobj=metered(raw), mode="r:*") as tar:
+            yield tar
+
+
+# ---------------------------------------------------------------------------
+# Seekable archives
+# ---------------------------------------------------------------------------
+
+# Hidden SQLite sidecar next to each folder archive (".name_backup_TS.tar.gz.idx")
+# mapping tar members and compressed blocks to offsets, so a single item can be
+# restored by decompressing only the blocks that hold it
+INDEX_SUFFIX = ".idx"
+INDEX_FORMAT = "nautilus-backup-index"
+INDEX_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE blocks (
+    offset INTEGER PRIMARY KEY,
+    compressed_offset INTEGER NOT NULL,
+    compressed_size INTEGER NOT NULL
+);
+CREATE TABLE members (
+    name TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    link TEXT,
+    hash TEXT
+);
+"""
+INDEX_BATCH_SIZE = 10000
+INDEX_CACHED_BLOCKS = 4
+
+
+def index_path_for(archive_path):
+    """Sidecar index of an archive"""
+    archive_path = Path(archive_path)
+    return archive_path.parent / f".{archive_path.name}{INDEX_SUFFIX}"
+
+
+def is_index_sidecar(name):
+    """Whether a file name is an archive index rather than a backup"""
+    return (name.startswith('.') and name.endswith(INDEX_SUFFIX)
+            and archive_suffix(name[:-len(INDEX_SUFFIX)]) is not None)
+
+
+class ArchiveIndexWriter:
+    """Collects member and block offsets while an archive is written
+
+    Rows go to a temporary database that replaces the sidecar on commit(),
+    so a failed backup never leaves a stale index behind.
+    """
+
+    def __init__(self, path, codec):
+        self.path = Path(path)
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        if self._tmp_path.exists():
+            self._tmp_path.unlink()
+        self._conn = sqlite3.connect(str(self._tmp_path))
+        self._conn.executescript(INDEX_SCHEMA)
+        self._conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("format", INDEX_FORMAT), ("version", "1"), ("codec", codec.name),
+        ])
+        self._blocks = []
+        self._members = []
+
+    def add_block(self, offset, compressed_offset, compressed_size):
+        self._blocks.append((offset, compressed_offset, compressed_size))
+        if len(self._blocks) >= INDEX_BATCH_SIZE:
+            self._flush()
+
+    def add_member(self, tarinfo, offset, digest=None):
+        self._members.append((
+            tarinfo.name, offset, tarinfo.size, tarinfo.type.decode(), tarinfo.mtime,
+            tarinfo.linkname or None, digest,
+        ))
+        if len(self._members) >= INDEX_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._conn.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)", self._blocks)
+        self._conn.executemany("INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?, ?)", self._members)
+        self._blocks.clear()
+        self._members.clear()
+
+    def commit(self):
+        self._flush()
+        self._conn.commit()
+        self._conn.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        self._conn.close()
+        try:
+            self._tmp_path.unlink()
+        except OSError:
+            pass
+
+
+class _HashingReader:
+    """Read-through file object hashing what is read (same digest as _hash_file)"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.blake2b(digest_size=20)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+
+class _IndexingTarFile(tarfile.TarFile):
+    """TarFile reporting each member's header offset and content hash
+
+    on_member(tarinfo, offset, digest) runs after the member is written;
+    file contents are hashed as tarfile copies them, in the same pass.
+    Written members are not kept in tar.members, so writing an archive of
+    millions of entries takes no more memory than one of a few.
+    """
+
+    on_member = None
+
+    def addfile(self, tarinfo, fileobj=None, header=None):
+        """TarFile.addfile, optionally with the header already encoded (see _pax_header)"""
+        self._check("awx")
+        metrics = current_metrics()
+        if metrics and fileobj is not None and tarinfo.isreg():
+            metrics.add(files=1)
+            fileobj = _MeteredFile(fileobj, metrics)
+        reader = None
+        if self.on_member is not None and fileobj is not None and tarinfo.isreg():
+            fileobj = reader = _HashingReader(fileobj)
+
+        offset = self.offset
+        if header is None:
+            header = tarinfo.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(header)
+        self.offset += len(header)
+        if fileobj is not None:
+            tarfile.copyfileobj(fileobj, self.fileobj, tarinfo.size, bufsize=self.copybufsize)
+            blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+            if remainder:
+                self.fileobj.write(bytes(tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            self.offset += blocks * tarfile.BLOCKSIZE
+
+        if self.on_member is not None:
+            self.on_member(tarinfo, offset, reader.hash.hexdigest() if reader else None)
+
+    def addsparse(self, tarinfo, fileobj, extents):
+        """Add a regular file storing only its data extents (see data_extents)
+
+        Written as a GNU sparse 1.0 member in a PAX header, which tarfile and
+        GNU tar extract with the holes left as holes. Its index digest is the
+        same as addfile's, with the holes hashed as zeros. A file with more
+        data than a header's size field holds is added in full instead.
+        """
+        self._check("awx")
+        sparse_map = f"{len(extents) + 1}\n" + "".join(f"{offset}\n{length}\n" for offset, length in extents)
+        sparse_map = sparse_map.encode("ascii") + f"{tarinfo.size}\n0\n".encode("ascii")
+        sparse_map += bytes(-len(sparse_map) % tarfile.BLOCKSIZE)
+        stored = len(sparse_map) + sum(length for _offset, length in extents)
+        if stored >= 0o100000000000:
+            self.addfile(tarinfo, fileobj)
+            return
+
+        # Like GNU tar, an unaware reader extracts it under GNUSparseFile.0/
+        head, _sep, tail = tarinfo.name.rpartition("/")
+        member = tarfile.TarInfo(f"{head}/GNUSparseFile.0/{tail}" if head else f"GNUSparseFile.0/{tail}")
+        member.size = stored
+        member.mode, member.mtime = tarinfo.mode, tarinfo.mtime
+        member.uid, member.gid, member.uname, member.gname = tarinfo.uid, tarinfo.gid, tarinfo.uname, tarinfo.gname
+        if not member.name.isascii() or len(member.name) > 100:
+            # Ahead of GNU.sparse.name, which must override it
+            member.pax_headers["path"] = member.name
+        member.pax_headers.update({
+            "GNU.sparse.major": "1",
+            "GNU.sparse.minor": "0",
+            "GNU.sparse.name": tarinfo.name,
+            "GNU.sparse.realsize": str(tarinfo.size),
+        })
+
+        metrics = current_metrics()
+        if metrics:
+            metrics.add(files=1)
+            fileobj = _MeteredFile(fileobj, metrics)
+        reader = _HashingReader(fileobj) if self.on_member is not None else None
+        offset = self.offset
+        header = member.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(header + sparse_map)
+        position = 0
+        for start, length in extents:
+            if reader:
+                _hash_zeros(reader.hash, start - position)
+            fileobj.seek(start)
+            tarfile.copyfileobj(reader or fileobj, self.fileobj, length, bufsize=self.copybufsize)
+            position = start + length
+        if reader:
+            _hash_zeros(reader.hash, tarinfo.size - position)
+        padding = -stored % tarfile.BLOCKSIZE
+        self.fileobj.write(bytes(padding))
+        self.offset += len(header) + stored + padding
+
+        if self.on_member is not None:
+            self.on_member(tarinfo, offset, reader.hash.hexdigest())
+
+
+class SeekableArchive:
+    """Random access to an archive through its index sidecar
+
+    Acts as a read-only, seekable file object over the uncompressed tar
+    stream; only the blocks that are read get decompressed.
+    """
+
+    def __init__(self, archive_path):
+        self.path = Path(archive_path)
+        index_path = index_path_for(self.path)
+        if not index_path.exists():
+            raise FileNotFoundError(f"{self.path.name} has no index (it was made by an older version)")
+
+        self._db = sqlite3.connect(f"file:{quote(str(index_path))}?mode=ro", uri=True)
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        if meta.get("format") != INDEX_FORMAT:
+            raise ValueError(f"Not a backup index: {index_path}")
+        self.codec = CODECS[meta["codec"]]()
+        self._raw = open(self.path, 'rb')
+        self._blocks = collections.OrderedDict()
+        self._position = 0
+
+    # Lookups
+
+    def members_under(self, name):
+        """(name, offset) of a member and, for a folder, everything inside it"""
+        name = name.rstrip('/')
+        return self._db.execute(
+            "SELECT name, offset FROM members WHERE name = ? OR (name >= ? AND name < ?) ORDER BY offset",
+            (name, name + '/', name + '0')
+        ).fetchall()
+
+    def entries(self):
+        """(name, type, size, mtime, link, hash) of every member"""
+        return self._db.execute("SELECT name, type, size, mtime, link, hash FROM members")
+
+    def search(self, text, limit=200):
+        """Member names containing text"""
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return [row[0] for row in self._db.execute(
+            "SELECT name FROM members WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT ?", (pattern, limit)
+        )]
+
+    def read_member(self, name):
+        """Contents of a regular file member, or None if it isn't in the archive"""
+        offsets = self.members_under(name)
+        if not offsets or offsets[0][0] != name:
+            return None
+        with self._open_tar() as tar:
+            info = self._member_at(tar, offsets[0][1])
+            return tar.extractfile(info).read()
+
+    def extract(self, offsets, target_dir):
+        """Extract the members whose headers start at offsets into target_dir"""
+        with self._open_tar() as tar:
+            members = [self._member_at(tar, offset) for offset in sorted(offsets)]
+            tar.extractall(target_dir, members=members)
+        return len(members)
+
+    def _open_tar(self):
+        self._position = 0
+        return tarfile.open(fileobj=self, mode="r:")
+
+    def _member_at(self, tar, offset):
+        self.seek(offset)
+        tar.offset = offset
+        return tarfile.TarInfo.fromtarfile(tar)
+
+    # File object over the uncompressed stream
+
+    def _block_at(self, position):
+        """(offset, data) of the uncompressed block holding position, or None at the end"""
+        for offset, data in self._blocks.items():
+            if offset <= position < offset + len(data):
+                self._blocks.move_to_end(offset)
+                return offset, data
+
+        row = self._db.execute(
+            "SELECT offset, compressed_offset, compressed_size FROM blocks WHERE offset <= ? "
+            "ORDER BY offset DESC LIMIT 1", (position,)
+        ).fetchone()
+        if row is None:
+            return None
+        offset, compressed_offset, compressed_size = row
+        self._raw.seek(compressed_offset)
+        data = self.codec.decompress_block(self._raw.read(compressed_size))
+        if position >= offset + len(data):
+            return None
+
+        self._blocks[offset] = data
+        if len(self._blocks) > INDEX_CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
+        return offset, data
+
+    def read(self, size=-1):
+        if self.codec.name == "none":
+            self._raw.seek(self._position)
+            data = self._raw.read(size)
+            self._position += len(data)
+            return data
+
+        out = bytearray()
+        while size < 0 or len(out) < size:
+            block = self._block_at(self._position)
+            if block is None:
+                break
+            offset, data = block
+            start = self._position - offset
+            end = len(data) if size < 0 else min(len(data), start + size - len(out))
+            out += data[start:end]
+            self._position += end - start
+        return bytes(out)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence != os.SEEK_SET:
+            raise io.UnsupportedOperation("can't seek from the end of a compressed archive")
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._raw.close()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# ---------------------------------------------------------------------------
+# Deduplicating chunk repository
+# ---------------------------------------------------------------------------
+
+# Backups written in repository mode are small JSON manifests with this suffix
+MANIFEST_SUFFIX = ".nbk"
+STORE_DIRNAME = ".nautilus-backup-store"
+
+# Content-defined chunking: every byte is mapped to one bit (its parity) and a
+# chunk ends right after the first occurrence of _CDC_ANCHOR in that bit stream
+# past CDC_MIN_SIZE. Boundaries follow the content, so an insertion only
+# changes the chunks around it, and bytes.translate()/find() run in C.
+CDC_MIN_SIZE = 512 * 1024
+CDC_MAX_SIZE = 8 * 1024 * 1024
+CDC_READ_SIZE = 16 * 1024 * 1024
+_CDC_TABLE = bytes(bin(b).count('1') & 1 for b in range(256))
+_CDC_ANCHOR = b'\x01\x01\x00\x00\x01\x01\x00\x00\x01\x00\x00\x01\x01\x00\x01\x01\x00\x01\x00\x01'
+
+
+def iter_chunks(fileobj):
+    """Yield content-defined chunks read from a binary file object"""
+    buf = b''
+    offset = 0
+    eof = False
+
+    while True:
+        if not eof and len(buf) - offset < CDC_MAX_SIZE:
+            data = fileobj.read(CDC_READ_SIZE)
+            if data:
+                buf = buf[offset:] + data
+                offset = 0
+                continue
+            eof = True
+
+        remaining = len(buf) - offset
+        if remaining == 0:
+            return
+
+        if remaining <= CDC_MIN_SIZE:
+            cut = remaining
+        else:
+            start = offset + CDC_MIN_SIZE - len(_CDC_ANCHOR)
+            end = offset + min(remaining, CDC_MAX_SIZE)
+            hit = buf[start:end].translate(_CDC_TABLE).find(_CDC_ANCHOR)
+            cut = CDC_MIN_SIZE + hit if hit >= 0 else end - offset
+
+        yield buf[offset:offset + cut]
+        offset += cut
+
+
+def _safe_relpath(relpath):
+    """Reject manifest paths that would escape the restore directory"""
+    parts = Path(relpath).parts
+    if not parts or Path(relpath).is_absolute() or '..' in parts:
+        raise ValueError(f"Unsafe path in manifest: {relpath}")
+    return Path(*parts)
+
+
+def load_manifest(manifest_path):
+    """Read a repository-mode backup manifest"""
+    manifest = json.loads(Path(manifest_path).read_text())
+    if manifest.get("format") != "nautilus-backup-manifest":
+        raise ValueError(f"Not a backup manifest: {manifest_path}")
+    return manifest
+
+
+class ChunkStore:
+    """Content-addressed chunk repository shared by all manifest backups
+
+    Layout:
+        <root>/chunks/<aa>/<digest>   one file per unique chunk
+        <root>/manifests.txt          manifests that reference this store
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.chunks_dir = self.root / "chunks"
+        self.registry_file = self.root / "manifests.txt"
+        self._lock = threading.Lock()
+
+    def _chunk_path(self, digest):
+        return self.chunks_dir / digest[:2] / digest
+
+    def put(self, data):
+        """Store a chunk once, returns (digest, bytes_written)"""
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        path = self._chunk_path(digest)
+        if path.exists():
+            # Refresh the mtime so a concurrent collect_garbage() keeps it
+            os.utime(path)
+            return digest, 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with metered(open(tmp_path, 'wb')) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return digest, len(data)
+
+    def get(self, digest):
+        """Read a chunk and check it against its digest"""
+        with metered(open(self._chunk_path(digest), 'rb')) as f:
+            data = f.read()
+        if hashlib.blake2b(data, digest_size=20).hexdigest() != digest:
+            raise ValueError(f"Corrupted chunk in repository: {digest}")
+        return data
+
+    def _store_file(self, path, progress):
+        """Chunk a file into the store, returns (chunk list, bytes_written)"""
+        chunks = []
+        written = 0
+        with metered(open(path, 'rb')) as f:
+            for data in iter_chunks(f):
+                digest, count = self.put(data)
+                chunks.append([digest, len(data)])
+                written += count
+                progress(len(data))
+        _count_file()
+        return chunks, written
+
+    def _file_entry(self, path, relpath, st, progress):
+        entry = {
+            "path": relpath,
+            "mode": st.st_mode & 0o7777,
+            "mtime": st.st_mtime,
+        }
+        if stat.S_ISLNK(st.st_mode):
+            entry.update(type="symlink", target=os.readlink(path))
+            return entry, 0
+        if not stat.S_ISREG(st.st_mode):
+            # Sockets, FIFOs and device nodes are not backed up
+            return None, 0
+        chunks, written = self._store_file(path, progress)
+        entry.update(type="file", size=st.st_size, chunks=chunks)
+        return entry, written
+
+    def backup(self, source, destination, progress=None, on_file=None, hasher=None):
+        """Store source in the repository and write its manifest to destination
+
+        on_file(relpath) is called after each regular file is stored, and
+        hasher (if given) is updated with the manifest bytes.
+
+        Returns:
+            int: bytes actually written (new chunks + manifest)
+        """
+        progress = progress or _ignore_progress
+        source = Path(source)
+        entries = []
+        written = 0
+
+        if source.is_dir():
+            kind = "folder"
+            for full_path, relpath, st in walk_tree(source, source.name):
+                if stat.S_ISDIR(st.st_mode):
+                    entries.append({
+                        "path": relpath,
+                        "type": "dir",
+                        "mode": st.st_mode & 0o7777,
+                        "mtime": st.st_mtime,
+                    })
+                    continue
+                entry, count = self._file_entry(full_path, relpath, st, progress)
+                if entry:
+                    entries.append(entry)
+                    written += count
+                    if on_file and entry["type"] == "file":
+                        on_file(relpath)
+        else:
+            kind = "file"
+            entry, written = self._file_entry(str(source), source.name, os.lstat(source), progress)
+            if entry is None:
+                raise ValueError(f"Not a regular file: {source}")
+            entries.append(entry)
+            if on_file:
+                on_file(source.name)
+
+        manifest = {
+            "format": "nautilus-backup-manifest",
+            "version": 1,
+            "kind": kind,
+            "name": source.name,
+            "source": str(source),
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "store": str(self.root),
+            "entries": entries,
+        }
+        data = json.dumps(manifest, separators=(',', ':')).encode()
+        if hasher:
+            hasher.update(data)
+        tmp_path = Path(destination).with_name(f".{Path(destination).name}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, destination)
+        self.register(destination)
+
+        return written + len(data)
+
+    def restore(self, manifest, target_dir):
+        """Rebuild the data described by a manifest under target_dir
+
+        Returns:
+            Path: restored file or folder
+        """
+        target_dir = Path(target_dir)
+        dir_times = []
+
+        for entry in manifest["entries"]:
+            target = target_dir / _safe_relpath(entry["path"])
+            kind = entry["type"]
+
+            if kind == "dir":
+                target.mkdir(parents=True, exist_ok=True)
+                dir_times.append((target, entry))
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.is_symlink() or (target.exists() and not target.is_dir()):
+                target.unlink()
+
+            if kind == "symlink":
+                os.symlink(entry["target"], target)
+                continue
+
+            tmp_path = target.with_name(f".{target.name}.restore.tmp")
+            with metered(open(tmp_path, 'wb')) as raw:
+                f = _HoleWriter(raw)
+                for digest, _length in entry["chunks"]:
+                    f.write(self.get(digest))
+                f.finish()
+            _count_file()
+            os.chmod(tmp_path, entry["mode"])
+            os.utime(tmp_path, (entry["mtime"], entry["mtime"]))
+            os.replace(tmp_path, target)
+
+        # Directory metadata last, writing files into them bumps their mtime
+        for target, entry in reversed(dir_times):
+            os.chmod(target, entry["mode"])
+            os.utime(target, (entry["mtime"], entry["mtime"]))
+
+        return target_dir / manifest["name"]
+
+    def register(self, manifest_path):
+        """Remember a manifest so garbage collection keeps its chunks"""
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.registry_file, 'a') as f:
+                f.write(f"{Path(manifest_path).resolve()}\n")
+
+    def collect_garbage(self, grace_seconds=3600):
+        """Delete chunks no longer referenced by any existing manifest
+
+        Chunks touched within grace_seconds are kept, they may belong to a
+        backup whose manifest has not been written yet.
+
+        Returns:
+            int: number of chunks removed
+        """
+        with self._lock:
+            if not self.registry_file.exists():
+                return 0
+
+            live_manifests = []
+            referenced = set()
+            for line in dict.fromkeys(self.registry_file.read_text().splitlines()):
+                try:
+                    manifest = load_manifest(line)
+                except (OSError, ValueError):
+                    continue
+                live_manifests.append(line)
+                for entry in manifest["entries"]:
+                    referenced.update(digest for digest, _length in entry.get("chunks", ()))
+
+            tmp_path = self.registry_file.with_suffix(".tmp")
+            tmp_path.write_text("".join(f"{line}\n" for line in live_manifests))
+            os.replace(tmp_path, self.registry_file)
+
+            removed = 0
+            cutoff = datetime.now().timestamp() - grace_seconds
+            if self.chunks_dir.exists():
+                for bucket in self.chunks_dir.iterdir():
+                    for chunk in bucket.iterdir():
+                        if chunk.name.startswith('.') or chunk.name in referenced:
+                            continue
+                        if chunk.stat().st_mtime > cutoff:
+                            continue
+                        chunk.unlink()
+                        removed += 1
+            return removed
+
+
+# ---------------------------------------------------------------------------
+# Delta backups
+# ---------------------------------------------------------------------------
+
+# Large files can be backed up as a delta (".nbd") against their last full
+# backup, rsync-style: the new version is cut into content-defined chunks
+# (iter_chunks) and each chunk the full backup already holds becomes a
+# reference into it. Full backups keep a hidden signature sidecar with their
+# chunk hashes, so writing a delta never reads the full backup.
+DELTA_SUFFIX = ".nbd"
+DELTA_FORMAT = "nautilus-backup-delta"
+DELTA_MAGIC = b"NBDELTA1"
+DELTA_MIN_SIZE = 64 * 1024 * 1024
+# Write a new full backup after this many deltas, or instead of a delta that
+# would hold more than this share of the file
+DELTA_MAX_CHAIN = 10
+DELTA_REBASE_RATIO = 0.5
+SIGNATURE_SUFFIX = ".sig"
+SIGNATURE_MAGIC = b"NBSIG1\n"
+
+# Delta stream: header, then ops: b"C" copy (base offset, length),
+# b"L" literal (length, data) and b"E" end (trailer JSON with the checksum)
+_DELTA_LENGTH = struct.Struct("<I")
+_DELTA_COPY = struct.Struct("<QQ")
+_DELTA_LITERAL = struct.Struct("<Q")
+_SIGNATURE_RECORD = struct.Struct("<20sQQ")
+
+
+def signature_path_for(backup_path):
+    """Chunk signature sidecar of a full backup"""
+    backup_path = Path(backup_path)
+    return backup_path.parent / f".{backup_path.name}{SIGNATURE_SUFFIX}"
+
+
+def is_signature_sidecar(name):
+    """Whether a file name is a chunk signature rather than a backup"""
+    return name.startswith('.') and name.endswith(SIGNATURE_SUFFIX)
+
+
+def _chunk_digest(chunk):
+    return hashlib.blake2b(chunk, digest_size=20).digest()
+
+
+def copy_file_signed(source, destination, progress=None, hasher=None):
+    """Copy a file like copy_file and write its chunk signature for later deltas"""
+    progress = progress or _ignore_progress
+    signature_path = signature_path_for(destination)
+    tmp_path = signature_path.with_name(f"{signature_path.name}.tmp")
+    try:
+        with metered(open(source, 'rb')) as fsrc, metered(open(destination, 'wb')) as raw, \
+                metered(open(tmp_path, 'wb')) as fsig:
+            fdst = _HoleWriter(raw)
+            fsig.write(SIGNATURE_MAGIC)
+            offset = 0
+            for chunk in iter_chunks(fsrc):
+                fdst.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+                fsig.write(_SIGNATURE_RECORD.pack(_chunk_digest(chunk), offset, len(chunk)))
+                offset += len(chunk)
+                progress(len(chunk))
+            fdst.finish()
+        shutil.copystat(source, destination)
+        os.replace(tmp_path, signature_path)
+        _count_file()
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def load_signature(backup_path):
+    """{chunk digest: (offset, length)} of a full backup"""
+    data = signature_path_for(backup_path).read_bytes()
+    if not data.startswith(SIGNATURE_MAGIC):
+        raise ValueError(f"Not a chunk signature: {signature_path_for(backup_path)}")
+    return {digest: (offset, length)
+            for digest, offset, length in _SIGNATURE_RECORD.iter_unpack(data[len(SIGNATURE_MAGIC):])}
+
+
+def write_delta(source, destination, base_path, progress=None, hasher=None, max_literal=None):
+    """Write source as a delta against the full backup base_path
+
+    hasher (if given) is updated with the delta file's bytes. Once more than
+    max_literal bytes would be stored as literal data the delta is given up
+    (and removed), a full backup is cheaper from there.
+
+    Returns:
+        int: bytes stored as literal data, or None if the delta was given up
+    """
+    progress = progress or _ignore_progress
+    source = Path(source)
+    signature = load_signature(base_path)
+    st = source.stat()
+    header = json.dumps({
+        "format": DELTA_FORMAT,
+        "base": Path(base_path).name,
+        "size": st.st_size,
+        "mode": stat.S_IMODE(st.st_mode),
+        "mtime": st.st_mtime,
+    }).encode()
+    content = new_checksum()
+    literal = 0
+    run = None
+
+    _count_file()
+    with metered(open(source, 'rb')) as fsrc, metered(open(destination, 'wb')) as raw:
+        out = _HashingWriter(raw, hasher) if hasher else raw
+        out.write(DELTA_MAGIC + _DELTA_LENGTH.pack(len(header)) + header)
+        for chunk in iter_chunks(fsrc):
+            content.update(chunk)
+            ref = signature.get(_chunk_digest(chunk))
+            if ref and ref[1] == len(chunk):
+                # Consecutive references to adjoining base chunks become one copy
+                if run and run[0] + run[1] == ref[0]:
+                    run = (run[0], run[1] + ref[1])
+                    progress(len(chunk))
+                    continue
+                if run:
+                    out.write(b"C" + _DELTA_COPY.pack(*run))
+                run = ref
+            else:
+                if run:
+                    out.write(b"C" + _DELTA_COPY.pack(*run))
+                    run = None
+                out.write(b"L" + _DELTA_LITERAL.pack(len(chunk)))
+                out.write(chunk)
+                literal += len(chunk)
+                if max_literal is not None and literal > max_literal:
+                    break
+            progress(len(chunk))
+        else:
+            if run:
+                out.write(b"C" + _DELTA_COPY.pack(*run))
+            trailer = json.dumps({"checksum": format_checksum(content)}).encode()
+            out.write(b"E" + _DELTA_LENGTH.pack(len(trailer)) + trailer)
+            return literal
+    Path(destination).unlink()
+    return None
+
+
+def _read_exact(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise EOFError("Delta backup is truncated")
+    return data
+
+
+def _read_delta_header(fileobj):
+    if fileobj.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError("Not a delta backup")
+    (length,) = _DELTA_LENGTH.unpack(_read_exact(fileobj, _DELTA_LENGTH.size))
+    header = json.loads(_read_exact(fileobj, length))
+    if header.get("format") != DELTA_FORMAT:
+        raise ValueError("Not a delta backup")
+    return header
+
+
+def delta_base(delta_path):
+    """Full backup a delta backup was made against"""
+    delta_path = Path(delta_path)
+    with open(delta_path, 'rb') as f:
+        return delta_path.parent / _read_delta_header(f)["base"]
+
+
+def restore_delta(delta_path, target_path, progress=None):
+    """Rebuild a file from a delta backup and its base, streaming both
+
+    The result is checked against the checksum in the delta before it
+    replaces target_path.
+    """
+    progress = progress or _ignore_progress
+    delta_path = Path(delta_path)
+    target_path = Path(target_path)
+    tmp_path = target_path.with_name(f".{target_path.name}.restore.tmp")
+
+    with metered(open(delta_path, 'rb')) as delta:
+        header = _read_delta_header(delta)
+        content = new_checksum()
+        try:
+            with metered(open(delta_path.parent / header["base"], 'rb')) as base, \
+                    metered(open(tmp_path, 'wb')) as raw:
+                out = _HoleWriter(raw)
+                while True:
+                    op = delta.read(1)
+                    if op == b"C":
+                        offset, length = _DELTA_COPY.unpack(_read_exact(delta, _DELTA_COPY.size))
+                        base.seek(offset)
+                        while length:
+                            data = base.read(min(length, COPY_CHUNK_SIZE))
+                            if not data:
+                                raise ValueError(f"Base backup is shorter than expected: {header['base']}")
+                            content.update(data)
+                            out.write(data)
+                            length -= len(data)
+                            progress(len(data))
+                    elif op == b"L":
+                        (length,) = _DELTA_LITERAL.unpack(_read_exact(delta, _DELTA_LITERAL.size))
+                        data = _read_exact(delta, length)
+                        content.update(data)
+                        out.write(data)
+                        progress(length)
+                    elif op == b"E":
+                        (length,) = _DELTA_LENGTH.unpack(_read_exact(delta, _DELTA_LENGTH.size))
+                        trailer = json.loads(_read_exact(delta, length))
+                        out.finish()
+                        break
+                    elif not op:
+                        raise EOFError("Delta backup is truncated")
+                    else:
+                        raise ValueError("Corrupted delta backup")
+
+            if format_checksum(content) != trailer["checksum"]:
+                raise ValueError("Restored data doesn't match the delta's checksum")
+            os.chmod(tmp_path, header["mode"])
+            os.utime(tmp_path, (header["mtime"], header["mtime"]))
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    _count_file()
+    return target_path
+
+
+# ---------------------------------------------------------------------------
+# Incremental folder archives
+# ---------------------------------------------------------------------------
+
+# First member of every archive written in incremental mode
+INCREMENT_MEMBER = ".nautilus-backup-increment.json"
+
+# Start a new full archive after this many increments
+MAX_INCREMENT_CHAIN = 10
+
+
+def scan_tree(source, hash_files=False, previous=None):
+    """Stat-walk a folder into a snapshot {relpath: signature}
+
+    Paths are relative to the folder's parent, like the archive member names.
+    Signatures are ["f", size, mtime_ns, inode, hash], ["d"] or ["l", target].
+    With hash_files, new and modified files are hashed (unchanged ones keep
+    their previous hash) so a mere touch or rewrite is not stored again.
+    """
+    return dict(iter_tree_signatures(source, hash_files, previous))
+
+
+def iter_tree_signatures(source, hash_files=False, previous=None):
+    """Yield (relpath, signature) for a folder in walk_tree order, as scan_tree stores them"""
+    source = Path(source)
+    previous = previous or {}
+
+    for full_path, relpath, st in walk_tree(source, source.name):
+        if stat.S_ISDIR(st.st_mode):
+            yield relpath, ["d"]
+        elif stat.S_ISLNK(st.st_mode):
+            yield relpath, ["l", os.readlink(full_path)]
+        elif stat.S_ISREG(st.st_mode):
+            signature = ["f", st.st_size, st.st_mtime_ns, st.st_ino, None]
+            if hash_files:
+                old = previous.get(relpath)
+                if old and old[:4] == signature[:4]:
+                    signature[4] = old[4]
+                else:
+                    signature[4] = _hash_file(full_path)
+            yield relpath, signature
+
+
+def _hash_file(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _entry_changed(old, new):
+    """Compare two snapshot signatures"""
+    if old is None or old[0] != new[0]:
+        return True
+    if new[0] == "f":
+        if old[1:4] == new[1:4]:
+            return False
+        # Same content under a new mtime/inode (hash mode only)
+        return not (new[4] and old[4] == new[4])
+    return old != new
+
+
+def read_increment_info(archive_path):
+    """Return the increment header of an archive, or None for plain archives"""
+    try:
+        with open_tar_reader(archive_path) as tar:
+            member = tar.next()
+            if member is None or member.name != INCREMENT_MEMBER:
+                return None
+            return json.loads(tar.extractfile(member).read())
+    except (OSError, tarfile.TarError, ValueError, RuntimeError):
+        return None
+
+
+class IncrementalArchiver:
+    """Writes folder archives that only contain what changed since the last one
+
+    A snapshot of the source (see scan_tree) is kept per source/destination
+    folder pair in state_dir. Each archive starts with an INCREMENT_MEMBER
+    header naming its base archive and the paths deleted since then.
+    """
+
+    def __init__(self, state_dir, hash_files=False, codec=None):
+        self.state_dir = Path(state_dir)
+        self.hash_files = hash_files
+        self.codec = codec
+
+    def _state_file(self, source, dest_dir):
+        key = hashlib.sha1(f"{Path(source).resolve()}\0{Path(dest_dir).resolve()}".encode()).hexdigest()
+        return self.state_dir / f"{key}.json"
+
+    def _load_state(self, state_file, dest_dir):
+        try:
+            state = json.loads(state_file.read_text())
+        except (OSError, ValueError):
+            return None
+
+        # Re-base when the chain is too long or any link of it was deleted
+        chain = state.get("chain", [])
+        if not chain or len(chain) > MAX_INCREMENT_CHAIN:
+            return None
+        if not all((Path(dest_dir) / name).exists() for name in chain):
+            return None
+        return state
+
+    def create(self, source, destination, progress=None, on_plan=None, on_file=None, hasher=None):
+        """Write a full or incremental archive of source to destination
+
+        on_plan(bytes, files) is called with the size of what will be archived
+        once the changes are known, on_file(relpath) after each regular file.
+        hasher (if given) is updated with the archive bytes.
+
+        Returns:
+            dict: the increment header written to the archive
+        """
+        source = Path(source)
+        destination = Path(destination)
+        state_file = self._state_file(source, destination.parent)
+        state = self._load_state(state_file, destination.parent)
+
+        previous = state["entries"] if state else {}
+        entries = scan_tree(source, self.hash_files, previous)
+
+        if state:
+            changed = [p for p, sig in entries.items() if sig[0] == "d" or _entry_changed(previous.get(p), sig)]
+            deleted = sorted(p for p in previous if p not in entries)
+            header = {
+                "base": state["chain"][-1],
+                "level": len(state["chain"]),
+                "deleted": deleted,
+            }
+            chain = state["chain"] + [destination.name]
+        else:
+            changed = list(entries)
+            header = {"base": None, "level": 0, "deleted": []}
+            chain = [destination.name]
+        header["source"] = str(source)
+        header["created"] = datetime.now().isoformat(timespec='seconds')
+
+        if on_plan:
+            files = [entries[p] for p in changed if entries[p][0] == "f"]
+            on_plan(sum(sig[1] for sig in files), len(files))
+
+        with open_tar_writer(destination, codec_for_path(destination, self.codec), progress=progress,
+                             index=True, hasher=hasher) as tar:
+            data = json.dumps(header).encode()
+            info = tarfile.TarInfo(INCREMENT_MEMBER)
+            info.size = len(data)
+            info.mtime = int(datetime.now().timestamp())
+            tar.addfile(info, io.BytesIO(data))
+
+            headers = _TarHeaders()
+            for relpath in changed:
+                full_path = source.parent / relpath
+                st = os.lstat(full_path)
+                info = headers.tarinfo(full_path, relpath, st)
+                if info is None:
+                    continue
+                if info.isreg():
+                    _add_file(tar, full_path, info, sparse=may_have_holes(st))
+                else:
+                    tar.addfile(info)
+                if on_file and entries[relpath][0] == "f":
+                    on_file(relpath)
+
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = state_file.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({
+            "source": str(source),
+            "dest_dir": str(destination.parent),
+            "chain": chain,
+            "entries": entries,
+        }))
+        os.replace(tmp_path, state_file)
+
+        logger.info(f"Incremental backup level {header['level']}: {len(changed)} entries, "
+                    f"{len(header['deleted'])} deletions")
+        return header
+
+
+def archive_chain(archive_path):
+    """Archives needed to rebuild archive_path, oldest (full) first"""
+    archive_path = Path(archive_path)
+    chain = [archive_path]
+    info = read_increment_info(archive_path)
+
+    while info and info.get("base"):
+        base = archive_path.parent / info["base"]
+        if not base.exists():
+            raise FileNotFoundError(f"Base archive missing: {info['base']}")
+        if base in chain:
+            raise ValueError(f"Archive chain loops at {base.name}")
+        chain.append(base)
+        info = read_increment_info(base)
+
+    chain.reverse()
+    return chain
+
+
+def restore_archive_chain(archive_path, target_dir):
+    """Extract a (possibly incremental) folder archive into target_dir"""
+    target_dir = Path(target_dir)
+
+    for archive in archive_chain(archive_path):
+        # Archives may be read as a stream (zstd), so the increment header is
+        # extracted along with everything else and picked up afterwards
+        with open_tar_reader(archive) as tar:
+            tar.extractall(target_dir, members=_counted_members(tar))
+
+        info = {}
+        header_path = target_dir / INCREMENT_MEMBER
+        if header_path.exists():
+            info = json.loads(header_path.read_text())
+            header_path.unlink()
+
+        for relpath in info.get("deleted", ()):
+            path = target_dir / _safe_relpath(relpath)
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.exists() or path.is_symlink():
+                path.unlink()
+
+
+def _counted_members(tar):
+    """Iterate an archive's members, counting the files extracted into the current operation"""
+    metrics = current_metrics()
+    for member in tar:
+        if metrics and member.isreg():
+            metrics.add(written=member.size, files=1)
+        yield member
+
+
+def _deleted_in(name, deleted):
+    """Whether name or one of its parent folders is in deleted"""
+    parts = name.split('/')
+    return any('/'.join(parts[:i]) in deleted for i in range(1, len(parts) + 1))
+
+
+def _walk_chain_indexes(archive_path):
+    """Yield (archive, SeekableArchive, deleted) newest first
+
+    deleted holds the paths removed by archives newer than this one, which
+    must not be taken from it.
+    """
+    deleted = set()
+    for archive in reversed(archive_chain(archive_path)):
+        with SeekableArchive(archive) as index:
+            yield archive, index, deleted
+            header = index.read_member(INCREMENT_MEMBER)
+        if header:
+            deleted = deleted | set(json.loads(header).get("deleted", ()))
+
+
+def search_archive_chain(archive_path, text, limit=200):
+    """Names of restorable items containing text (newest archive chain state)"""
+    names = set()
+    for archive, index, deleted in _walk_chain_indexes(archive_path):
+        names.update(name for name in index.search(text, limit) if not _deleted_in(name, deleted))
+    names.discard(INCREMENT_MEMBER)
+    return sorted(names)[:limit]
+
+
+def restore_archive_item(archive_path, item, target_dir):
+    """Restore one file or folder (with its contents) from a folder archive
+
+    Only the compressed blocks holding the item are read. For incremental
+    archives, each path comes from the newest archive in the chain that has it.
+
+    Returns:
+        int: number of entries restored
+    """
+    found = {}
+    for archive, index, deleted in _walk_chain_indexes(archive_path):
+        for name, offset in index.members_under(item):
+            if name != INCREMENT_MEMBER and name not in found and not _deleted_in(name, deleted):
+                found[name] = (archive, offset)
+    if not found:
+        raise FileNotFoundError(f"'{item}' is not in {Path(archive_path).name}")
+
+    by_archive = collections.defaultdict(list)
+    for archive, offset in found.values():
+        by_archive[archive].append(offset)
+
+    restored = 0
+    for archive, offsets in by_archive.items():
+        with SeekableArchive(archive) as reader:
+            restored += reader.extract(offsets, target_dir)
+    return restored
+
+
+# tar member types as scan_tree signature kinds; hard links are resolved to their target
+_TAR_KINDS = {"0": "f", "\x00": "f", "7": "f", "5": "d", "2": "l", "1": "hardlink"}
+# Stored and live mtimes of an unchanged file can differ by float rounding
+MTIME_TOLERANCE = 1e-6
+
+
+def archive_entries(archive_path):
+    """{name: (kind, size, mtime, link, hash)} of what restoring an archive chain gives
+
+    Kinds are those of scan_tree signatures ("f", "d", "l").
+    """
+    found = {}
+    for archive, index, deleted in _walk_chain_indexes(archive_path):
+        for name, tar_type, size, mtime, link, digest in index.entries():
+            if name != INCREMENT_MEMBER and name not in found and not _deleted_in(name, deleted):
+                found[name] = (_TAR_KINDS.get(tar_type, tar_type), size, mtime, link, digest)
+
+    for name, entry in found.items():
+        if entry[0] == "hardlink" and entry[3] in found:
+            target = found[entry[3]]
+            found[name] = ("f", target[1], entry[2], None, target[4])
+    return found
+
+
+def _try_hash_file(path):
+    try:
+        return _hash_file(path)
+    except OSError:
+        return None
+
+
+def compare_archive(archive_path, source, workers=None):
+    """Compare a folder archive with the live folder without extracting anything
+
+    The live folder is only stat-walked; files are hashed (on a pool) just
+    when their size matches but their mtime doesn't.
+
+    Returns:
+        dict: "added" (only in the folder), "removed" (only in the backup)
+        and "modified" lists of paths relative to the folder's parent, and
+        the "unchanged" count
+    """
+    source = Path(source)
+    stored = archive_entries(archive_path)
+    live = scan_tree(source)
+
+    added = sorted(path for path in live if path not in stored)
+    removed = sorted(path for path in stored if path not in live)
+    modified = []
+    to_hash = []
+    unchanged = 0
+
+    for path, signature in live.items():
+        entry = stored.get(path)
+        if entry is None:
+            continue
+        kind, size, mtime, link, digest = entry
+        if kind != signature[0]:
+            modified.append(path)
+        elif kind == "l":
+            if link == signature[1]:
+                unchanged += 1
+            else:
+                modified.append(path)
+        elif kind == "f":
+            if size != signature[1] or not digest:
+                modified.append(path)
+            elif abs(mtime - signature[2] / 1e9) < MTIME_TOLERANCE:
+                unchanged += 1
+            else:
+                to_hash.append(path)
+        else:
+            unchanged += 1
+
+    metrics = current_metrics()
+    if metrics:
+        metrics.add(files=len(live))
+    if to_hash:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            digests = pool.map(_try_hash_file, [source.parent / path for path in to_hash])
+            for path, digest in zip(to_hash, digests):
+                if digest == stored[path][4]:
+                    unchanged += 1
+                else:
+                    modified.append(path)
+        if metrics:
+            # Hashed on the pool: reading and hashing in one phase
+            metrics.add("read", time.perf_counter() - start, read=sum(live[path][1] for path in to_hash))
+
+    return {
+        "added": added,
+        "removed": removed,
+        "modified": sorted(modified),
+        "unchanged": unchanged,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Checksums and verification
+# ---------------------------------------------------------------------------
+
+# Backups are hashed while they are written ("blake2b:<hex>"); the checksum is
+# kept in an extended attribute on the backup file and in the catalog
+CHECKSUM_ALGORITHM = "blake2b"
+CHECKSUM_XATTR = "user.nautilus-backup.checksum"
+
+# Outcomes of verify_backup
+VERIFY_OK = "ok"
+VERIFY_MISSING = "missing"
+VERIFY_TRUNCATED = "truncated"
+VERIFY_CORRUPT = "corrupt"
+VERIFY_UNCHECKED = "unchecked"
+
+
+def _new_hasher(algorithm=CHECKSUM_ALGORITHM):
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    return hashlib.new(algorithm)
+
+
+def new_checksum():
+    """Hasher to pass to copy_file / open_tar_writer while writing a backup"""
+    return _new_hasher()
+
+
+def format_checksum(hasher):
+    return f"{CHECKSUM_ALGORITHM}:{hasher.hexdigest()}"
+
+
+def store_checksum(path, checksum):
+    """Attach a checksum to a backup file (skipped where xattrs aren't supported)"""
+    try:
+        os.setxattr(path, CHECKSUM_XATTR, checksum.encode())
+        return True
+    except OSError as e:
+        logger.debug(f"No checksum attribute on {path}: {e}")
+        return False
+
+
+def read_checksum(path):
+    """Checksum stored on a backup file, or None"""
+    try:
+        return os.getxattr(path, CHECKSUM_XATTR).decode()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _verify_chunks(manifest, verified_chunks, progress):
+    """Check every chunk a manifest references, returns an error or None"""
+    store = ChunkStore(manifest["store"])
+    for entry in manifest["entries"]:
+        for digest, length in entry.get("chunks", ()):
+            if digest in verified_chunks:
+                continue
+            try:
+                store.get(digest)
+            except FileNotFoundError:
+                return f"Missing chunk of {entry['path']}"
+            except ValueError:
+                return f"Damaged chunk of {entry['path']}"
+            verified_chunks.add(digest)
+            progress(length)
+    return None
+
+
+def _decode_archive(path, progress):
+    """Read an archive to the end, returns (status, detail) for a damaged one or None"""
+    try:
+        with open_tar_reader(path) as tar:
+            for member in tar:
+                if member.isfile():
+                    fileobj = tar.extractfile(member)
+                    for block in iter(lambda: fileobj.read(COPY_CHUNK_SIZE), b''):
+                        progress(len(block))
+    except EOFError as e:
+        return VERIFY_TRUNCATED, str(e)
+    except tarfile.ReadError as e:
+        if "unexpected end" in str(e):
+            return VERIFY_TRUNCATED, str(e)
+        return VERIFY_CORRUPT, str(e)
+    except (tarfile.TarError, OSError, zlib.error, lzma.LZMAError) as e:
+        return VERIFY_CORRUPT, str(e)
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            return VERIFY_CORRUPT, str(e)
+        raise
+    return None
+
+
+def verify_backup(path, checksum=None, size=None, verified_chunks=None, progress=None):
+    """Check one backup file against its recorded checksum and size
+
+    checksum defaults to the one stored on the file. Without any, archives
+    are decoded to the end instead and plain copies are reported unchecked.
+    Deltas also need the full backup they were made against.
+    Manifests also have their chunks checked; verified_chunks (a set shared
+    between calls) avoids reading chunks common to several manifests again.
+    progress(count) is called with bytes read and may raise to abort.
+
+    Returns:
+        tuple: (status, detail), status one of the VERIFY_* values
+    """
+    path = Path(path)
+    progress = progress or _ignore_progress
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return VERIFY_MISSING, "Backup file is gone"
+
+    if size is not None and st.st_size != size:
+        if st.st_size < size:
+            return VERIFY_TRUNCATED, f"{format_size(st.st_size)} of {format_size(size)}"
+        return VERIFY_CORRUPT, f"Size changed from {format_size(size)} to {format_size(st.st_size)}"
+
+    checksum = checksum or read_checksum(path)
+    if checksum:
+        algorithm, _, expected = checksum.partition(":")
+        try:
+            hasher = _new_hasher(algorithm)
+        except ValueError:
+            return VERIFY_UNCHECKED, f"Unknown checksum algorithm {algorithm}"
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                hasher.update(block)
+                progress(len(block))
+        if hasher.hexdigest() != expected:
+            return VERIFY_CORRUPT, "Checksum mismatch"
+
+    if path.name.endswith(MANIFEST_SUFFIX):
+        try:
+            manifest = load_manifest(path)
+        except ValueError as e:
+            return VERIFY_CORRUPT, str(e)
+        error = _verify_chunks(manifest, verified_chunks if verified_chunks is not None else set(), progress)
+        return (VERIFY_CORRUPT, error) if error else (VERIFY_OK, "")
+
+    if path.name.endswith(DELTA_SUFFIX):
+        try:
+            base = delta_base(path)
+        except EOFError as e:
+            return VERIFY_TRUNCATED, str(e)
+        except ValueError as e:
+            return VERIFY_CORRUPT, str(e)
+        if not base.exists():
+            return VERIFY_CORRUPT, f"Full backup {base.name} is gone"
+
+    if checksum:
+        return VERIFY_OK, ""
+    if archive_suffix(path):
+        return _decode_archive(path, progress) or (VERIFY_OK, "Decoded (no checksum recorded)")
+    return VERIFY_UNCHECKED, "No checksum recorded"
+
+
+# ---------------------------------------------------------------------------
+# Change detection
+# ---------------------------------------------------------------------------
+
+# What happens when a source hasn't changed since its last backup in the same
+# folder: "off" always backs up; opt in to "link" to add the new version as a
+# hard link to that backup, or "skip" to write nothing. ":hash" also compares
+# contents, so a touched but identical source counts as unchanged
+DEFAULT_UNCHANGED_MODE = "off"
+
+
+def source_state(source):
+    """Stat fingerprint (size, mtime, inode) of a file or of a whole folder
+
+    Returns:
+        tuple: (state, (bytes, regular files))
+    """
+    st = os.stat(source)
+    if not stat.S_ISDIR(st.st_mode):
+        return f"f:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}", (st.st_size, 1)
+
+    digest, totals = _tree_fingerprint(iter_tree_signatures(source))
+    return f"d:{digest}", totals
+
+
+def source_content_hash(source):
+    """Checksum of a file's bytes (as format_checksum), or of a folder's paths and contents"""
+    source = Path(source)
+    if not source.is_dir():
+        hasher = new_checksum()
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                hasher.update(block)
+        return format_checksum(hasher)
+
+    # Sizes and hashes only: a touch or a copy of the tree doesn't count
+    entries = ((path, [sig[0], sig[1], sig[4]] if sig[0] == "f" else sig)
+               for path, sig in iter_tree_signatures(source, hash_files=True))
+    digest, _ = _tree_fingerprint(entries)
+    return f"tree:{digest}"
+
+
+def _tree_fingerprint(entries):
+    """blake2b hex digest of (relpath, signature) pairs and their (bytes, regular files)
+
+    Each pair is hashed as it arrives (walk_tree order is deterministic), so
+    memory stays flat however many entries a folder has.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    size = files = 0
+    for relpath, signature in entries:
+        digest.update(json.dumps([relpath, signature]).encode())
+        digest.update(b"\n")
+        if signature[0] == "f":
+            size += signature[1]
+            files += 1
+    return digest.hexdigest(), (size, files)
+
+
+def link_backup(previous, destination):
+    """Add destination as another name of an existing backup (no data is written)
+
+    The archive index or chunk signature comes along. Returns False where
+    hard links aren't possible (other file system, FAT, ...).
+    """
+    try:
+        os.link(previous, destination)
+    except OSError as e:
+        logger.debug(f"Cannot link {destination} to {previous}: {e}")
+        return False
+    for sidecar_path in (index_path_for, signature_path_for):
+        try:
+            os.link(sidecar_path(previous), sidecar_path(destination))
+        except OSError:
+            pass
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Backup file names
+# ---------------------------------------------------------------------------
+
+# name_backup_YYYY-MM-DD_HH-MM-SS[-N][.ext], -N telling apart same-named items
+# backed up to one folder in the same second; compiled once, these run on
+# every right-click
+BACKUP_STAMP_RE = re.compile(r'_backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}(?:-\d+)?')
+BACKUP_NAME_RE = re.compile(r'^(.+)_backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}(?:-\d+)?(.*)$')
+
+
+# ---------------------------------------------------------------------------
+# Backup catalog
+# ---------------------------------------------------------------------------
+
+# One entry per schema version; each upgrades the database from the previous
+CATALOG_MIGRATIONS = [
+    """
+    CREATE TABLE backups (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        original_name TEXT NOT NULL,
+        destination TEXT NOT NULL UNIQUE,
+        dest_dir TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        codec TEXT,
+        checksum TEXT
+    );
+    CREATE INDEX backups_by_source ON backups (source, created);
+    CREATE INDEX backups_by_folder ON backups (dest_dir, original_name, created);
+    CREATE TABLE indexed_dirs (
+        path TEXT PRIMARY KEY,
+        scanned REAL NOT NULL
+    );
+    """,
+    # Change detection: the source's fingerprint when it was backed up, and
+    # the backup an unchanged version links to
+    """
+    ALTER TABLE backups ADD COLUMN source_state TEXT;
+    ALTER TABLE backups ADD COLUMN source_hash TEXT;
+    ALTER TABLE backups ADD COLUMN same_as TEXT;
+    """,
+]
+
+
+class BackupCatalog:
+    """SQLite index of every backup, so lookups don't scan directories
+
+    Rows are dicts with the columns of the backups table. The connection is
+    opened on first use and shared by all threads behind a lock.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, script in enumerate(CATALOG_MIGRATIONS[version:], start=version + 1):
+                conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, params)
+
+    def record(self, source, destination, kind, size, codec=None, checksum=None, created=None,
+               source_state=None, source_hash=None, same_as=None):
+        """Add or replace the entry for a backup file"""
+        source = Path(source)
+        destination = Path(destination)
+        self._execute(
+            """INSERT OR REPLACE INTO backups
+               (source, original_name, destination, dest_dir, kind, size, created, codec, checksum,
+                source_state, source_hash, same_as)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (str(source), source.name, str(destination), str(destination.parent), kind, size,
+             created if created is not None else time.time(), codec, checksum,
+             source_state, source_hash, None if same_as is None else str(same_as))
+        )
+
+    def remove(self, destinations):
+        """Forget backups (after they were deleted)"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("DELETE FROM backups WHERE destination = ?", [(str(d),) for d in destinations])
+
+    def find(self, destination):
+        """Entry for a backup file, or None"""
+        rows = self._query("SELECT * FROM backups WHERE destination = ?", (str(destination),))
+        return rows[0] if rows else None
+
+    def history(self, source):
+        """All backups of a source path, newest first"""
+        return self._query("SELECT * FROM backups WHERE source = ? ORDER BY created DESC", (str(source),))
+
+    def backups_in(self, dest_dir, original_name):
+        """Backups of original_name stored in dest_dir, newest first"""
+        return self._query(
+            "SELECT * FROM backups WHERE dest_dir = ? AND original_name = ? ORDER BY created DESC",
+            (str(dest_dir), original_name)
+        )
+
+    def backups_in_folder(self, dest_dir):
+        """Every backup stored in dest_dir, newest first"""
+        return self._query("SELECT * FROM backups WHERE dest_dir = ? ORDER BY created DESC", (str(dest_dir),))
+
+    def entries(self):
+        """Every catalogued backup, oldest first"""
+        return self._query("SELECT * FROM backups ORDER BY created")
+
+    def totals(self):
+        """(number of backups, total bytes) currently catalogued (linked versions take no space)"""
+        row = self._query("SELECT COUNT(*) AS count, "
+                          "COALESCE(SUM(CASE WHEN same_as IS NULL THEN size ELSE 0 END), 0) AS size "
+                          "FROM backups")[0]
+        return row["count"], row["size"]
+
+    def known_dirs(self):
+        """Every folder that holds catalogued backups or was scanned"""
+        rows = self._query("SELECT DISTINCT dest_dir AS path FROM backups UNION SELECT path FROM indexed_dirs")
+        return [Path(row["path"]) for row in rows]
+
+    def is_indexed(self, directory):
+        return bool(self._query("SELECT 1 FROM indexed_dirs WHERE path = ?", (str(directory),)))
+
+    def reconcile(self, directory, identify):
+        """Sync the catalog with the backup files actually in a folder
+
+        identify(path) returns (original_name, kind) for backup files and None
+        for anything else. Unknown backups are added (their source is assumed
+        to sit next to them), entries whose file is gone are dropped.
+
+        Returns:
+            tuple: (added, removed)
+        """
+        directory = Path(directory)
+        on_disk = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if '_backup_' not in entry.name:
+                        continue
+                    identity = identify(Path(entry.path))
+                    if identity:
+                        on_disk[entry.path] = (identity, entry.stat())
+        except FileNotFoundError:
+            pass
+
+        known = {row["destination"] for row in self._query(
+            "SELECT destination FROM backups WHERE dest_dir = ?", (str(directory),))}
+        stale = known - on_disk.keys()
+        added = 0
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for path, ((original_name, kind), st) in on_disk.items():
+                    if path in known:
+                        continue
+                    conn.execute(
+                        """INSERT OR IGNORE INTO backups
+                           (source, original_name, destination, dest_dir, kind, size, created)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                        (str(directory / original_name), original_name, path, str(directory),
+                         kind, st.st_size, st.st_mtime)
+                    )
+                    added += 1
+                conn.executemany("DELETE FROM backups WHERE destination = ?", [(p,) for p in stale])
+                conn.execute("INSERT OR REPLACE INTO indexed_dirs (path, scanned) VALUES (?, ?)",
+                             (str(directory), time.time()))
+
+        return added, len(stale)
+
+
+# ---------------------------------------------------------------------------
+# Retention
+# ---------------------------------------------------------------------------
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Grandfather-father-son thinning: (age limit, bucket length). Within each
+# age limit the newest backup of every bucket is kept; 0 keeps them all and
+# a None limit covers everything older
+GFS_TIERS = [
+    (DAY, 0),
+    (7 * DAY, HOUR),
+    (31 * DAY, DAY),
+    (365 * DAY, 7 * DAY),
+    (None, 30 * DAY),
+]
+
+# Seconds to wait after a backup before pruning, so a burst shares one pass
+RETENTION_DELAY = 5
+
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_size(text):
+    """Byte count from '500M', '20G', '1.5t' or a plain number"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?', text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+class RetentionPolicy:
+    """Which backups of an item to keep
+
+    A backup is kept if any rule keeps it: it is among the newest keep_last,
+    or it is the newest of its GFS bucket (tiers). Without either rule every
+    backup is kept. Size caps then drop the oldest kept backups until each
+    item stays under max_item_size and each backup folder under
+    max_folder_size. The newest backup of an item is never deleted.
+    """
+
+    def __init__(self, keep_last=None, tiers=None, max_item_size=None, max_folder_size=None):
+        self.keep_last = keep_last
+        self.tiers = tiers
+        self.max_item_size = max_item_size
+        self.max_folder_size = max_folder_size
+
+    @property
+    def active(self):
+        return any((self.keep_last, self.tiers, self.max_item_size, self.max_folder_size))
+
+
+def parse_retention(spec, keep_last=None):
+    """Build a policy from a setting like 'gfs,item:2G,folder:50G'
+
+    Comma-separated rules: 'gfs' (GFS_TIERS), 'last:N', 'item:SIZE' and
+    'folder:SIZE'. Unknown rules are logged and ignored.
+    """
+    policy = RetentionPolicy(keep_last=keep_last)
+    for rule in (spec or "").lower().split(','):
+        key, _, value = rule.strip().partition(':')
+        try:
+            if not key:
+                continue
+            elif key == "gfs":
+                policy.tiers = GFS_TIERS
+            elif key == "last":
+                policy.keep_last = int(value)
+            elif key == "item":
+                policy.max_item_size = parse_size(value)
+            elif key == "folder":
+                policy.max_folder_size = parse_size(value)
+            else:
+                raise ValueError("unknown rule")
+        except ValueError as e:
+            logger.warning(f"Ignoring retention rule '{rule.strip()}': {e}")
+    return policy
+
+
+def _gfs_bucket(created, tiers, now):
+    """GFS bucket of a backup, True to always keep it, None if it is too old"""
+    age = now - created
+    for tier, (limit, length) in enumerate(tiers):
+        if limit is None or age < limit:
+            return (tier, int(created // length)) if length else True
+    return None
+
+
+def _retain_item(backups, policy, now):
+    """Split one item's backups (newest first) into (keep, delete) by rules and item cap"""
+    keep, delete = [], []
+    buckets = set()
+    for position, row in enumerate(backups):
+        kept = position == 0 or not (policy.keep_last or policy.tiers)
+        if policy.keep_last and position < policy.keep_last:
+            kept = True
+        if policy.tiers:
+            bucket = _gfs_bucket(row["created"], policy.tiers, now)
+            if bucket is True or (bucket is not None and bucket not in buckets):
+                kept = True
+            buckets.add(bucket)
+        (keep if kept else delete).append(row)
+
+    if policy.max_item_size:
+        total = 0
+        capped = []
+        for row in keep:
+            total += row["size"]
+            (delete if capped and total > policy.max_item_size else capped).append(row)
+        keep = capped
+    return keep, delete
+
+
+def plan_retention(backups, policy, now=None):
+    """Decide which backups (catalog rows) a policy deletes
+
+    Works from the index alone: rows need destination, dest_dir,
+    original_name, created and size; nothing is read from disk.
+
+    Returns:
+        tuple: (keep, delete) lists of rows
+    """
+    now = time.time() if now is None else now
+    items = collections.defaultdict(list)
+    for row in sorted(backups, key=lambda row: row["created"], reverse=True):
+        items[(row["dest_dir"], row["original_name"])].append(row)
+
+    keep, delete = [], []
+    for rows in items.values():
+        item_keep, item_delete = _retain_item(rows, policy, now)
+        keep += item_keep
+        delete += item_delete
+
+    if policy.max_folder_size:
+        newest = {id(rows[0]) for rows in items.values()}
+        folders = collections.defaultdict(list)
+        for row in keep:
+            folders[row["dest_dir"]].append(row)
+        dropped = set()
+        for rows in folders.values():
+            total = sum(row["size"] for row in rows)
+            for row in sorted(rows, key=lambda row: row["created"]):
+                if total <= policy.max_folder_size:
+                    break
+                if id(row) not in newest:
+                    dropped.add(id(row))
+                    delete.append(row)
+                    total -= row["size"]
+        keep = [row for row in keep if id(row) not in dropped]
+    return keep, delete
+
+
+# ---------------------------------------------------------------------------
+# Backup job scheduling
+# ---------------------------------------------------------------------------
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+# Concurrent jobs per destination device: one stream keeps a spinning disk at
+# full speed while several seek it to death; flash handles some parallelism
+ROTATIONAL_DEVICE_JOBS = 1
+SOLID_STATE_DEVICE_JOBS = 3
+UNKNOWN_DEVICE_JOBS = 2
+MAX_BACKUP_WORKERS = 4
+
+# Queued jobs listed by BackupScheduler.status() (the rest are only counted)
+STATUS_QUEUED_SHOWN = 10
+
+# Throughput is measured over the last RATE_WINDOW seconds, sampled this often
+RATE_WINDOW = 10
+RATE_SAMPLE_INTERVAL = 0.5
+
+# Seconds between updates of a progress notification
+PROGRESS_NOTIFY_INTERVAL = 2
+
+
+class BackupCancelled(Exception):
+    """Raised inside a job when it was cancelled"""
+
+
+def _device_of(path):
+    """st_dev of the closest existing ancestor of path"""
+    path = Path(path)
+    for candidate in (path, *path.parents):
+        try:
+            return os.stat(candidate).st_dev
+        except OSError:
+            continue
+    return 0
+
+
+def device_job_limit(device):
+    """How many backups may write to a block device at once"""
+    major, minor = os.major(device), os.minor(device)
+    if major == 0:
+        # tmpfs, NFS, FUSE, btrfs subvolumes... no queue to look at
+        return UNKNOWN_DEVICE_JOBS
+
+    sysfs = Path(f"/sys/dev/block/{major}:{minor}")
+    # Partitions have no queue of their own, their parent disk does
+    for queue_dir in (sysfs / "queue", sysfs / ".." / "queue"):
+        try:
+            rotational = (queue_dir / "rotational").read_text().strip()
+        except OSError:
+            continue
+        return ROTATIONAL_DEVICE_JOBS if rotational == "1" else SOLID_STATE_DEVICE_JOBS
+    return UNKNOWN_DEVICE_JOBS
+
+
+def measure_tree(source):
+    """(bytes, regular files) under source, or of source itself if it's a file"""
+    source = Path(source)
+    if not source.is_dir():
+        return source.stat().st_size, 1
+
+    total = files = 0
+    for _path, _name, st in walk_tree(source, source.name, onerror=lambda e: None):
+        if stat.S_ISREG(st.st_mode):
+            total += st.st_size
+            files += 1
+    return total, files
+
+
+def format_size(size):
+    """Human readable byte count"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+def format_duration(seconds):
+    """Rough duration such as 45 s, 12 min or 3 h 05 min"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} s"
+    if seconds < 3600:
+        return f"{seconds // 60} min"
+    return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+
+
+def describe_progress(snapshot):
+    """Two-line summary of a BackupProgress snapshot for notifications"""
+    done = format_size(snapshot["bytes_done"])
+    if snapshot["bytes_total"]:
+        line = f"{done} of {format_size(snapshot['bytes_total'])} ({snapshot['percent']:.0f}%)"
+    else:
+        line = done
+    if snapshot["files_total"]:
+        line += f" · {snapshot['files_done']} of {snapshot['files_total']} files"
+    elif snapshot["files_done"]:
+        line += f" · {snapshot['files_done']} files"
+
+    speed = f"{snapshot['rate'] / (1024 * 1024):.1f} MB/s"
+    if snapshot["eta"] is not None:
+        speed += f" · about {format_duration(snapshot['eta'])} left"
+    return f"{line}\n{speed}"
+
+
+class BackupProgress:
+    """Live counters of one backup: bytes and files done, throughput, ETA
+
+    Copy loops report through add_bytes() and file_done(); any thread may
+    call snapshot(). Without totals there is no percentage or ETA.
+    """
+
+    def __init__(self):
+        self.bytes_done = 0
+        self.files_done = 0
+        self.bytes_total = None
+        self.files_total = None
+        self.current = None
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """Restart the clock (jobs wait in the queue before they run)"""
+        with self._lock:
+            self.started = time.monotonic()
+            self._samples = collections.deque([(self.started, self.bytes_done)])
+
+    def set_totals(self, bytes_total, files_total):
+        self.bytes_total = bytes_total
+        self.files_total = files_total
+
+    def add_bytes(self, count):
+        if not count:
+            return
+        with self._lock:
+            self.bytes_done += count
+            now = time.monotonic()
+            if now - self._samples[-1][0] >= RATE_SAMPLE_INTERVAL:
+                self._samples.append((now, self.bytes_done))
+                while now - self._samples[0][0] > RATE_WINDOW:
+                    self._samples.popleft()
+
+    def file_done(self, path=None):
+        self.files_done += 1
+        self.current = path
+
+    def snapshot(self):
+        """Current numbers as a dict (rate in bytes/s, eta in seconds or None)"""
+        with self._lock:
+            now = time.monotonic()
+            since, bytes_then = self._samples[0]
+            bytes_done = self.bytes_done
+
+        elapsed = now - self.started
+        rate = (bytes_done - bytes_then) / (now - since) if now > since else 0.0
+        percent = eta = None
+        if self.bytes_total:
+            # Archive headers make the written stream slightly larger than the sources
+            percent = min(100.0, 100.0 * bytes_done / self.bytes_total)
+            if rate > 0:
+                eta = max(0.0, (self.bytes_total - bytes_done) / rate)
+        return {
+            "bytes_done": bytes_done,
+            "bytes_total": self.bytes_total,
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "current": self.current,
+            "elapsed": elapsed,
+            "rate": rate,
+            "percent": percent,
+            "eta": eta,
+        }
+
+
+class BackupJob:
+    """A queued or running backup
+
+    The job function receives the job and should call job.checkpoint() from
+    its copy loops; it raises BackupCancelled once the job is cancelled.
+    job.progress tracks the bytes and files done.
+    """
+
+    def __init__(self, job_id, func, description, device, priority, on_done):
+        self.id = job_id
+        self.func = func
+        self.description = description
+        self.device = device
+        self.priority = priority
+        self.on_done = on_done
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.progress = BackupProgress()
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def checkpoint(self, count=0):
+        """Progress hook for copy loops (count = bytes done), aborts the job once cancelled"""
+        self.progress.add_bytes(count)
+        if self._cancel_event.is_set():
+            raise BackupCancelled(self.description)
+
+
+class BackupBatch:
+    """Collects the outcome of related jobs and reports once all are done
+
+    Pass batch.job_done as on_done for each job; the job result must be the
+    (success, error) tuple returned by _create_backup.
+    """
+
+    def __init__(self, total, on_complete):
+        self.total = total
+        self.on_complete = on_complete
+        self.succeeded = []
+        self.failed = []
+        self.cancelled = []
+        self._lock = threading.Lock()
+
+    def job_done(self, job):
+        success, error = job.result or (False, job.error)
+        with self._lock:
+            if job.state == "cancelled" or job.cancelled:
+                self.cancelled.append(job.description)
+            elif success:
+                self.succeeded.append(job.description)
+            else:
+                self.failed.append((job.description, error or "Unknown error"))
+            finished = len(self.succeeded) + len(self.failed) + len(self.cancelled) == self.total
+
+        if finished:
+            self.on_complete(self)
+
+
+class BackupScheduler:
+    """Priority/FIFO queue of backup jobs run by a small worker pool
+
+    At most max_workers jobs run at once, and no more than the device limit
+    (device_jobs, or see device_job_limit) write to the same destination device.
+    Each device has its own heap of (priority, id, job), so dispatching a job
+    costs O(log n) however many are queued. Cancelled jobs leave the heaps
+    lazily, when they reach the top.
+    """
+
+    def __init__(self, max_workers=MAX_BACKUP_WORKERS, device_jobs=None):
+        self.max_workers = max_workers
+        self.device_jobs = device_jobs
+        self._cond = threading.Condition()
+        self._queues = collections.defaultdict(list)
+        self._queued = {}
+        self._running = {}
+        self._device_busy = collections.Counter()
+        self._device_limits = {}
+        self._device_cache = {}
+        self._workers = 0
+        self._idle_workers = 0
+        self._next_id = 1
+
+    def _device_for(self, destination):
+        """Device of a destination's folder, cached (batches share folders)"""
+        folder = str(Path(destination).parent)
+        device = self._device_cache.get(folder)
+        if device is None:
+            device = self._device_cache[folder] = _device_of(folder)
+        return device
+
+    def submit(self, func, description, destination, priority=PRIORITY_NORMAL, on_done=None):
+        """Queue func(job); on_done(job) runs in the worker when it finishes"""
+        device = self._device_for(destination)
+
+        with self._cond:
+            if device not in self._device_limits:
+                self._device_limits[device] = self.device_jobs or device_job_limit(device)
+            job = BackupJob(self._next_id, func, description, device, priority, on_done)
+            self._next_id += 1
+            heapq.heappush(self._queues[device], (priority, job.id, job))
+            self._queued[job.id] = job
+
+            if self._idle_workers == 0 and self._workers < self.max_workers:
+                self._workers += 1
+                thread = threading.Thread(target=self._worker, name=f"backup-worker-{self._workers}")
+                thread.daemon = True
+                thread.start()
+            self._cond.notify_all()
+        return job
+
+    def _head(self, device):
+        """(priority, id, job) next in line for a device, or None (call with the lock held)"""
+        heap = self._queues[device]
+        while heap and heap[0][1] not in self._queued:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _next_runnable(self):
+        """Highest priority, oldest job whose device has a free slot"""
+        best = None
+        for device in self._queues:
+            if self._device_busy[device] >= self._device_limits[device]:
+                continue
+            head = self._head(device)
+            if head and (best is None or head[:2] < best[:2]):
+                best = head
+        if best is None:
+            return None
+        heapq.heappop(self._queues[best[2].device])
+        return self._queued.pop(best[1])
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_runnable()
+                while job is None:
+                    self._idle_workers += 1
+                    self._cond.wait()
+                    self._idle_workers -= 1
+                    job = self._next_runnable()
+                job.state = "running"
+                job.started = time.monotonic()
+                job.progress.start()
+                self._running[job.id] = job
+                self._device_busy[job.device] += 1
+
+            try:
+                job.checkpoint()
+                job.result = job.func(job)
+                job.state = "done"
+            except BackupCancelled:
+                job.state = "cancelled"
+            except Exception as e:
+                logger.error(f"Backup job '{job.description}' failed: {e}")
+                job.error = str(e)
+                job.state = "failed"
+            finally:
+                job.finished = time.monotonic()
+                with self._cond:
+                    del self._running[job.id]
+                    self._device_busy[job.device] -= 1
+                    self._cond.notify_all()
+
+            if job.on_done:
+                try:
+                    job.on_done(job)
+                except Exception as e:
+                    logger.error(f"Backup job callback failed: {e}")
+
+    def cancel(self, job_id=None):
+        """Cancel one job, or every queued and running job
+
+        Returns:
+            int: number of jobs cancelled
+        """
+        with self._cond:
+            if job_id is None:
+                never_started = list(self._queued.values())
+                running = list(self._running.values())
+                self._queued.clear()
+                self._queues.clear()
+            else:
+                job = self._queued.pop(job_id, None)
+                never_started = [job] if job else []
+                running = [self._running[job_id]] if job_id in self._running else []
+            jobs = never_started + running
+            for job in jobs:
+                job.cancel()
+            for job in never_started:
+                job.state = "cancelled"
+                job.finished = time.monotonic()
+
+        # Running jobs report through their worker once they stop
+        for job in never_started:
+            if job.on_done:
+                job.on_done(job)
+        return len(jobs)
+
+    def status(self):
+        """Snapshot of the queue: {"running": [...], "queued": [...], "queued_count": n}
+
+        Only the first STATUS_QUEUED_SHOWN queued jobs, in the order they'll
+        run, are listed.
+        """
+        with self._cond:
+            running = sorted(self._running.values(), key=lambda j: j.id)
+            queued = heapq.nsmallest(STATUS_QUEUED_SHOWN, self._queued.values(), key=lambda j: (j.priority, j.id))
+            return {
+                "running": [{"id": j.id, "description": j.description, "progress": j.progress.snapshot()}
+                            for j in running],
+                "queued": [{"id": j.id, "description": j.description} for j in queued],
+                "queued_count": len(self._queued),
+            }
+
+    def progress(self, job_id):
+        """Progress snapshot of a running job (see BackupProgress.snapshot), or None"""
+        with self._cond:
+            job = self._running.get(job_id)
+        return job.progress.snapshot() if job else None
+
+    def is_busy(self):
+        with self._cond:
+            return bool(self._queued or self._running)
+
+    def is_saturated(self, destination):
+        """Whether a job for destination would have to wait right now"""
+        device = self._device_for(destination)
+        with self._cond:
+            limit = self._device_limits.get(device)
+            if limit is None:
+                return False
+            waiting = self._head(device) is not None
+            return waiting or self._device_busy[device] >= limit or len(self._running) >= self.max_workers
+
+
+# ---------------------------------------------------------------------------
+# Statistics
+# ---------------------------------------------------------------------------
+
+# Seconds between writes of changed statistics
+STATS_FLUSH_INTERVAL = 5
+
+
+class StatsAccumulator:
+    """Backup counters kept in memory and written to a JSON file in batches
+
+    add() only updates memory; a timer flushes changes at most every
+    flush_interval seconds with an atomic temp file + rename, so a crash
+    never leaves a half-written file. The file is only read once a counter
+    is first used. Safe to use from any thread: flushes are written one at
+    a time, so an older snapshot never replaces a newer one.
+    """
+
+    def __init__(self, path, flush_interval=STATS_FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Held from snapshot to rename so concurrent flushes land in order
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        self._loaded = None
+        atexit.register(self.flush)
+
+    @property
+    def _data(self):
+        """Counters, read from the file the first time they are needed (call with the lock held)"""
+        if self._loaded is None:
+            self._loaded = self._load()
+        return self._loaded
+
+    def _load(self):
+        data = {"total_backups": 0, "total_size": 0}
+        try:
+            data.update(json.loads(self.path.read_text()))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load stats: {e}")
+        return data
+
+    def add(self, name, amount=1, group=None):
+        """Increase a counter, or a counter inside the group dict"""
+        with self._lock:
+            counters = self._data.setdefault(group, {}) if group else self._data
+            counters[name] = counters.get(name, 0) + amount
+            self._changed()
+
+    def set(self, name, value, group=None):
+        """Replace a counter (or a value inside the group dict)"""
+        with self._lock:
+            counters = self._data.setdefault(group, {}) if group else self._data
+            counters[name] = value
+            self._changed()
+
+    def _changed(self):
+        """Mark the counters dirty and schedule a flush (call with the lock held)"""
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def get(self, name, default=None):
+        with self._lock:
+            return json.loads(json.dumps(self._data.get(name, default)))
+
+    def flush(self):
+        """Write pending changes now (a failed write is retried by the next timer)"""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                data = json.dumps(self._data)
+                self._dirty = False
+
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".stats-", suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            except Exception as e:
+                logger.error(f"Failed to save stats: {e}")
+                with self._lock:
+                    self._changed()
+
+
+# ---------------------------------------------------------------------------
+# Operation metrics
+# ---------------------------------------------------------------------------
+
+# metrics.jsonl is rotated to metrics.jsonl.1, .2, ... past this size
+METRICS_MAX_BYTES = 1024 * 1024
+METRICS_BACKUP_COUNT = 3
+# Most recent operations kept in memory for percentiles
+METRICS_RECENT = 1000
+# Seconds between rewrites of the Prometheus textfile
+METRICS_EXPORT_INTERVAL = 10
+
+METRICS_OPERATIONS = ("backup", "restore", "compare", "cleanup")
+# Where an operation's time goes; "copy" is a read and write done in the kernel
+METRICS_PHASES = ("read", "compress", "write", "copy")
+METRICS_QUANTILES = (0.5, 0.9, 0.99)
+
+_active_metrics = threading.local()
+
+
+def current_metrics():
+    """OperationMetrics of the operation measured in this thread, or None"""
+    return getattr(_active_metrics, "metrics", None)
+
+
+def metered(fileobj):
+    """fileobj with its reads and writes timed into the current operation (as is when none is measured)"""
+    metrics = current_metrics()
+    return _MeteredFile(fileobj, metrics) if metrics else fileobj
+
+
+class _MeteredFile:
+    """Pass-through file object adding read and write seconds and bytes to an OperationMetrics"""
+
+    def __init__(self, fileobj, metrics):
+        self.fileobj = fileobj
+        self.metrics = metrics
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.fileobj.read(size)
+        self.metrics.add("read", time.perf_counter() - start, read=len(data))
+        return data
+
+    def write(self, data):
+        start = time.perf_counter()
+        count = self.fileobj.write(data)
+        self.metrics.add("write", time.perf_counter() - start, written=len(data))
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.fileobj.close()
+
+
+def _count_file():
+    """Add a file read or written to the current operation"""
+    metrics = current_metrics()
+    if metrics:
+        metrics.add(files=1)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class OperationMetrics:
+    """Measurements of one backup, restore, compare or cleanup
+
+    The copy engine reports into the operation measured in its thread (see
+    BackupCore.measure): bytes and seconds of file reads and writes (through
+    metered()), in-kernel copies and compression. Compression runs on
+    ParallelCompressWriter's workers, so its seconds add up across cores and
+    overlap the other phases; wall time not spent reading, writing or
+    copying is reported as "other". Safe to use from any thread.
+    """
+
+    def __init__(self, operation, name):
+        self.operation = operation
+        self.name = name
+        self.status = "ok"
+        self.error = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.files = 0
+        self.phases = dict.fromkeys(METRICS_PHASES, 0.0)
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add(self, phase=None, seconds=0.0, read=0, written=0, files=0):
+        with self._lock:
+            if phase:
+                self.phases[phase] += seconds
+            self.bytes_read += read
+            self.bytes_written += written
+            self.files += files
+
+    def record(self):
+        """The finished operation as a metrics log entry"""
+        wall = time.perf_counter() - self._start
+        with self._lock:
+            phases = dict(self.phases)
+            read, written = self.bytes_read, self.bytes_written
+        phases["other"] = max(0.0, wall - phases["read"] - phases["write"] - phases["copy"])
+
+        # Uncompressed bytes per stored byte
+        stored, data = (written, read) if self.operation == "backup" else (read, written)
+        return {
+            "time": round(time.time(), 3),
+            "operation": self.operation,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "seconds": round(wall, 6),
+            "bytes_read": read,
+            "bytes_written": written,
+            "files": self.files,
+            "ratio": round(data / stored, 3) if stored and data else None,
+            "phases": {phase: round(seconds, 6) for phase, seconds in phases.items()},
+        }
+
+
+class MetricsLog:
+    """Per-operation metrics in a rotating JSON lines file, optionally exported for Prometheus
+
+    Each record is appended to path as one line; past max_bytes the file is
+    rotated like logging's RotatingFileHandler (path.1 is the newest old
+    file, path.<backup_count> the oldest). The last METRICS_RECENT records
+    are kept in memory for percentiles, read back from the files the first
+    time they are needed. Running totals go to the stats file, so counters
+    survive restarts.
+
+    With an export path, a Prometheus textfile-collector file (see
+    node_exporter's --collector.textfile.directory) is rewritten atomically
+    at most every METRICS_EXPORT_INTERVAL seconds. Safe to use from any thread.
+    """
+
+    def __init__(self, path, stats, max_bytes=METRICS_MAX_BYTES, backup_count=METRICS_BACKUP_COUNT):
+        self.path = Path(path)
+        self.stats = stats
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.export_path = None
+        self._lock = threading.Lock()
+        self._recent = None
+        self._timer = None
+
+    def add(self, record, export_path=None):
+        """Log a finished operation (see OperationMetrics.record) and update the totals"""
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self._lock:
+            try:
+                self._append(line)
+            except OSError as e:
+                logger.error(f"Failed to write metrics: {e}")
+            if self._recent is not None:
+                self._recent.append(record)
+
+        operation = record["operation"]
+        self.stats.add(f"{operation}.{record['status']}", group="metrics")
+        for field in ("seconds", "bytes_read", "bytes_written", "files"):
+            self.stats.add(f"{operation}.{field}", record[field], group="metrics")
+        for phase in METRICS_PHASES:
+            self.stats.add(f"{operation}.{phase}_seconds", record["phases"][phase], group="metrics")
+        if record["status"] == "ok":
+            self.stats.set(f"{operation}.last_success", record["time"], group="metrics")
+
+        self.export_path = export_path
+        if export_path:
+            with self._lock:
+                if self._timer is None:
+                    self._timer = threading.Timer(METRICS_EXPORT_INTERVAL, self.export)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def _append(self, line):
+        """Append to the log, rotating first if it would grow past max_bytes (call with the lock held)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size and size + len(line) > self.max_bytes:
+            for number in range(self.backup_count - 1, 0, -1):
+                older = self.path.with_name(f"{self.path.name}.{number}")
+                if older.exists():
+                    os.replace(older, self.path.with_name(f"{self.path.name}.{number + 1}"))
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        with open(self.path, 'a') as f:
+            f.write(line)
+
+    def recent(self, operation=None):
+        """The most recent records, oldest first"""
+        with self._lock:
+            if self._recent is None:
+                self._recent = collections.deque(self._load(), maxlen=METRICS_RECENT)
+            records = list(self._recent)
+        return [r for r in records if operation in (None, r["operation"])]
+
+    def _load(self):
+        """Records from the rotated files and the log, oldest first"""
+        paths = [self.path.with_name(f"{self.path.name}.{number}") for number in range(self.backup_count, 0, -1)]
+        records = collections.deque(maxlen=METRICS_RECENT)
+        for path in paths + [self.path]:
+            try:
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            # A line cut short by a crash
+                            continue
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.error(f"Failed to read metrics from {path}: {e}")
+        return records
+
+    def summary(self):
+        """Percentiles of the recent operations that succeeded, per operation
+
+        Returns:
+            dict: {operation: {"count", "p50", "p90", "p99" (seconds), "mb_per_s",
+                   "ratio" (medians) and "phases" (share of the wall time)}}
+        """
+        by_operation = collections.defaultdict(list)
+        for record in self.recent():
+            if record["status"] == "ok":
+                by_operation[record["operation"]].append(record)
+
+        summary = {}
+        for operation, records in by_operation.items():
+            seconds = [r["seconds"] for r in records]
+            moved = [max(r["bytes_read"], r["bytes_written"]) / r["seconds"] / (1024 * 1024)
+                     for r in records if r["seconds"] > 0]
+            ratios = [r["ratio"] for r in records if r.get("ratio")]
+            total = sum(seconds)
+            summary[operation] = {
+                "count": len(records),
+                **{f"p{round(q * 100)}": percentile(seconds, q) for q in METRICS_QUANTILES},
+                "mb_per_s": percentile(moved, 0.5) if moved else None,
+                "ratio": percentile(ratios, 0.5) if ratios else None,
+                "phases": {phase: sum(r["phases"].get(phase, 0) for r in records) / total if total else 0
+                           for phase in METRICS_PHASES + ("other",)},
+            }
+        return summary
+
+    def prometheus_text(self):
+        """Totals and recent percentiles in the Prometheus text exposition format"""
+        totals = self.stats.get("metrics", {})
+        summary = self.summary()
+        operations = [op for op in METRICS_OPERATIONS
+                      if any(key.startswith(f"{op}.") for key in totals)]
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP nautilus_backup_{name} {help_text}")
+            lines.append(f"# TYPE nautilus_backup_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                value = value if isinstance(value, int) else round(value, 6)
+                lines.append(f"nautilus_backup_{name}{suffix}{{{label_text}}} {value}")
+
+        metric("operations_total", "counter", "Finished operations by outcome.", [
+            ("", (("operation", op), ("status", status)), totals.get(f"{op}.{status}", 0))
+            for op in operations for status in ("ok", "failed", "cancelled")
+        ])
+        quantiles = [
+            ("", (("operation", op), ("quantile", str(q))), summary[op][f"p{round(q * 100)}"])
+            for op in operations if op in summary for q in METRICS_QUANTILES
+        ]
+        metric("operation_seconds", "summary",
+               f"Wall time of operations (quantiles over the last {METRICS_RECENT} that succeeded).",
+               quantiles + [
+                   (suffix, (("operation", op),), value)
+                   for op in operations
+                   for suffix, value in (
+                       ("_sum", totals.get(f"{op}.seconds", 0)),
+                       ("_count", sum(totals.get(f"{op}.{status}", 0) for status in ("ok", "failed", "cancelled"))),
+                   )
+               ])
+        for field, help_text in (("bytes_read", "Bytes read."), ("bytes_written", "Bytes written."),
+                                 ("files", "Files read or written.")):
+            metric(f"{field}_total", "counter", help_text, [
+                ("", (("operation", op),), totals.get(f"{op}.{field}", 0)) for op in operations
+            ])
+        metric("phase_seconds_total", "counter",
+               "Seconds spent reading, compressing (summed over cores), writing and copying in the kernel.", [
+                   ("", (("operation", op), ("phase", phase)), totals.get(f"{op}.{phase}_seconds", 0))
+                   for op in operations for phase in METRICS_PHASES
+               ])
+        metric("last_success_timestamp_seconds", "gauge", "Unix time the last successful operation finished.", [
+            ("", (("operation", op),), totals[f"{op}.last_success"])
+            for op in operations if f"{op}.last_success" in totals
+        ])
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Rewrite the Prometheus textfile now (if an export path is set)"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        path = self.export_path
+        if not path:
+            return
+        try:
+            self.stats.flush()
+            text = self.prometheus_text()
+            path = Path(path)
+            # node_exporter must never read a half-written file
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(text)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Failed to export metrics to {path}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Backup core
+# ---------------------------------------------------------------------------
+
+DEFAULT_CONFIG_DIR = Path.home() / ".config" / "nautilus-backup"
+DEFAULT_BACKUP_FOLDER = Path.home() / "Backups"
+
+# Singles below this size are backed up inline by the extension, without a
+# progress notification
+LARGE_BACKUP_SIZE = 10_000_000
+
+
+class ConfigValue:
+    """A BackupCore setting kept in its own file in config_dir
+
+    The file is read on first access and again only after it changed (by
+    mtime, size and inode), so settings edited by hand, by the command line
+    tool or by another process apply without a restart. parse() gets the
+    stripped file contents, or "" when the file is missing or unreadable.
+    Assigning a value overrides the file until the file next changes.
+    """
+
+    def __init__(self, filename, parse):
+        self.filename = filename
+        self.parse = parse
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def _signature(self, core):
+        try:
+            st = os.stat(core.config_dir / self.filename)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def __get__(self, core, owner=None):
+        if core is None:
+            return self
+        signature = self._signature(core)
+        cached = core._config_cache.get(self.name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        text = ""
+        if signature is not None:
+            try:
+                text = (core.config_dir / self.filename).read_text().strip()
+            except Exception as e:
+                logger.error(f"Failed to load {self.filename}: {e}")
+        value = self.parse(text)
+        core._config_cache[self.name] = (signature, value)
+        return value
+
+    def __set__(self, core, value):
+        core._config_cache[self.name] = (self._signature(core), value)
+
+
+def _parse_max_backups(text):
+    return int(text) if text and text != "0" else None
+
+
+def _parse_unchanged(text):
+    """(mode, hash) from a setting like 'link', 'skip:hash' or 'off'"""
+    mode, _, option = (text or DEFAULT_UNCHANGED_MODE).lower().partition(':')
+    return (mode if mode in ("link", "skip", "off") else DEFAULT_UNCHANGED_MODE), option == "hash"
+
+
+class BackupCore:
+    """Settings, naming, backup, restore and cleanup shared by the extension and the CLI
+
+    Reads the one-value-per-file settings in config_dir (see ConfigValue).
+    Nothing here needs a desktop session: backups run in the calling thread
+    or as jobs on self.scheduler, and errors are returned, never shown.
+    Construction touches no files; the catalog, statistics and settings are
+    read when first used.
+    """
+
+    # Backup folder for "Backup to ~/Backups"
+    backup_folder = ConfigValue("config.txt", lambda text: Path(text) if text else DEFAULT_BACKUP_FOLDER)
+    # Keep last N backups per item (None: keep all)
+    max_backups = ConfigValue("cleanup.txt", _parse_max_backups)
+    # Retention rules on top of "keep last" (e.g. "gfs,item:2G,folder:50G")
+    retention_spec = ConfigValue("retention.txt", str)
+    # Storage mode (default: plain copies and archives)
+    repository_mode = ConfigValue("storage.txt", lambda text: text == "repository")
+    # Incremental folder backups ("on", or "hash" to also compare contents)
+    incremental_mode = ConfigValue("incremental.txt", lambda text: text if text in ("on", "hash") else None)
+    # Compression codec for folder archives (e.g. "gzip:6", "zstd:3", "xz", "none", "auto")
+    codec = ConfigValue("codec.txt", parse_codec)
+    # Delta backups of large files ("on" or "off")
+    delta_mode = ConfigValue("delta.txt", lambda text: text == "on")
+    # What to do with sources unchanged since their last backup
+    # ("link", "skip" or "off", optionally ":hash" to compare contents)
+    _unchanged = ConfigValue("unchanged.txt", _parse_unchanged)
+    # Prometheus textfile to export metrics to (None: don't export)
+    metrics_export = ConfigValue("metrics-export.txt", lambda text: Path(text).expanduser() if text else None)
+
+    def __init__(self, config_dir=None, max_workers=MAX_BACKUP_WORKERS, device_jobs=None):
+        self.config_dir = Path(config_dir) if config_dir else DEFAULT_CONFIG_DIR
+        self.config_file = self.config_dir / "config.txt"
+        self.cleanup_config = self.config_dir / "cleanup.txt"
+        self.retention_config = self.config_dir / "retention.txt"
+        self.storage_config = self.config_dir / "storage.txt"
+        self.incremental_config = self.config_dir / "incremental.txt"
+        self.codec_config = self.config_dir / "codec.txt"
+        self.delta_config = self.config_dir / "delta.txt"
+        self.unchanged_config = self.config_dir / "unchanged.txt"
+        self.metrics_export_config = self.config_dir / "metrics-export.txt"
+        self._config_cache = {}
+
+        self._retention_lock = threading.Lock()
+        self._retention_pending = set()
+        self._retention_scheduled = False
+        self._gc_thread = None
+        self._chunk_store = None
+
+        # Background jobs (limited per destination device)
+        self.scheduler = BackupScheduler(max_workers, device_jobs)
+
+        # Index of all backups (opened on first use)
+        self.catalog = BackupCatalog(self.config_dir / "catalog.db")
+
+        # Stats tracking
+        self.stats_file = self.config_dir / "stats.txt"
+        self.stats = StatsAccumulator(self.stats_file)
+
+        # Wall time, bytes and phases of every backup, restore, compare and cleanup
+        self.metrics = MetricsLog(self.config_dir / "metrics.jsonl", self.stats)
+
+    @property
+    def unchanged_mode(self):
+        return self._unchanged[0]
+
+    @unchanged_mode.setter
+    def unchanged_mode(self, mode):
+        self._unchanged = (mode, self.unchanged_hash)
+
+    @property
+    def unchanged_hash(self):
+        return self._unchanged[1]
+
+    @unchanged_hash.setter
+    def unchanged_hash(self, enabled):
+        self._unchanged = (self.unchanged_mode, enabled)
+
+    def close(self):
+        """Wait for background repository cleanup and write pending statistics and metrics"""
+        if self._gc_thread is not None:
+            self._gc_thread.join()
+        self.stats.flush()
+        self.metrics.export()
+
+    @contextlib.contextmanager
+    def measure(self, operation, name):
+        """Record an operation run in this thread in the metrics log
+
+        Yields its OperationMetrics; set status and error there when the
+        operation reports a failure instead of raising. An operation run
+        inside another one counts towards the outer one.
+        """
+        if current_metrics() is not None:
+            yield current_metrics()
+            return
+        metrics = _active_metrics.metrics = OperationMetrics(operation, name)
+        try:
+            yield metrics
+        except BackupCancelled:
+            metrics.status = "cancelled"
+            raise
+        except Exception as e:
+            metrics.status, metrics.error = "failed", str(e)
+            raise
+        finally:
+            _active_metrics.metrics = None
+            try:
+                self.metrics.add(metrics.record(), self.metrics_export)
+            except Exception as e:
+                logger.error(f"Failed to record metrics: {e}")
+
+    def _update_stats(self, file_size):
+        """Update statistics after successful backup"""
+        self.stats.add("total_backups")
+        self.stats.add("total_size", file_size)
+
+    def get_chunk_store(self):
+        """Chunk repository inside the current backup folder"""
+        root = self.backup_folder / STORE_DIRNAME
+        if self._chunk_store is None or self._chunk_store.root != root:
+            self._chunk_store = ChunkStore(root)
+        return self._chunk_store
+
+    def is_manifest_backup(self, path):
+        """Check if a backup was written in repository mode"""
+        return path.name.endswith(MANIFEST_SUFFIX)
+
+    def _count_copy_method(self, method):
+        """Track which copy path single-file backups take"""
+        self.stats.add(method, group="copy_methods")
+
+    def is_backup_file(self, path):
+        """Check if filename matches backup pattern"""
+        return ('_backup_' in path.name and BACKUP_STAMP_RE.search(path.name)
+                and not is_index_sidecar(path.name) and not is_signature_sidecar(path.name))
+
+    def generate_backup_name(self, source_path, counter=None):
+        """Generate timestamped backup filename (counter, if given, is added to the timestamp)"""
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        if counter:
+            timestamp += f"-{counter}"
+
+        if self.repository_mode:
+            # Manifest pointing into the chunk repository
+            if source_path.is_dir():
+                return f"{source_path.name}_backup_{timestamp}{MANIFEST_SUFFIX}"
+            return f"{source_path.stem}_backup_{timestamp}{source_path.suffix}{MANIFEST_SUFFIX}"
+
+        if source_path.is_dir():
+            return f"{source_path.name}_backup_{timestamp}{self.codec.extension}"
+        else:
+            stem = source_path.stem
+            suffix = source_path.suffix
+            return f"{stem}_backup_{timestamp}{suffix}"
+
+    def unique_backup_name(self, source_path, dest_dir, taken=()):
+        """generate_backup_name, counted up (-2, -3, ...) past names in taken or already in dest_dir
+
+        Backups of same-named items made in the same second would otherwise
+        overwrite each other. A name is also taken when its delta exists.
+        """
+        name = self.generate_backup_name(source_path)
+        counter = 1
+        while (name in taken or (dest_dir / name).exists()
+               or (dest_dir / f"{name}{DELTA_SUFFIX}").exists()):
+            counter += 1
+            name = self.generate_backup_name(source_path, counter)
+        return name
+
+    def get_original_filename(self, backup_path):
+        """Extract original filename from backup filename"""
+        if self.is_manifest_backup(backup_path):
+            # name_backup_TS.ext.nbk (file) or name_backup_TS.nbk (folder)
+            match = BACKUP_NAME_RE.match(backup_path.name[:-len(MANIFEST_SUFFIX)])
+            return match.group(1) + match.group(2) if match else None
+        if backup_path.name.endswith(DELTA_SUFFIX):
+            match = BACKUP_NAME_RE.match(backup_path.name[:-len(DELTA_SUFFIX)])
+            return match.group(1) + match.group(2) if match else None
+
+        match = BACKUP_NAME_RE.match(backup_path.name)
+        if match:
+            if self.is_folder_archive(backup_path):
+                # It's a folder backup
+                return match.group(1)
+            else:
+                # It's a file backup
+                return match.group(1) + match.group(2)
+        return None
+
+    def has_archive_name(self, backup_path):
+        """Whether a backup is named like a folder archive (no file access)"""
+        match = BACKUP_NAME_RE.match(backup_path.name)
+        return bool(match) and archive_suffix(match.group(2)) == match.group(2)
+
+    def is_folder_archive(self, backup_path):
+        """Check if a backup is a folder archive (.tar, .tar.gz, .tar.zst, .tar.xz)"""
+        match = BACKUP_NAME_RE.match(backup_path.name)
+        if not match or archive_suffix(match.group(2)) != match.group(2):
+            return False
+        if match.group(2) != Codec.extension:
+            return True
+
+        # A backed-up "name.tar" file looks like an uncompressed folder backup
+        try:
+            with tarfile.open(backup_path, "r:") as tar:
+                member = tar.next()
+                top = member.name.split('/')[0] if member else None
+                return top in (match.group(1), INCREMENT_MEMBER)
+        except (OSError, tarfile.TarError):
+            return False
+
+    def is_large(self, source):
+        """Whether backing up source takes long enough to want progress reports"""
+        return source.is_dir() or (source.is_file() and source.stat().st_size > LARGE_BACKUP_SIZE)
+
+    def create_backup(self, source, destination, job=None):
+        """Create backup of file or folder
+
+        When run from a scheduler job, the copy loops check for cancellation
+        and report bytes and files done to job.progress. The backup is hashed
+        as it is written and the checksum stored with it. A source unchanged
+        since its last backup is linked or skipped (see unchanged_mode).
+        Recorded in the metrics log.
+
+        The backup isn't always written to destination: a delta gets
+        DELTA_SUFFIX appended, and a skipped unchanged source is its previous
+        backup. Report and clean up the returned path.
+
+        Returns:
+            tuple: (success, error message or None, path of the backup or None)
+        """
+        with self.measure("backup", source.name) as metrics:
+            success, error, path = self._create_backup(source, destination, job)
+            if not success:
+                metrics.status = "cancelled" if error == "Cancelled" else "failed"
+                metrics.error = error
+            return success, error, path
+
+    def _create_backup(self, source, destination, job):
+        progress = job.checkpoint if job else None
+        on_file = job.progress.file_done if job else None
+        codec_spec = None
+        hasher = new_checksum()
+        manifest = self.is_manifest_backup(destination)
+        incremental = not manifest and source.is_dir() and self.incremental_mode
+        # The backup file being written, removed if the backup doesn't finish
+        partial = None
+        try:
+            # The backup folder is only created (and its disk woken) when written to
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            state = totals = content = None
+            if self.unchanged_mode != "off":
+                state, totals = source_state(source)
+                previous, content = self._unchanged_since(source, destination, state)
+                if previous:
+                    return self._backup_unchanged(source, destination, previous, state, content)
+
+            if job and not incremental:
+                # Incremental archives report their own (smaller) totals
+                job.progress.set_totals(*(totals or measure_tree(source)))
+
+            partial = destination
+            if manifest:
+                # Repository mode: only new chunks and the manifest hit the disk
+                file_size = self.get_chunk_store().backup(source, destination, progress, on_file, hasher)
+                kind = "manifest"
+            elif incremental:
+                # Only changed entries since the previous archive of this folder
+                archiver = IncrementalArchiver(
+                    self.config_dir / "snapshots",
+                    hash_files=self.incremental_mode == "hash",
+                    codec=self.codec
+                )
+                archiver.create(source, destination, progress,
+                                on_plan=job.progress.set_totals if job else None, on_file=on_file,
+                                hasher=hasher)
+                file_size = destination.stat().st_size
+                kind, codec_spec = "archive", self.codec.spec
+            elif source.is_dir():
+                # Create compressed archive for folders (on all cores)
+                codec = codec_for_path(destination, self.codec)
+                with open_tar_writer(destination, codec, progress=progress, index=True, hasher=hasher) as tar:
+                    add_tree(tar, source, source.name, on_file)
+                file_size = destination.stat().st_size
+                kind, codec_spec = "archive", codec.spec
+            elif self.delta_mode and source.stat().st_size >= DELTA_MIN_SIZE:
+                # Large file: only the chunks its last full backup lacks
+                base = self._delta_base(source, destination)
+                literal = None
+                if base:
+                    delta_path = partial = destination.with_name(destination.name + DELTA_SUFFIX)
+                    literal = write_delta(source, delta_path, base, progress, hasher,
+                                          max_literal=source.stat().st_size * DELTA_REBASE_RATIO)
+                    partial = destination
+                if literal is not None:
+                    logger.info(f"Delta of {source.name}: {format_size(literal)} new against {base.name}")
+                    destination = partial = delta_path
+                    kind = "delta"
+                else:
+                    # First or re-based full backup
+                    if base:
+                        # The delta was given up, start over
+                        hasher = new_checksum()
+                        if job:
+                            job.progress.set_totals(job.progress.bytes_done + source.stat().st_size, 1)
+                    copy_file_signed(source, destination, progress, hasher)
+                    kind = "file"
+                if on_file:
+                    on_file(source.name)
+                file_size = destination.stat().st_size
+            else:
+                # Copy file with metadata (reflink/in-kernel copy when possible)
+                method = copy_file(source, destination, progress, hasher)
+                if on_file:
+                    on_file(source.name)
+                logger.info(f"Copied {source.name} via {method}")
+                file_size = destination.stat().st_size
+                kind = "file"
+                self._count_copy_method(method)
+
+            checksum = format_checksum(hasher)
+            store_checksum(destination, checksum)
+            if self.unchanged_hash and content is None:
+                # A plain copy's checksum is the hash of the source's bytes
+                content = checksum if kind == "file" else source_content_hash(source)
+
+            # Update statistics
+            self._update_stats(file_size)
+            self._record_backup(source, destination, kind, file_size, codec_spec, checksum, state, content)
+
+            partial = None
+            return True, None, destination
+        except BackupCancelled:
+            return False, "Cancelled", None
+        except Exception as e:
+            return False, str(e), None
+        finally:
+            if partial:
+                self._remove_partial_backup(partial)
+
+    def _remove_partial_backup(self, path):
+        """Delete a backup that didn't finish, with its sidecars, so it's never taken for a good one"""
+        for leftover in (path, index_path_for(path), signature_path_for(path)):
+            try:
+                leftover.unlink(missing_ok=True)
+            except OSError as e:
+                logger.error(f"Failed to remove partial backup {leftover}: {e}")
+
+    def _record_backup(self, source, destination, kind, size, codec=None, checksum=None,
+                       state=None, content=None, same_as=None):
+        """Add a finished backup to the catalog (a catalog error never fails the backup)"""
+        try:
+            self.catalog.record(source.resolve(), destination, kind, size, codec=codec, checksum=checksum,
+                                source_state=state, source_hash=content, same_as=same_as)
+        except Exception as e:
+            logger.error(f"Failed to record {destination.name} in catalog: {e}")
+
+    def _unchanged_since(self, source, destination, state):
+        """Last backup of source in destination's folder, if source hasn't changed since
+
+        Only a backup with the same kind of name (extension, codec, storage
+        mode) counts. With hash checking, a source whose fingerprint changed
+        is hashed and compared by content.
+
+        Returns:
+            tuple: (catalog row or None, content hash if one is known)
+        """
+        try:
+            rows = self.catalog.backups_in(destination.parent, source.name)
+        except Exception as e:
+            logger.error(f"Catalog lookup failed: {e}")
+            return None, None
+        resolved = str(source.resolve())
+        previous = next((row for row in rows if row["source"] == resolved), None)
+        if previous is None or not previous["source_state"]:
+            return None, None
+
+        previous_path = Path(previous["destination"])
+        if not self._same_backup_type(previous_path, destination) or not previous_path.exists():
+            return None, None
+
+        if previous["source_state"] == state:
+            return previous, previous["source_hash"]
+        if self.unchanged_hash:
+            content = source_content_hash(source)
+            return (previous if content == previous["source_hash"] else None), content
+        return None, None
+
+    def _same_backup_type(self, backup_path, destination):
+        """Whether an existing backup has the extension a new backup named destination gets"""
+        name = backup_path.name
+        old_name = BACKUP_NAME_RE.match(name[:-len(DELTA_SUFFIX)] if name.endswith(DELTA_SUFFIX) else name)
+        new_name = BACKUP_NAME_RE.match(destination.name)
+        return bool(old_name and new_name) and old_name.group(2) == new_name.group(2)
+
+    def _delta_base(self, source, destination):
+        """Full backup in destination's folder to write a delta of source against
+
+        None means a full backup is due: there is no full backup with a
+        signature yet, or DELTA_MAX_CHAIN deltas were made against it.
+        """
+        resolved = str(source.resolve())
+        deltas = 0
+        for row in self.catalog.backups_in(destination.parent, source.name):
+            if row["source"] != resolved:
+                continue
+            if row["kind"] == "delta":
+                deltas += 1
+                if deltas >= DELTA_MAX_CHAIN:
+                    return None
+                continue
+
+            path = Path(row["destination"])
+            if (row["kind"] != "file" or not self._same_backup_type(path, destination)
+                    or not signature_path_for(path).exists() or not path.exists()):
+                return None
+            return path
+        return None
+
+    def _backup_unchanged(self, source, destination, previous, state, content):
+        """Add an unchanged source's new version as a link to its last backup (or skip it)"""
+        self.stats.add("unchanged_backups")
+        previous_path = Path(previous["destination"])
+        if previous["kind"] == "delta":
+            destination = destination.with_name(destination.name + DELTA_SUFFIX)
+        if self.unchanged_mode == "link" and link_backup(previous_path, destination):
+            if previous["kind"] == "manifest":
+                # Keep the chunks alive if the original manifest is removed
+                ChunkStore(load_manifest(destination)["store"]).register(destination)
+            self._record_backup(source, destination, previous["kind"], previous["size"], previous["codec"],
+                                previous["checksum"], state, content, same_as=previous_path)
+            logger.info(f"{source.name} unchanged, {destination.name} links to {previous_path.name}")
+            return True, None, destination
+        logger.info(f"{source.name} unchanged since {previous_path.name}, skipped")
+        return True, None, previous_path
+
+    def identify_backup(self, path):
+        """(original name, kind) of a backup file found on disk, for the catalog"""
+        if not self.is_backup_file(path):
+            return None
+        original_name = self.get_original_filename(path)
+        if not original_name:
+            return None
+        if self.is_manifest_backup(path):
+            return original_name, "manifest"
+        if path.name.endswith(DELTA_SUFFIX):
+            return original_name, "delta"
+        return original_name, "archive" if self.is_folder_archive(path) else "file"
+
+    def index_folder(self, directory):
+        """Reconcile the catalog with one folder's backups, returns (added, removed)"""
+        added, removed = self.catalog.reconcile(directory, self.identify_backup)
+        if added or removed:
+            logger.info(f"Catalog: {added} backup(s) added, {removed} removed in {directory}")
+        return added, removed
+
+    def known_folders(self):
+        """Every folder the catalog has backups in, plus the backup folder"""
+        return sorted(set(self.catalog.known_dirs()) | {self.backup_folder})
+
+    def original_path(self, backup_path, original_name):
+        """Where the source of a backup lives (from the catalog, else next to the backup)"""
+        try:
+            entry = self.catalog.find(backup_path)
+        except Exception as e:
+            logger.error(f"Catalog lookup failed: {e}")
+            entry = None
+        if entry and Path(entry["source"]).name == original_name:
+            return Path(entry["source"])
+        return backup_path.parent / original_name
+
+    def restore(self, backup_path, target_dir=None, progress=None):
+        """Put the file or folder a backup holds back into target_dir
+
+        target_dir defaults to the folder the source was backed up from. An
+        existing file or folder of the same name is overwritten.
+
+        Returns:
+            Path: restored file or folder
+        """
+        with self.measure("restore", backup_path.name):
+            return self._restore(backup_path, target_dir, progress)
+
+    def _restore(self, backup_path, target_dir, progress):
+        original_name = self.get_original_filename(backup_path)
+        if not original_name:
+            raise ValueError(f"{backup_path.name} doesn't appear to be a backup file")
+        if target_dir is None:
+            target_dir = self.original_path(backup_path, original_name).parent
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.is_manifest_backup(backup_path):
+            # Rebuild file or folder from the chunk repository
+            manifest = load_manifest(backup_path)
+            return ChunkStore(manifest["store"]).restore(manifest, target_dir)
+        if backup_path.name.endswith(DELTA_SUFFIX):
+            # Stream the full backup through the delta
+            return restore_delta(backup_path, target_dir / original_name, progress)
+        if self.is_folder_archive(backup_path):
+            # Extract folder from archive (replaying increments if any)
+            restore_archive_chain(backup_path, target_dir)
+            return target_dir / original_name
+        # Copy file back
+        copy_file(backup_path, target_dir / original_name, progress)
+        return target_dir / original_name
+
+    def compare(self, archive_path, source):
+        """compare_archive(), recorded in the metrics log"""
+        with self.measure("compare", Path(source).name):
+            return compare_archive(archive_path, source)
+
+    def retention_policy(self):
+        """Rules from the keep-last setting (cleanup.txt) and retention.txt"""
+        return parse_retention(self.retention_spec, keep_last=self.max_backups)
+
+    def cleanup_old_backups(self, new_backup_path):
+        """Schedule a retention pass over the folder a backup was written to
+
+        Nothing is deleted here: folders touched by a burst of backups are
+        pruned together, RETENTION_DELAY seconds later, in one low-priority
+        scheduler job.
+        """
+        if not self.retention_policy().active:
+            return
+        with self._retention_lock:
+            self._retention_pending.add(new_backup_path.parent)
+            if self._retention_scheduled:
+                return
+            self._retention_scheduled = True
+        self._schedule_retention()
+
+    def _schedule_retention(self):
+        """Call _start_retention after RETENTION_DELAY (the extension uses a GLib timeout)"""
+        timer = threading.Timer(RETENTION_DELAY, self._start_retention)
+        timer.daemon = True
+        timer.start()
+
+    def _start_retention(self):
+        """Queue the pending retention pass"""
+        def do_prune(job):
+            self.prune_pending(job.checkpoint)
+            return True, None
+
+        self.scheduler.submit(do_prune, "Remove old backups", self.backup_folder / "retention",
+                              priority=PRIORITY_LOW)
+        return False
+
+    def prune_pending(self, checkpoint=None):
+        """Apply retention now to the folders cleanup_old_backups collected, returns the number deleted"""
+        with self._retention_lock:
+            folders = self._retention_pending
+            self._retention_pending = set()
+            self._retention_scheduled = False
+        return self.apply_retention(folders, checkpoint)
+
+    def apply_retention(self, folders, checkpoint=None):
+        """Delete the backups the retention policy drops in folders
+
+        Decisions come from the catalog alone; archives that kept incremental
+        archives are built on are never deleted. Returns the number deleted.
+        """
+        with self.measure("cleanup", f"{len(folders)} folder(s)") as metrics:
+            count = self._apply_retention(folders, checkpoint)
+            metrics.add(files=count)
+            return count
+
+    def _apply_retention(self, folders, checkpoint):
+        policy = self.retention_policy()
+        count = 0
+        removed_manifest = False
+        for folder in folders:
+            removed = []
+            try:
+                if not self.catalog.is_indexed(folder):
+                    self.index_folder(folder)
+                keep, delete = plan_retention(self.catalog.backups_in_folder(folder), policy)
+                doomed = {row["destination"] for row in delete}
+
+                # Archives that kept incremental backups are built on, and
+                # full backups of kept deltas
+                protected = set()
+                deleting = {row["kind"] for row in delete}
+                for row in keep:
+                    try:
+                        if row["kind"] == "archive" and "archive" in deleting:
+                            bases = archive_chain(row["destination"])[:-1]
+                        elif row["kind"] == "delta" and "file" in deleting:
+                            bases = [delta_base(row["destination"])]
+                        else:
+                            continue
+                    except Exception as e:
+                        logger.warning(f"Broken backup chain for {row['destination']}: {e}")
+                        continue
+                    protected.update(str(path) for path in bases if str(path) in doomed)
+
+                for row in delete:
+                    if checkpoint:
+                        checkpoint()
+                    old_backup = Path(row["destination"])
+                    if row["destination"] in protected:
+                        logger.debug(f"Keeping {old_backup.name}, newer increments depend on it")
+                        continue
+                    try:
+                        old_backup.unlink(missing_ok=True)
+                        index_path_for(old_backup).unlink(missing_ok=True)
+                        signature_path_for(old_backup).unlink(missing_ok=True)
+                        removed.append(old_backup)
+                        removed_manifest |= row["kind"] == "manifest"
+                        logger.info(f"Cleaned up old backup: {old_backup.name}")
+                    except OSError as e:
+                        logger.error(f"Failed to delete {old_backup}: {e}")
+            except BackupCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"Cleanup of {folder} failed: {e}")
+            finally:
+                # One catalog transaction per folder
+                if removed:
+                    self.catalog.remove(removed)
+                count += len(removed)
+
+        if removed_manifest:
+            self._collect_repository_garbage()
+        return count
+
+    def find_backups(self, parent_dir, original_name):
+        """All backups of original_name in parent_dir, newest first
+
+        Answered from the catalog; a folder is scanned only the first time
+        it is seen, to pick up backups made before the catalog existed.
+        """
+        if not self.catalog.is_indexed(parent_dir):
+            self.index_folder(parent_dir)
+
+        backups, missing = [], []
+        for entry in self.catalog.backups_in(parent_dir, original_name):
+            path = Path(entry["destination"])
+            (backups if path.exists() else missing).append(path)
+        if missing:
+            self.catalog.remove(missing)
+        return backups
+
+    def _collect_repository_garbage(self):
+        """Drop unreferenced chunks in the background (close() waits for it)"""
+        store = self.get_chunk_store()
+
+        def do_collect():
+            try:
+                removed = store.collect_garbage()
+                if removed:
+                    logger.info(f"Removed {removed} unreferenced chunk(s) from {store.root}")
+            except Exception as e:
+                logger.error(f"Repository cleanup failed: {e}")
+
+        thread = threading.Thread(target=do_collect)
+        thread.daemon = True
+        thread.start()
+        self._gc_thread = thread
+
+    def verify_entry(self, row, verified_chunks=None, job=None):
+        """verify_backup for one catalog row, returns (status, detail)"""
+        if job and row["kind"] != "manifest":
+            job.progress.set_totals(row["size"], 1)
+        return verify_backup(
+            row["destination"], row["checksum"],
+            # A manifest's catalogued size counts the chunks it added
+            None if row["kind"] == "manifest" else row["size"],
+            verified_chunks, job.checkpoint if job else None
+        )
+
+    def write_verify_report(self, results, cancelled=0):
+        """Write verify-report.txt from (path, status, detail) results
+
+        Returns:
+            tuple: (summary line, [problem results], report path)
+        """
+        problems = [r for r in results if r[1] not in (VERIFY_OK, VERIFY_UNCHECKED)]
+        unchecked = sum(1 for r in results if r[1] == VERIFY_UNCHECKED)
+        report_path = self.config_dir / "verify-report.txt"
+        lines = [f"Backup verification {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                 f"{len(results)} checked, {len(problems)} problem(s), {unchecked} without checksum, "
+                 f"{cancelled} cancelled", ""]
+        lines += [f"{status.upper():10} {path}  {detail}" for path, status, detail in sorted(results)
+                  if status != VERIFY_OK]
+        try:
+            report_path.parent.mkdir(parents=True, exist_ok=True)
+            report_path.write_text("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write {report_path}: {e}")
+        return lines[1], problems, report_path
@@ -6,6 +6,8 @@ set -e
 
 EXTENSION_NAME="nautilus-backup.py"
 INSTALL_DIR="$HOME/.local/share/nautilus-python/extensions"
+LIB_DIR="$HOME/.local/share/nautilus-backup"
+CLI_LINK="$HOME/.local/bin/nautilus-backup"
 CONFIG_DIR="$HOME/.config/nautilus-backup"
 
 echo "============================================================"
@@ -32,8 +34,12 @@ fi
 echo ""
 echo "[INFO] Removing extension..."
 
-# Remove extension file
+# Remove extension file, backup core and command line tool
 rm -f "$INSTALL_DIR/$EXTENSION_NAME"
+rm -rf "$LIB_DIR"
+if [ -L "$CLI_LINK" ]; then
+    rm -f "$CLI_LINK"
+fi
 
 echo "[OK] Extension removed"
 